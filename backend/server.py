@@ -1,34 +1,414 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Request
+from fastapi import FastAPI, APIRouter, HTTPException, Request, Response, BackgroundTasks, Depends, Header, Path as PathParam
+from fastapi.routing import APIRoute
+from fastapi.exceptions import RequestValidationError
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne, DeleteMany, ReturnDocument
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from pymongo import monitoring
 import os
+import io
+import re
+import json
+import csv
+import hashlib
+import unicodedata
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple, TYPE_CHECKING
+from collections import OrderedDict, Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from contextlib import asynccontextmanager, contextmanager, AsyncExitStack
+from bisect import bisect_left
 import uuid
-from datetime import datetime, timedelta
-import stripe
-import httpx
-from emergentintegrations.llm.chat import LlmChat, UserMessage
+import time
+import asyncio
+import sys
+import random
+import hmac
+import threading
+import sqlite3
+import math
+import zlib
+import bson
+from datetime import datetime, timedelta, date
+
+# Heavy SDKs (emergentintegrations, stripe, httpx, numpy) are imported on first
+# use so worker start-up stays fast; see tests/test_startup.py
+if TYPE_CHECKING:
+    import httpx
+
+try:
+    import yaml
+except ImportError:  # YAML content packs are optional
+    yaml = None
+try:
+    import zstandard
+except ImportError:  # archived chats fall back to zlib
+    zstandard = None
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# MongoDB connection (opened in the lifespan handler)
+client: Optional[AsyncIOMotorClient] = None
+db = None
+MONGO_WARM_CONNECTIONS = int(os.environ.get('MONGO_WARM_CONNECTIONS', '4'))
+
+# Set once start-up warm-up (indexes, connections, catalogs) has finished
+app_ready = asyncio.Event()
+# A failed warm-up is retried, waiting twice as long each time up to the maximum
+WARM_UP_RETRY_SECONDS = float(os.environ.get('WARM_UP_RETRY_SECONDS', '1'))
+WARM_UP_RETRY_MAX_SECONDS = float(os.environ.get('WARM_UP_RETRY_MAX_SECONDS', '60'))
+
+# Outbound HTTP client (created on startup, shared by all requests)
+HTTP_MAX_CONNECTIONS = int(os.environ.get('HTTP_MAX_CONNECTIONS', '100'))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get('HTTP_MAX_KEEPALIVE_CONNECTIONS', '20'))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get('HTTP_KEEPALIVE_EXPIRY', '30'))
+HTTP_TIMEOUT = float(os.environ.get('HTTP_TIMEOUT', '10'))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', '5'))
+HTTP2_ENABLED = os.environ.get('HTTP2_ENABLED', 'false').lower() == 'true'
+http_client: Optional["httpx.AsyncClient"] = None
+
+# Weather cache (Open-Meteo refreshes current conditions every 15 minutes)
+WEATHER_GRID_DEGREES = float(os.environ.get('WEATHER_GRID_DEGREES', '0.1'))
+WEATHER_CACHE_TTL_SECONDS = int(os.environ.get('WEATHER_CACHE_TTL_SECONDS', '900'))
+WEATHER_CACHE_MAX_ENTRIES = int(os.environ.get('WEATHER_CACHE_MAX_ENTRIES', '10000'))
+WEATHER_STALE_SECONDS = int(os.environ.get('WEATHER_STALE_SECONDS', '21600'))  # serve stale up to 6h past TTL
+WEATHER_TIMEOUT_SECONDS = float(os.environ.get('WEATHER_TIMEOUT_SECONDS', '3'))
+WEATHER_BREAKER_FAILURES = int(os.environ.get('WEATHER_BREAKER_FAILURES', '5'))
+WEATHER_BREAKER_RESET_SECONDS = float(os.environ.get('WEATHER_BREAKER_RESET_SECONDS', '30'))
+WEATHER_ARCHIVE_AFTER_DAYS = 5  # Open-Meteo archive lags real time by a few days
+WEATHER_BACKFILL_BATCH_LOCATIONS = int(os.environ.get('WEATHER_BACKFILL_BATCH_LOCATIONS', '50'))
+WEATHER_BACKFILL_REQUEST_INTERVAL = float(os.environ.get('WEATHER_BACKFILL_REQUEST_INTERVAL', '1'))
+
+# ============== METRICS ==============
+
+# Upper bounds in seconds; one extra slot holds +Inf
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+MONGO_COMMAND_NAMES = (
+    "find", "getMore", "insert", "update", "delete", "findAndModify",
+    "aggregate", "count", "distinct", "createIndexes", "ping",
+)
+EXTERNAL_SERVICES = ("llm", "weather", "stripe")
 
-# Stripe configuration
-stripe.api_key = os.environ.get('STRIPE_SECRET_KEY')
+class Histogram:
+    """Fixed-bucket histogram; observe() is a bisect and two in-place adds.
 
-# Create the main app
-app = FastAPI(title="Ágora Mujeres API", description="API for emotional companion app")
+    Counts are kept per bucket and made cumulative only when rendered, so
+    there is nothing to lock: on the event loop nothing interleaves, and a
+    lost increment from a driver thread would only skew one sample.
+    """
+    __slots__ = ("counts", "total")
+    
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+    
+    def observe(self, seconds: float):
+        self.counts[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.total += seconds
+    
+    def render(self, name: str, labels: str) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_sum{{{labels}}} {self.total:.6f}')
+        lines.append(f'{name}_count{{{labels}}} {cumulative}')
+        return lines
+
+class RouteMetrics:
+    __slots__ = ("method", "path", "latency", "in_flight", "statuses")
+    
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.latency = Histogram()
+        self.in_flight = 0
+        self.statuses: Dict[int, int] = {}
+
+route_metrics: Dict[Tuple[str, str], RouteMetrics] = {}
+mongo_command_metrics = {name: Histogram() for name in MONGO_COMMAND_NAMES}
+mongo_command_failures = {name: 0 for name in MONGO_COMMAND_NAMES}
+external_call_metrics = {service: Histogram() for service in EXTERNAL_SERVICES}
+external_call_failures = {service: 0 for service in EXTERNAL_SERVICES}
+rate_limit_counters = {"rejected": 0, "fail_open": 0}
+
+class TimedRoute(APIRoute):
+    """APIRoute that records latency, in-flight requests and status codes.
+
+    Metrics are allocated once per route when it is registered, so the
+    request path never creates label sets. include_router() copies each
+    route; the copy shares the original's metrics.
+    """
+    
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+        key = (",".join(sorted(self.methods)), self.path)
+        metrics = route_metrics.setdefault(key, RouteMetrics(*key))
+        
+        async def timed_handler(request: Request) -> Response:
+            metrics.in_flight += 1
+            started = time.perf_counter()
+            status = 500
+            try:
+                response = await handler(request)
+                status = response.status_code
+                return response
+            except HTTPException as e:
+                status = e.status_code
+                raise
+            except RequestValidationError:
+                # Turned into a 422 response by FastAPI's default handler
+                status = 422
+                raise
+            finally:
+                metrics.latency.observe(time.perf_counter() - started)
+                metrics.in_flight -= 1
+                metrics.statuses[status] = metrics.statuses.get(status, 0) + 1
+        
+        return timed_handler
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """PyMongo command monitoring feeding the per-command histograms"""
+    
+    def started(self, event):
+        pass
+    
+    def succeeded(self, event):
+        histogram = mongo_command_metrics.get(event.command_name)
+        if histogram is None:
+            histogram = mongo_command_metrics.setdefault(event.command_name, Histogram())
+        histogram.observe(event.duration_micros / 1e6)
+    
+    def failed(self, event):
+        self.succeeded(event)
+        mongo_command_failures[event.command_name] = mongo_command_failures.get(event.command_name, 0) + 1
+
+@contextmanager
+def track_external_call(service: str):
+    """Time a call to the LLM, Open-Meteo or Stripe"""
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        external_call_failures[service] += 1
+        raise
+    finally:
+        external_call_metrics[service].observe(time.perf_counter() - started)
+
+def render_metrics() -> str:
+    """All metrics in the Prometheus text exposition format"""
+    lines = [
+        "# HELP http_request_duration_seconds Request latency by route",
+        "# TYPE http_request_duration_seconds histogram",
+    ]
+    for metrics in route_metrics.values():
+        labels = f'method="{metrics.method}",route="{metrics.path}"'
+        lines.extend(metrics.latency.render("http_request_duration_seconds", labels))
+    
+    lines += [
+        "# HELP http_requests_in_flight Requests currently being handled by route",
+        "# TYPE http_requests_in_flight gauge",
+    ]
+    for metrics in route_metrics.values():
+        lines.append(f'http_requests_in_flight{{method="{metrics.method}",route="{metrics.path}"}} {metrics.in_flight}')
+    
+    lines += [
+        "# HELP http_requests_total Completed requests by route and status",
+        "# TYPE http_requests_total counter",
+    ]
+    for metrics in route_metrics.values():
+        for status, count in sorted(metrics.statuses.items()):
+            lines.append(
+                f'http_requests_total{{method="{metrics.method}",route="{metrics.path}",status="{status}"}} {count}'
+            )
+    
+    lines += [
+        "# HELP mongodb_command_duration_seconds MongoDB command latency",
+        "# TYPE mongodb_command_duration_seconds histogram",
+    ]
+    for name, histogram in list(mongo_command_metrics.items()):
+        lines.extend(histogram.render("mongodb_command_duration_seconds", f'command="{name}"'))
+    lines += [
+        "# HELP mongodb_command_failures_total Failed MongoDB commands",
+        "# TYPE mongodb_command_failures_total counter",
+    ]
+    for name, count in list(mongo_command_failures.items()):
+        lines.append(f'mongodb_command_failures_total{{command="{name}"}} {count}')
+    
+    lines += [
+        "# HELP external_call_duration_seconds Outbound call latency by service",
+        "# TYPE external_call_duration_seconds histogram",
+    ]
+    for service, histogram in external_call_metrics.items():
+        lines.extend(histogram.render("external_call_duration_seconds", f'service="{service}"'))
+    lines += [
+        "# HELP external_call_failures_total Failed outbound calls by service",
+        "# TYPE external_call_failures_total counter",
+    ]
+    for service, count in external_call_failures.items():
+        lines.append(f'external_call_failures_total{{service="{service}"}} {count}')
+    
+    lines += [
+        "# HELP rate_limit_rejected_total Requests answered 429 by the rate limiter",
+        "# TYPE rate_limit_rejected_total counter",
+        f'rate_limit_rejected_total {rate_limit_counters["rejected"]}',
+        "# HELP rate_limit_fail_open_total Requests let through because the bucket store was unavailable",
+        "# TYPE rate_limit_fail_open_total counter",
+        f'rate_limit_fail_open_total {rate_limit_counters["fail_open"]}',
+    ]
+    
+    return "\n".join(lines) + "\n"
+
+# ============== RATE LIMITING ==============
+
+# Requests per minute per device and route; the bucket holds a full minute's burst
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+RATE_LIMIT_DEFAULT_PER_MINUTE = int(os.environ.get('RATE_LIMIT_DEFAULT_PER_MINUTE', '120'))
+RATE_LIMITS_PER_MINUTE = {
+    "POST /api/chat": int(os.environ.get('RATE_LIMIT_CHAT_PER_MINUTE', '10')),
+    "POST /api/diary": int(os.environ.get('RATE_LIMIT_DIARY_PER_MINUTE', '30')),
+}
+# A bucket idle this long has refilled completely, so dropping it changes nothing
+RATE_LIMIT_IDLE_SECONDS = int(os.environ.get('RATE_LIMIT_IDLE_SECONDS', '600'))
+RATE_LIMIT_EVICT_INTERVAL_SECONDS = int(os.environ.get('RATE_LIMIT_EVICT_INTERVAL_SECONDS', '60'))
+# How long a check waits for another worker's write lock before failing open
+RATE_LIMIT_LOCK_TIMEOUT = float(os.environ.get('RATE_LIMIT_LOCK_TIMEOUT', '0.5'))
+# On tmpfs when available; every uvicorn worker on the host opens the same file
+RATE_LIMIT_DB = os.environ.get(
+    'RATE_LIMIT_DB',
+    '/dev/shm/agora-rate-limits.sqlite3' if os.path.isdir('/dev/shm') else str(ROOT_DIR / 'rate_limits.sqlite3')
+)
+
+class TokenBucketStore:
+    """Token buckets kept in a SQLite file shared by all worker processes.
+
+    One row per (device, route) bucket. Each check is a short write
+    transaction, so concurrent workers see a consistent token count.
+    The connection is opened lazily, after uvicorn has forked its workers.
+    Methods block (on the file lock, up to lock_timeout) and are called
+    from worker threads; a lock serializes them on the one connection.
+    """
+    
+    def __init__(self, path: str, lock_timeout: float = RATE_LIMIT_LOCK_TIMEOUT):
+        self.path = path
+        self.lock_timeout = lock_timeout
+        self.conn: Optional[sqlite3.Connection] = None
+        self.lock = threading.Lock()
+    
+    def connect(self) -> sqlite3.Connection:
+        if self.conn is None:
+            conn = sqlite3.connect(
+                self.path, timeout=self.lock_timeout, isolation_level=None, check_same_thread=False
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")  # losing buckets on a crash only resets limits
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets "
+                "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL) WITHOUT ROWID"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS buckets_updated ON buckets (updated)")
+            self.conn = conn
+        return self.conn
+    
+    def take(self, key: str, capacity: float, per_second: float) -> float:
+        """Take one token; return 0 if allowed, else seconds until a token is available"""
+        with self.lock:
+            conn = self.connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Read the clock inside the transaction so updates stay in commit order
+                now = time.time()
+                row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+                tokens = capacity if row is None else min(capacity, row[0] + max(0.0, now - row[1]) * per_second)
+                if tokens < 1:
+                    conn.execute("COMMIT")
+                    return (1 - tokens) / per_second
+                conn.execute(
+                    "INSERT INTO buckets (key, tokens, updated) VALUES (?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+                    (key, tokens - 1, now)
+                )
+                conn.execute("COMMIT")
+                return 0.0
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+    
+    def evict_idle(self, idle_seconds: float) -> int:
+        with self.lock:
+            cursor = self.connect().execute("DELETE FROM buckets WHERE updated < ?", (time.time() - idle_seconds,))
+            return cursor.rowcount
+    
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+rate_limiter = TokenBucketStore(RATE_LIMIT_DB)
+
+async def request_device_id(request: Request) -> Optional[str]:
+    """Device id from the path, the query string or a JSON body"""
+    device_id = request.path_params.get("device_id") or request.query_params.get("device_id")
+    if device_id is None and request.method in ("POST", "PUT", "PATCH"):
+        try:
+            body = await request.json()  # cached by Starlette; the endpoint reuses it
+        except ValueError:
+            return None
+        if isinstance(body, dict) and isinstance(body.get("device_id"), str):
+            device_id = body["device_id"]
+    return device_id
+
+async def enforce_rate_limit(request: Request):
+    """Router dependency: per-device, per-route token bucket"""
+    if not RATE_LIMIT_ENABLED:
+        return
+    device_id = await request_device_id(request)
+    if not device_id:
+        return
+    
+    route = f"{request.method} {request.scope['route'].path}"
+    per_minute = RATE_LIMITS_PER_MINUTE.get(route, RATE_LIMIT_DEFAULT_PER_MINUTE)
+    try:
+        wait = await asyncio.to_thread(rate_limiter.take, f"{device_id}|{route}", per_minute, per_minute / 60)
+    except sqlite3.Error as e:
+        # Fail open: a locked or broken store must not take the API down
+        rate_limit_counters["fail_open"] += 1
+        logger.warning(f"Rate limit store unavailable: {e}")
+        return
+    if wait > 0:
+        rate_limit_counters["rejected"] += 1
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests",
+            headers={"Retry-After": str(math.ceil(wait))}
+        )
+
+async def run_rate_limit_evictor():
+    """Periodically drop idle buckets until cancelled"""
+    while True:
+        await asyncio.sleep(RATE_LIMIT_EVICT_INTERVAL_SECONDS)
+        try:
+            evicted = await asyncio.to_thread(rate_limiter.evict_idle, RATE_LIMIT_IDLE_SECONDS)
+            if evicted:
+                logger.info(f"Evicted {evicted} idle rate limit buckets")
+        except sqlite3.Error as e:
+            logger.warning(f"Could not evict rate limit buckets: {e}")
+
+async def require_admin_code(x_admin_code: Optional[str] = Header(None)):
+    """Dependency for operator endpoints: the admin code in the X-Admin-Code header"""
+    if not x_admin_code or not hmac.compare_digest(x_admin_code, ADMIN_CODE):
+        raise HTTPException(status_code=403, detail="Invalid admin code")
 
 # Create a router with the /api prefix
-api_router = APIRouter(prefix="/api")
+api_router = APIRouter(prefix="/api", route_class=TimedRoute, dependencies=[Depends(enforce_rate_limit)])
 
 # Configure logging
 logging.basicConfig(
@@ -59,6 +439,7 @@ class DiaryEntry(BaseModel):
     emotional_state: EmotionalState = Field(default_factory=EmotionalState)
     physical_state: Optional[PhysicalState] = None
     weather: Optional[Dict[str, Any]] = None
+    location: Optional[Dict[str, float]] = None  # {lat, lon} snapped to the weather grid
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class DiaryEntryCreate(BaseModel):
@@ -67,6 +448,8 @@ class DiaryEntryCreate(BaseModel):
     emotional_state: EmotionalState = Field(default_factory=EmotionalState)
     physical_state: Optional[PhysicalState] = None
     weather: Optional[Dict[str, Any]] = None
+    lat: Optional[float] = Field(default=None, ge=-90, le=90)  # If set and weather is empty, attached server-side
+    lon: Optional[float] = Field(default=None, ge=-180, le=180)
 
 class ChatMessage(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -130,6 +513,11 @@ class MonthlyPainRecordCreate(BaseModel):
     records: List[Dict[str, Any]] = Field(default_factory=list)
     cycle_start_date: str
 
+class MonthlyPainDayUpdate(BaseModel):
+    intensity: int = Field(ge=0, le=5)  # 0 removes the day
+    notes: Optional[str] = None
+    expected_version: Optional[int] = None  # If set, rejected with 409 when the record has changed
+
 # ============== RESOURCE MODELS ==============
 
 class Resource(BaseModel):
@@ -153,6 +541,63 @@ class Resource(BaseModel):
 # Admin code for bypassing trial (set your secret code here)
 ADMIN_CODE = "AGORA2025ADMIN"
 
+# Monthly pain record cycle length
+PAIN_CYCLE_DAYS = 30
+# Days past cycle start kept when archiving; later dates come from wrong client clocks
+PAIN_CYCLE_MAX_DAYS = 90
+
+# Hormonal cycle defaults, used when a device's history can't tell
+DEFAULT_CYCLE_LENGTH_DAYS = 28
+DEFAULT_PERIOD_DAYS = 5
+MAX_CYCLE_LENGTH_DAYS = 45
+CYCLE_STATS_TTL_SECONDS = int(os.environ.get('CYCLE_STATS_TTL_SECONDS', '300'))
+CYCLE_STATS_CACHE_MAX_ENTRIES = int(os.environ.get('CYCLE_STATS_CACHE_MAX_ENTRIES', '10000'))
+
+# Resource catalog snapshots
+RESOURCE_CATALOG_TTL_SECONDS = int(os.environ.get('RESOURCE_CATALOG_TTL_SECONDS', '300'))
+RESOURCE_CACHE_MAX_AGE = int(os.environ.get('RESOURCE_CACHE_MAX_AGE', '60'))
+
+# Content packs (versioned resource catalogs on disk)
+CONTENT_PACKS_DIR = Path(os.environ.get('CONTENT_PACKS_DIR', str(ROOT_DIR / 'data' / 'content_packs')))
+
+# Monthly report rendering
+REPORT_CACHE_DIR = Path(os.environ.get('REPORT_CACHE_DIR', str(ROOT_DIR / 'report_cache')))
+REPORT_WORKERS = int(os.environ.get('REPORT_WORKERS', '2'))
+
+# Request profiler (sampled fraction, or requests sending X-Debug-Profile: <ADMIN_CODE>)
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_INTERVAL_SECONDS = float(os.environ.get('PROFILE_INTERVAL_SECONDS', '0.005'))
+PROFILE_MAX_CONCURRENT = int(os.environ.get('PROFILE_MAX_CONCURRENT', '2'))
+PROFILE_MAX_PER_ROUTE = int(os.environ.get('PROFILE_MAX_PER_ROUTE', '20'))
+PROFILE_DIR = Path(os.environ.get('PROFILE_DIR', str(ROOT_DIR / 'profiles')))
+
+# Home screen batch endpoint
+HOME_SECTION_TIMEOUT_SECONDS = float(os.environ.get('HOME_SECTION_TIMEOUT_SECONDS', '2'))
+
+# Delta sync: max changed documents per collection in one response
+SYNC_PAGE_SIZE = int(os.environ.get('SYNC_PAGE_SIZE', '500'))
+# Change numbers reserved by a write that never finished stop holding back the token after this
+SYNC_RESERVATION_TIMEOUT_SECONDS = int(os.environ.get('SYNC_RESERVATION_TIMEOUT_SECONDS', '120'))
+
+# Chat retention: idle conversations move to the compressed chat_archive collection
+CHAT_ARCHIVE_IDLE_DAYS = int(os.environ.get('CHAT_ARCHIVE_IDLE_DAYS', '90'))
+CHAT_ARCHIVE_BATCH_SIZE = int(os.environ.get('CHAT_ARCHIVE_BATCH_SIZE', '100'))
+CHAT_ARCHIVE_BATCH_PAUSE_SECONDS = float(os.environ.get('CHAT_ARCHIVE_BATCH_PAUSE_SECONDS', '1'))
+CHAT_ARCHIVE_INTERVAL_SECONDS = int(os.environ.get('CHAT_ARCHIVE_INTERVAL_SECONDS', '3600'))
+# Archived conversations idle this long are deleted by a TTL index; 0 keeps them forever
+CHAT_ARCHIVE_TTL_DAYS = int(os.environ.get('CHAT_ARCHIVE_TTL_DAYS', '730'))
+
+# Purge jobs (batched background deletion of device or conversation data)
+PURGE_BATCH_SIZE = int(os.environ.get('PURGE_BATCH_SIZE', '500'))
+PURGE_BATCH_PAUSE_SECONDS = float(os.environ.get('PURGE_BATCH_PAUSE_SECONDS', '0.1'))
+PURGE_MAX_CONCURRENT = int(os.environ.get('PURGE_MAX_CONCURRENT', '2'))
+PURGE_STALE_SECONDS = int(os.environ.get('PURGE_STALE_SECONDS', '300'))  # resume jobs with no progress for this long
+PURGE_RESUME_INTERVAL_SECONDS = int(os.environ.get('PURGE_RESUME_INTERVAL_SECONDS', '60'))
+
+# Trial limits
+TRIAL_LIMIT_SECONDS = 7200  # 2 hours of usage
+TRIAL_SWEEP_INTERVAL_SECONDS = int(os.environ.get('TRIAL_SWEEP_INTERVAL_SECONDS', '60'))
+
 # ============== SYSTEM PROMPTS ==============
 
 SYSTEM_PROMPTS = {
@@ -215,12 +660,22 @@ Always respond in English, briefly and warmly. Maximum 3-4 sentences."""
 # ============== DIARY ENDPOINTS ==============
 
 @api_router.post("/diary", response_model=DiaryEntry)
-async def create_diary_entry(entry: DiaryEntryCreate):
+async def create_diary_entry(entry: DiaryEntryCreate, background_tasks: BackgroundTasks):
     """Create a new diary entry"""
     try:
-        entry_dict = entry.model_dump()
+        entry_dict = entry.model_dump(exclude={"lat", "lon"})
         entry_obj = DiaryEntry(**entry_dict)
-        await db.diary_entries.insert_one(entry_obj.model_dump())
+        if entry.lat is not None and entry.lon is not None:
+            lat, lon = weather_cache.cell(entry.lat, entry.lon)
+            entry_obj.location = {"lat": lat, "lon": lon}
+        async with sync_write(entry.device_id) as sync_seq:
+            await db.diary_entries.insert_one({**entry_obj.model_dump(), **sync_fields(sync_seq)})
+        
+        # Attach weather after responding, so the client needs a single round trip
+        if entry_obj.location and not entry_obj.weather:
+            background_tasks.add_task(
+                attach_weather, entry_obj.id, entry.device_id, entry_obj.location["lat"], entry_obj.location["lon"]
+            )
         
         # Track usage for trial
         await track_usage(entry.device_id, 60)  # 1 minute for creating entry
@@ -242,6 +697,41 @@ async def get_diary_entries(device_id: str, limit: int = 30, offset: int = 0):
         logger.error(f"Error getting diary entries: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def average_states(entries: List[dict]) -> Tuple[Dict[str, float], Optional[Dict[str, float]]]:
+    """Average emotional state over all entries and physical state over entries that have one"""
+    emotional_sums = {"calma": 0, "fatiga": 0, "niebla_mental": 0, "dolor_difuso": 0, "gratitud": 0, "tension": 0}
+    physical_sums = {"nivel_dolor": 0, "energia": 0, "sensibilidad": 0}
+    physical_count = 0
+    
+    for entry in entries:
+        emotional = entry.get("emotional_state", {})
+        for key in emotional_sums:
+            emotional_sums[key] += emotional.get(key, 0)
+        
+        physical = entry.get("physical_state")
+        if physical:
+            physical_count += 1
+            for key in physical_sums:
+                physical_sums[key] += physical.get(key, 0)
+    
+    count = len(entries)
+    emotional_avg = {k: round(v / count, 1) for k, v in emotional_sums.items()}
+    physical_avg = {k: round(v / max(physical_count, 1), 1) for k, v in physical_sums.items()} if physical_count > 0 else None
+    return emotional_avg, physical_avg
+
+def count_common_words(entries: List[dict], limit: int = 10) -> List[Tuple[str, int]]:
+    """Most frequent words longer than three characters in the entries' text"""
+    words_count = {}
+    for entry in entries:
+        texto = entry.get("texto", "")
+        if texto:
+            words = texto.lower().split()
+            for word in words:
+                if len(word) > 3:  # Skip short words
+                    words_count[word] = words_count.get(word, 0) + 1
+    
+    return sorted(words_count.items(), key=lambda x: x[1], reverse=True)[:limit]
+
 @api_router.get("/diary/{device_id}/patterns")
 async def get_patterns(device_id: str, days: int = 7):
     """Analyze patterns from diary entries (local processing)"""
@@ -256,40 +746,14 @@ async def get_patterns(device_id: str, days: int = 7):
             return {"patterns": None, "message": "No hay suficientes datos para analizar patrones"}
         
         # Calculate averages
-        emotional_sums = {"calma": 0, "fatiga": 0, "niebla_mental": 0, "dolor_difuso": 0, "gratitud": 0, "tension": 0}
-        physical_sums = {"nivel_dolor": 0, "energia": 0, "sensibilidad": 0}
-        physical_count = 0
-        
-        for entry in entries:
-            emotional = entry.get("emotional_state", {})
-            for key in emotional_sums:
-                emotional_sums[key] += emotional.get(key, 0)
-            
-            physical = entry.get("physical_state")
-            if physical:
-                physical_count += 1
-                for key in physical_sums:
-                    physical_sums[key] += physical.get(key, 0)
-        
-        count = len(entries)
-        emotional_avg = {k: round(v / count, 1) for k, v in emotional_sums.items()}
-        physical_avg = {k: round(v / max(physical_count, 1), 1) for k, v in physical_sums.items()} if physical_count > 0 else None
+        emotional_avg, physical_avg = average_states(entries)
         
         # Find most common words in text entries
-        words_count = {}
-        for entry in entries:
-            texto = entry.get("texto", "")
-            if texto:
-                words = texto.lower().split()
-                for word in words:
-                    if len(word) > 3:  # Skip short words
-                        words_count[word] = words_count.get(word, 0) + 1
-        
-        common_words = sorted(words_count.items(), key=lambda x: x[1], reverse=True)[:10]
+        common_words = count_common_words(entries)
         
         return {
             "period_days": days,
-            "total_entries": count,
+            "total_entries": len(entries),
             "emotional_averages": emotional_avg,
             "physical_averages": physical_avg,
             "common_words": common_words,
@@ -324,14 +788,12 @@ async def chat_with_aurora(request: ChatRequest):
                 device_id=request.device_id,
                 title=request.message[:50] + "..." if len(request.message) > 50 else request.message
             )
-            await db.chat_conversations.insert_one(new_conv.model_dump())
+            async with sync_write(request.device_id) as sync_seq:
+                await db.chat_conversations.insert_one({**new_conv.model_dump(), **sync_fields(sync_seq)})
             conversation_id = new_conv.id
-        else:
-            # Update conversation timestamp
-            await db.chat_conversations.update_one(
-                {"id": conversation_id},
-                {"$set": {"updated_at": datetime.utcnow()}}
-            )
+        elif not await db.chat_conversations.count_documents({"id": conversation_id}, limit=1):
+            # An archived conversation is brought back first
+            await rehydrate_conversation(request.device_id, conversation_id)
         
         # Get conversation history for this specific conversation
         history = await db.chat_messages.find(
@@ -343,6 +805,8 @@ async def chat_with_aurora(request: ChatRequest):
         api_key = os.environ.get('EMERGENT_LLM_KEY')
         system_prompt = SYSTEM_PROMPTS.get(request.language, SYSTEM_PROMPTS["es"])
         
+        from emergentintegrations.llm.chat import LlmChat, UserMessage
+        
         chat = LlmChat(
             api_key=api_key,
             session_id=f"aurora_{request.device_id}_{conversation_id}",
@@ -353,7 +817,8 @@ async def chat_with_aurora(request: ChatRequest):
         user_msg = UserMessage(text=request.message)
         
         # Get response
-        response = await chat.send_message(user_msg)
+        with track_external_call("llm"):
+            response = await chat.send_message(user_msg)
         
         # Save messages with conversation_id
         user_message = ChatMessage(
@@ -369,8 +834,12 @@ async def chat_with_aurora(request: ChatRequest):
             content=response
         )
         
-        await db.chat_messages.insert_one(user_message.model_dump())
-        await db.chat_messages.insert_one(assistant_message.model_dump())
+        # Stamped once the reply is in, so the LLM call doesn't hold back /sync tokens
+        async with sync_write(request.device_id) as sync_seq:
+            stamp = sync_fields(sync_seq)
+            await db.chat_conversations.update_one({"id": conversation_id}, {"$set": stamp})
+            await db.chat_messages.insert_one({**user_message.model_dump(), **stamp})
+            await db.chat_messages.insert_one({**assistant_message.model_dump(), **stamp})
         
         # Track usage
         await track_usage(request.device_id, 30)  # 30 seconds per chat
@@ -390,9 +859,17 @@ async def chat_with_aurora(request: ChatRequest):
 async def get_conversations(device_id: str, limit: int = 20):
     """Get all conversations for a device"""
     try:
-        conversations = await db.chat_conversations.find(
-            {"device_id": device_id}
-        ).sort("updated_at", -1).limit(limit).to_list(limit)
+        conversations, archived = await asyncio.gather(
+            db.chat_conversations.find(
+                {"device_id": device_id}
+            ).sort("updated_at", -1).limit(limit).to_list(limit),
+            # Archived conversations are listed too; opening one rehydrates it
+            db.chat_archive.find(
+                {"device_id": device_id}, {"messages": 0}
+            ).sort("updated_at", -1).limit(limit).to_list(limit)
+        )
+        if archived:
+            conversations = sorted(conversations + archived, key=lambda c: c["updated_at"], reverse=True)[:limit]
         
         return [{
             "id": c["id"],
@@ -411,6 +888,10 @@ async def get_conversation_messages(device_id: str, conversation_id: str, limit:
         messages = await db.chat_messages.find(
             {"device_id": device_id, "conversation_id": conversation_id}
         ).sort("created_at", 1).limit(limit).to_list(limit)
+        if not messages and await rehydrate_conversation(device_id, conversation_id):
+            messages = await db.chat_messages.find(
+                {"device_id": device_id, "conversation_id": conversation_id}
+            ).sort("created_at", 1).limit(limit).to_list(limit)
         
         return [{
             "role": m["role"], 
@@ -423,13 +904,14 @@ async def get_conversation_messages(device_id: str, conversation_id: str, limit:
 
 @api_router.delete("/chat/{device_id}/conversation/{conversation_id}")
 async def delete_conversation(device_id: str, conversation_id: str):
-    """Delete a specific conversation and its messages"""
+    """Delete a specific conversation; its messages are purged in the background"""
     try:
         await db.chat_conversations.delete_one({"id": conversation_id, "device_id": device_id})
-        result = await db.chat_messages.delete_many({"conversation_id": conversation_id, "device_id": device_id})
+        await record_tombstones(device_id, "chat_conversations", [conversation_id])
+        job = await start_purge_job(device_id, conversation_id)
         return {
             "message": "Conversation deleted successfully",
-            "deleted_messages": result.deleted_count
+            "purge_job_id": job["id"]
         }
     except Exception as e:
         logger.error(f"Error deleting conversation: {e}")
@@ -478,17 +960,360 @@ async def clear_chat_history(device_id: str):
         
         if latest_conv:
             await db.chat_conversations.delete_one({"id": latest_conv["id"]})
-            result = await db.chat_messages.delete_many({"conversation_id": latest_conv["id"]})
+            await record_tombstones(device_id, "chat_conversations", [latest_conv["id"]])
+            job = await start_purge_job(device_id, latest_conv["id"])
             return {
                 "message": "Current conversation cleared successfully",
-                "deleted_count": result.deleted_count
+                "purge_job_id": job["id"]
             }
         
-        return {"message": "No conversation to clear", "deleted_count": 0}
+        return {"message": "No conversation to clear", "purge_job_id": None}
     except Exception as e:
         logger.error(f"Error clearing chat history: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# ============== CHAT RETENTION ==============
+
+chat_archive_stats = {
+    "running": False,
+    "last_run_at": None,
+    "last_duration_ms": None,
+    "conversations_archived": 0,
+    "messages_archived": 0,
+    "bytes_raw": 0,
+    "bytes_compressed": 0,
+    "conversations_rehydrated": 0,
+}
+
+def compress_messages(messages: List[dict]) -> Tuple[str, bytes, int]:
+    """BSON-encode messages (keeps datetimes) and compress; returns (codec, blob, raw size)"""
+    raw = bson.encode({"messages": messages})
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=10).compress(raw), len(raw)
+    return "zlib", zlib.compress(raw, 9), len(raw)
+
+def decompress_messages(codec: str, blob: bytes) -> List[dict]:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Archived conversation needs the zstandard package")
+        raw = zstandard.ZstdDecompressor().decompress(blob)
+    else:
+        raw = zlib.decompress(blob)
+    return bson.decode(raw)["messages"]
+
+async def archive_conversation(conversation: dict, cutoff: datetime) -> Optional[int]:
+    """Move one idle conversation and its messages to chat_archive.
+
+    Returns the number of messages moved, or None if the conversation was
+    left in place (archived elsewhere or written to meanwhile).
+    """
+    messages = await db.chat_messages.find(
+        {"device_id": conversation["device_id"], "conversation_id": conversation["id"]}
+    ).sort("created_at", 1).to_list(None)
+    message_ids = [m.pop("_id") for m in messages]
+    codec, blob, raw_size = await asyncio.to_thread(compress_messages, messages)
+    
+    # Left unstamped until the hot copy is gone, so /sync never sees both
+    conversation = {k: v for k, v in conversation.items() if k not in ("_id", "sync_seq")}
+    try:
+        await db.chat_archive.insert_one({
+            **conversation,
+            "codec": codec,
+            "messages": blob,
+            "message_count": len(messages),
+            "archived_at": datetime.utcnow()
+        })
+    except DuplicateKeyError:
+        # Another worker's archiver got here first
+        return None
+    
+    # Only drop the hot copy if nobody wrote to the conversation meanwhile
+    result = await db.chat_conversations.delete_one({"id": conversation["id"], "updated_at": {"$lt": cutoff}})
+    if not result.deleted_count:
+        await db.chat_archive.delete_one({"id": conversation["id"]})
+        return None
+    if message_ids:
+        await db.chat_messages.delete_many({"_id": {"$in": message_ids}})
+    async with sync_write(conversation["device_id"]) as sync_seq:
+        await db.chat_archive.update_one({"id": conversation["id"]}, {"$set": {"sync_seq": sync_seq}})
+    
+    chat_archive_stats["bytes_raw"] += raw_size
+    chat_archive_stats["bytes_compressed"] += len(blob)
+    return len(messages)
+
+async def archive_idle_conversations() -> dict:
+    """Archive conversations idle for CHAT_ARCHIVE_IDLE_DAYS, in throttled batches"""
+    if chat_archive_stats["running"]:
+        return dict(chat_archive_stats)
+    started = time.perf_counter()
+    chat_archive_stats.update({"running": True, "last_run_at": datetime.utcnow().isoformat()})
+    try:
+        cutoff = datetime.utcnow() - timedelta(days=CHAT_ARCHIVE_IDLE_DAYS)
+        idle = {
+            "updated_at": {"$lt": cutoff},
+            # A rehydrated conversation gets a fresh idle period
+            "$or": [{"rehydrated_at": {"$exists": False}}, {"rehydrated_at": {"$lt": cutoff}}]
+        }
+        while True:
+            batch = await db.chat_conversations.find(idle).limit(CHAT_ARCHIVE_BATCH_SIZE).to_list(CHAT_ARCHIVE_BATCH_SIZE)
+            archived = 0
+            for conversation in batch:
+                moved = await archive_conversation(conversation, cutoff)
+                if moved is not None:
+                    archived += 1
+                    chat_archive_stats["conversations_archived"] += 1
+                    chat_archive_stats["messages_archived"] += moved
+            # A batch where nothing moved would come back unchanged next time
+            if len(batch) < CHAT_ARCHIVE_BATCH_SIZE or not archived:
+                break
+            await asyncio.sleep(CHAT_ARCHIVE_BATCH_PAUSE_SECONDS)
+    finally:
+        chat_archive_stats["running"] = False
+        chat_archive_stats["last_duration_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    
+    return dict(chat_archive_stats)
+
+async def rehydrate_conversation(device_id: str, conversation_id: str) -> bool:
+    """Move an archived conversation back to the hot collections; False if not archived"""
+    # Claiming the archive document makes concurrent rehydrations restore it once
+    archived = await db.chat_archive.find_one_and_delete({"id": conversation_id, "device_id": device_id})
+    if not archived:
+        return False
+    
+    try:
+        messages = await asyncio.to_thread(decompress_messages, archived["codec"], archived["messages"])
+        conversation = {
+            k: v for k, v in archived.items()
+            if k not in ("_id", "codec", "messages", "message_count", "archived_at")
+        }
+        conversation["rehydrated_at"] = datetime.utcnow()
+        # New change numbers: clients drop the messages of an archived conversation
+        async with sync_write(device_id, 1 + len(messages)) as first:
+            conversation["sync_seq"] = first
+            for i, message in enumerate(messages, start=1):
+                message["sync_seq"] = first + i
+            await db.chat_conversations.insert_one(conversation)
+            if messages:
+                await db.chat_messages.insert_many(messages)
+    except Exception:
+        await db.chat_archive.insert_one(archived)
+        raise
+    chat_archive_stats["conversations_rehydrated"] += 1
+    return True
+
+async def run_chat_archiver():
+    """Periodically archive idle conversations until cancelled"""
+    while True:
+        try:
+            await archive_idle_conversations()
+        except Exception as e:
+            logger.error(f"Error archiving idle conversations: {e}")
+        await asyncio.sleep(CHAT_ARCHIVE_INTERVAL_SECONDS)
+
+async def ensure_ttl_index(collection, field: str, seconds: int):
+    """Create, retune or drop a TTL index so it matches the configured expiry"""
+    name = f"{field}_ttl"
+    if seconds <= 0:
+        if name in await collection.index_information():
+            await collection.drop_index(name)
+        return
+    try:
+        await collection.create_index(field, name=name, expireAfterSeconds=seconds)
+    except OperationFailure as e:
+        # IndexOptionsConflict / IndexKeySpecsConflict: same index with another expiry
+        if e.code not in (85, 86):
+            raise
+        await db.command("collMod", collection.name, index={"name": name, "expireAfterSeconds": seconds})
+
+# ============== PURGE JOBS ==============
+
+class PurgeRequest(BaseModel):
+    device_id: str
+    conversation_id: Optional[str] = None  # If None, purges all of the device's data
+
+# Everything stored for a device, in deletion order; the subscription goes last
+PURGE_DEVICE_COLLECTIONS = (
+    "chat_messages", "chat_conversations", "chat_archive", "diary_entries", "cycle_entries",
+    "monthly_records", "pain_cycle_archive", "sync_tombstones", "subscriptions",
+)
+
+purge_slots = asyncio.Semaphore(PURGE_MAX_CONCURRENT)
+# Lease owner recorded on the jobs this process runs
+PURGE_WORKER_ID = uuid.uuid4().hex
+# Jobs queued or running in this process
+purge_jobs_active: set = set()
+
+def purge_targets(job: dict) -> List[Tuple[str, dict]]:
+    """(collection, filter) pairs a purge job deletes"""
+    device_id = job["device_id"]
+    if job.get("conversation_id"):
+        conversation_id = job["conversation_id"]
+        return [
+            ("chat_messages", {"device_id": device_id, "conversation_id": conversation_id}),
+            ("chat_conversations", {"device_id": device_id, "id": conversation_id}),
+            ("chat_archive", {"device_id": device_id, "id": conversation_id}),
+        ]
+    return [(name, {"device_id": device_id}) for name in PURGE_DEVICE_COLLECTIONS]
+
+async def run_purge_job(job_id: str):
+    """Delete a job's documents in throttled batches, recording progress after each.
+
+    The job is leased to this worker: it is claimed only when this worker
+    owns it or it has made no progress for PURGE_STALE_SECONDS, and every
+    progress write checks the lease, so a job taken over elsewhere stops here.
+    Collections already finished are skipped, so an interrupted job can be
+    resumed by running it again.
+    """
+    if job_id in purge_jobs_active:
+        return
+    purge_jobs_active.add(job_id)
+    try:
+        async with purge_slots:
+            await run_leased_purge_job(job_id)
+    finally:
+        purge_jobs_active.discard(job_id)
+
+async def run_leased_purge_job(job_id: str):
+    stale_before = datetime.utcnow() - timedelta(seconds=PURGE_STALE_SECONDS)
+    job = await db.purge_jobs.find_one_and_update(
+        {
+            "id": job_id,
+            "status": {"$in": ["pending", "running"]},
+            "$or": [{"owner": PURGE_WORKER_ID}, {"updated_at": {"$lt": stale_before}}]
+        },
+        {"$set": {"status": "running", "owner": PURGE_WORKER_ID, "updated_at": datetime.utcnow()}},
+        return_document=ReturnDocument.AFTER
+    )
+    if not job:
+        return
+    lease = {"id": job_id, "owner": PURGE_WORKER_ID}
+    started = time.perf_counter()
+    try:
+        for name, query in purge_targets(job):
+            if name in job["completed_collections"]:
+                continue
+            while True:
+                batch = await db[name].find(query, {"_id": 1}).limit(PURGE_BATCH_SIZE).to_list(PURGE_BATCH_SIZE)
+                if batch:
+                    result = await db[name].delete_many({"_id": {"$in": [doc["_id"] for doc in batch]}})
+                    progress = await db.purge_jobs.update_one(
+                        lease,
+                        {
+                            "$inc": {f"deleted.{name}": result.deleted_count},
+                            "$set": {"current_collection": name, "updated_at": datetime.utcnow()}
+                        }
+                    )
+                    if not progress.matched_count:
+                        logger.warning(f"Purge job {job_id} was taken over by another worker")
+                        return
+                if len(batch) < PURGE_BATCH_SIZE:
+                    break
+                await asyncio.sleep(PURGE_BATCH_PAUSE_SECONDS)
+            progress = await db.purge_jobs.update_one(
+                lease,
+                {"$push": {"completed_collections": name}, "$set": {"updated_at": datetime.utcnow()}}
+            )
+            if not progress.matched_count:
+                logger.warning(f"Purge job {job_id} was taken over by another worker")
+                return
+        
+        if not job.get("conversation_id"):
+            cycle_stats_cache.pop(job["device_id"], None)
+            await asyncio.to_thread(remove_cached_reports, job["device_id"])
+            # The counter is kept so change numbers never go back; a new
+            # epoch sends clients holding older tokens a full reset instead
+            await db.sync_counters.update_one({"device_id": job["device_id"]}, {"$inc": {"epoch": 1}})
+        await db.purge_jobs.update_one(
+            lease,
+            {"$set": {
+                "status": "completed",
+                "current_collection": None,
+                "finished_at": datetime.utcnow(),
+                "updated_at": datetime.utcnow()
+            }}
+        )
+        logger.info(f"Purge job {job_id} finished in {round((time.perf_counter() - started) * 1000)} ms")
+    except asyncio.CancelledError:
+        # Shutdown: left as running, taken over by run_purge_resumer once it goes stale
+        raise
+    except Exception as e:
+        logger.error(f"Purge job {job_id} failed: {e}")
+        await db.purge_jobs.update_one(
+            lease,
+            {"$set": {"status": "failed", "error": str(e), "updated_at": datetime.utcnow()}}
+        )
+
+async def start_purge_job(device_id: str, conversation_id: Optional[str] = None) -> dict:
+    """Record a purge job and start it in the background"""
+    now = datetime.utcnow()
+    job = {
+        "id": str(uuid.uuid4()),
+        "device_id": device_id,
+        "conversation_id": conversation_id,
+        "status": "pending",
+        "owner": PURGE_WORKER_ID,
+        "deleted": {},
+        "completed_collections": [],
+        "current_collection": None,
+        "error": None,
+        "created_at": now,
+        "updated_at": now,
+        "finished_at": None,
+    }
+    await db.purge_jobs.insert_one(job)
+    spawn_background(run_purge_job(job["id"]))
+    job.pop("_id", None)
+    return job
+
+async def resume_purge_jobs() -> int:
+    """Take over purge jobs with no progress for PURGE_STALE_SECONDS (e.g. left by a stopped worker)"""
+    stale_before = datetime.utcnow() - timedelta(seconds=PURGE_STALE_SECONDS)
+    jobs = await db.purge_jobs.find(
+        {"status": {"$in": ["pending", "running"]}, "updated_at": {"$lt": stale_before}},
+        {"_id": 0, "id": 1}
+    ).to_list(None)
+    resumed = 0
+    for job in jobs:
+        if job["id"] in purge_jobs_active:
+            continue
+        # Take the lease, so other workers skip the job
+        claimed = await db.purge_jobs.update_one(
+            {"id": job["id"], "updated_at": {"$lt": stale_before}},
+            {"$set": {"owner": PURGE_WORKER_ID, "updated_at": datetime.utcnow()}}
+        )
+        if claimed.modified_count:
+            spawn_background(run_purge_job(job["id"]))
+            resumed += 1
+    if resumed:
+        logger.info(f"Resumed {resumed} purge jobs")
+    return resumed
+
+async def run_purge_resumer():
+    """Periodically take over stale purge jobs until cancelled"""
+    while True:
+        try:
+            await resume_purge_jobs()
+        except Exception as e:
+            logger.error(f"Error resuming purge jobs: {e}")
+        await asyncio.sleep(PURGE_RESUME_INTERVAL_SECONDS)
+
+@api_router.post("/purge", status_code=202)
+async def create_purge_job(request: PurgeRequest):
+    """Delete a device's data (or one conversation) in the background"""
+    try:
+        return await start_purge_job(request.device_id, request.conversation_id)
+    except Exception as e:
+        logger.error(f"Error starting purge job: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/purge/{job_id}")
+async def get_purge_job(job_id: str):
+    """Progress of a purge job"""
+    job = await db.purge_jobs.find_one({"id": job_id}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Purge job not found")
+    return job
+
 # ============== CYCLE ENDPOINTS ==============
 
 @api_router.post("/cycle", response_model=CycleEntry)
@@ -497,7 +1322,9 @@ async def create_cycle_entry(entry: CycleEntryCreate):
     try:
         entry_dict = entry.model_dump()
         entry_obj = CycleEntry(**entry_dict)
-        await db.cycle_entries.insert_one(entry_obj.model_dump())
+        async with sync_write(entry.device_id) as sync_seq:
+            await db.cycle_entries.insert_one({**entry_obj.model_dump(), **sync_fields(sync_seq)})
+        cycle_stats_cache.pop(entry.device_id, None)
         return entry_obj
     except Exception as e:
         logger.error(f"Error creating cycle entry: {e}")
@@ -515,10 +1342,214 @@ async def get_cycle_entries(device_id: str, limit: int = 12):
         logger.error(f"Error getting cycle entries: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# ============== CYCLE PHASE ANALYTICS ==============
+
+CYCLE_PHASES = ("menstrual", "follicular", "ovulatory", "luteal")
+EMOTIONAL_FIELDS = list(EmotionalState.model_fields)
+PHYSICAL_FIELDS = list(PhysicalState.model_fields)
+
+def phase_of_day(day: "np.ndarray", cycle_length: "np.ndarray", period_days: "np.ndarray") -> "np.ndarray":
+    """Phase index (into CYCLE_PHASES) for 1-based days of cycle.
+
+    Ovulation is estimated 14 days before the next start; the ovulatory
+    phase spans that day +/- 1.
+    """
+    import numpy as np
+    
+    ovulation_day = cycle_length - 14
+    return np.select(
+        [day <= period_days, np.abs(day - ovulation_day) <= 1, day < ovulation_day],
+        [0, 2, 1],
+        default=3
+    )
+
+@api_router.get("/cycle/{device_id}/phases")
+async def get_cycle_phase_analytics(device_id: str, include_entries: bool = False):
+    """Average emotional and physical state of diary entries per cycle phase"""
+    import numpy as np
+    
+    try:
+        cycles = await db.cycle_entries.find(
+            {"device_id": device_id},
+            {"_id": 0, "start_date": 1, "end_date": 1}
+        ).sort("start_date", 1).to_list(None)
+        if not cycles:
+            return {"phases": None, "message": "No hay ciclos registrados"}
+        
+        entries = await db.diary_entries.find(
+            {"device_id": device_id, "created_at": {"$gte": cycles[0]["start_date"]}},
+            {"_id": 0, "id": 1, "created_at": 1, "emotional_state": 1, "physical_state": 1}
+        ).to_list(None)
+        
+        # Interval index: sorted cycle starts, each cycle ending where the next begins
+        starts = np.array([c["start_date"] for c in cycles], dtype="datetime64[s]")
+        lengths = np.diff(starts).astype("timedelta64[D]").astype(np.int64)
+        # Gaps longer than MAX_CYCLE_LENGTH_DAYS are missed logs, as in /stats
+        regular = (lengths > 0) & (lengths <= MAX_CYCLE_LENGTH_DAYS)
+        typical_length = int(np.median(lengths[regular])) if regular.any() else DEFAULT_CYCLE_LENGTH_DAYS
+        # Like the open (latest) cycle, a gap has no known end: phases use the
+        # typical length and only entries up to MAX_CYCLE_LENGTH_DAYS are assigned
+        cycle_length = np.append(np.where(regular, lengths, typical_length), typical_length)
+        max_day = np.append(np.minimum(lengths, MAX_CYCLE_LENGTH_DAYS), MAX_CYCLE_LENGTH_DAYS)
+        period_days = np.array([
+            (c["end_date"] - c["start_date"]).days + 1 if c.get("end_date") else DEFAULT_PERIOD_DAYS
+            for c in cycles
+        ])
+        
+        times = np.array([e["created_at"] for e in entries], dtype="datetime64[s]")
+        cycle_idx = np.searchsorted(starts, times, side="right") - 1
+        day = (times - starts[cycle_idx]).astype("timedelta64[D]").astype(np.int64) + 1
+        assigned = day <= max_day[cycle_idx]
+        phase = np.where(assigned, phase_of_day(day, cycle_length[cycle_idx], period_days[cycle_idx]), -1)
+        
+        emotional = np.array(
+            [[(e.get("emotional_state") or {}).get(f, 0) for f in EMOTIONAL_FIELDS] for e in entries],
+            dtype=np.float32
+        ).reshape(len(entries), len(EMOTIONAL_FIELDS))
+        has_physical = np.array([bool(e.get("physical_state")) for e in entries], dtype=bool)
+        physical = np.array(
+            [[(e.get("physical_state") or {}).get(f, 0) for f in PHYSICAL_FIELDS] for e in entries],
+            dtype=np.float32
+        ).reshape(len(entries), len(PHYSICAL_FIELDS))
+        
+        def averages(values: np.ndarray, mask: np.ndarray, fields: List[str]) -> Optional[dict]:
+            if not mask.any():
+                return None
+            return {f: round(float(v), 1) for f, v in zip(fields, values[mask].mean(axis=0))}
+        
+        phases = {}
+        for index, name in enumerate(CYCLE_PHASES):
+            in_phase = phase == index
+            phases[name] = {
+                "entries": int(in_phase.sum()),
+                "emotional_averages": averages(emotional, in_phase, EMOTIONAL_FIELDS),
+                "physical_averages": averages(physical, in_phase & has_physical, PHYSICAL_FIELDS)
+            }
+        
+        result = {
+            "cycles_analyzed": len(cycles),
+            "entries_analyzed": len(entries),
+            "entries_unassigned": int((~assigned).sum()),
+            "typical_cycle_length": typical_length,
+            "phases": phases
+        }
+        if include_entries:
+            result["entries"] = [{
+                "id": e["id"],
+                "created_at": e["created_at"].isoformat(),
+                "phase": CYCLE_PHASES[p] if p >= 0 else None,
+                "day_of_cycle": int(d) if p >= 0 else None
+            } for e, p, d in zip(entries, phase.tolist(), day.tolist())]
+        return result
+    except Exception as e:
+        logger.error(f"Error analyzing cycle phases: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# ============== CYCLE STATISTICS ==============
+
+# device_id -> (computed_at, version, stats). The version is the device's
+# newest cycle change number, so writes through any worker invalidate it
+cycle_stats_cache: "OrderedDict[str, Tuple[float, Optional[int], dict]]" = OrderedDict()
+
+async def cycle_stats_version(device_id: str) -> Optional[int]:
+    """Change number of the device's latest cycle write; None without cycles"""
+    latest = await db.cycle_entries.find_one(
+        {"device_id": device_id},
+        {"_id": 0, "sync_seq": 1},
+        sort=[("sync_seq", -1)]
+    )
+    return latest.get("sync_seq", 0) if latest else None
+
+async def compute_cycle_stats(device_id: str) -> dict:
+    """Cycle and period length statistics in a single projected cursor pass.
+
+    Uses Welford's algorithm for the running mean/variance. Gaps longer than
+    MAX_CYCLE_LENGTH_DAYS are treated as missed logs and left out.
+    """
+    cursor = db.cycle_entries.find(
+        {"device_id": device_id},
+        {"_id": 0, "start_date": 1, "end_date": 1}
+    ).sort("start_date", 1)
+    
+    count = 0
+    previous_start = None
+    length_n, length_mean, length_m2 = 0, 0.0, 0.0
+    period_n, period_total = 0, 0
+    skipped_gaps = 0
+    async for cycle in cursor:
+        count += 1
+        start = cycle["start_date"]
+        if previous_start is not None:
+            length = (start - previous_start).days
+            if 0 < length <= MAX_CYCLE_LENGTH_DAYS:
+                length_n += 1
+                delta = length - length_mean
+                length_mean += delta / length_n
+                length_m2 += delta * (length - length_mean)
+            else:
+                skipped_gaps += 1
+        if cycle.get("end_date") and cycle["end_date"] >= start:
+            period_n += 1
+            period_total += (cycle["end_date"] - start).days + 1
+        previous_start = start
+    
+    if not count:
+        return {"device_id": device_id, "cycles": 0, "message": "No hay ciclos registrados"}
+    
+    predicted_length = round(length_mean) if length_n else DEFAULT_CYCLE_LENGTH_DAYS
+    return {
+        "device_id": device_id,
+        "cycles": count,
+        "cycle_length": {
+            "mean": round(length_mean, 1) if length_n else None,
+            "variance": round(length_m2 / (length_n - 1), 2) if length_n > 1 else None,
+            "samples": length_n,
+            "skipped_gaps": skipped_gaps
+        },
+        "period_length": {
+            "mean": round(period_total / period_n, 1) if period_n else None,
+            "samples": period_n
+        },
+        "last_start": previous_start.isoformat(),
+        "predicted_next_start": (previous_start + timedelta(days=predicted_length)).isoformat(),
+        "prediction_uses_default": length_n == 0
+    }
+
+@api_router.get("/cycle/{device_id}/stats")
+async def get_cycle_stats(device_id: str):
+    """Get cycle-length statistics and the predicted next cycle start"""
+    try:
+        version = await cycle_stats_version(device_id)
+        cached = cycle_stats_cache.get(device_id)
+        if cached and cached[1] == version and time.monotonic() - cached[0] < CYCLE_STATS_TTL_SECONDS:
+            cycle_stats_cache.move_to_end(device_id)
+            return cached[2]
+        
+        stats = await compute_cycle_stats(device_id)
+        cycle_stats_cache[device_id] = (time.monotonic(), version, stats)
+        cycle_stats_cache.move_to_end(device_id)
+        while len(cycle_stats_cache) > CYCLE_STATS_CACHE_MAX_ENTRIES:
+            cycle_stats_cache.popitem(last=False)
+        return stats
+    except Exception as e:
+        logger.error(f"Error computing cycle stats: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 # ============== SUBSCRIPTION ENDPOINTS ==============
 
+def get_stripe():
+    """Import and configure the Stripe SDK on first use"""
+    import stripe
+    if stripe.api_key is None:
+        stripe.api_key = os.environ.get('STRIPE_SECRET_KEY')
+    return stripe
+
 async def get_subscription_status_internal(device_id: str) -> dict:
-    """Internal function to check subscription status"""
+    """Internal function to check subscription status.
+
+    Trial expiry is persisted by the background sweeper (see
+    sweep_expired_trials); this function only reads it.
+    """
     sub = await db.subscriptions.find_one({"device_id": device_id})
     
     if not sub:
@@ -527,7 +1558,7 @@ async def get_subscription_status_internal(device_id: str) -> dict:
         await db.subscriptions.insert_one(new_sub.model_dump())
         return {
             "status": "trial",
-            "trial_remaining_seconds": 7200,  # 2 hours
+            "trial_remaining_seconds": TRIAL_LIMIT_SECONDS,
             "trial_end": new_sub.trial_end.isoformat(),
             "is_admin": False
         }
@@ -544,16 +1575,12 @@ async def get_subscription_status_internal(device_id: str) -> dict:
     trial_end = sub.get("trial_end")
     usage_seconds = sub.get("usage_seconds", 0)
     
-    if usage_seconds >= 7200:  # 2 hours = 7200 seconds
-        await db.subscriptions.update_one(
-            {"device_id": device_id},
-            {"$set": {"status": "expired"}}
-        )
+    if sub.get("status") == "expired" or usage_seconds >= TRIAL_LIMIT_SECONDS:
         return {"status": "expired", "trial_remaining_seconds": 0, "is_admin": False}
     
     return {
         "status": "trial",
-        "trial_remaining_seconds": 7200 - usage_seconds,
+        "trial_remaining_seconds": TRIAL_LIMIT_SECONDS - usage_seconds,
         "trial_end": trial_end.isoformat() if trial_end else None,
         "usage_seconds": usage_seconds,
         "is_admin": False
@@ -563,10 +1590,58 @@ async def track_usage(device_id: str, seconds: int):
     """Track usage for trial period"""
     await db.subscriptions.update_one(
         {"device_id": device_id},
-        {"$inc": {"usage_seconds": seconds}},
+        {
+            "$inc": {"usage_seconds": seconds},
+            "$setOnInsert": {"status": "trial"}
+        },
         upsert=True
     )
 
+# ============== TRIAL EXPIRY SWEEPER ==============
+
+trial_sweep_stats: Dict[str, Any] = {
+    "runs": 0,
+    "last_run_at": None,
+    "last_duration_ms": None,
+    "last_matched": 0,
+    "last_expired": 0,
+    "total_expired": 0,
+}
+
+async def sweep_expired_trials() -> dict:
+    """Mark every exhausted trial as expired with a single bulk update"""
+    started = time.perf_counter()
+    result = await db.subscriptions.update_many(
+        {
+            # No status: written by the old usage tracker or the customer upsert, still a trial
+            "status": {"$in": ["trial", None]},
+            "usage_seconds": {"$gte": TRIAL_LIMIT_SECONDS},
+            "is_admin": {"$ne": True}
+        },
+        {"$set": {"status": "expired", "expired_at": datetime.utcnow()}}
+    )
+    duration_ms = round((time.perf_counter() - started) * 1000, 2)
+    
+    trial_sweep_stats["runs"] += 1
+    trial_sweep_stats["last_run_at"] = datetime.utcnow().isoformat()
+    trial_sweep_stats["last_duration_ms"] = duration_ms
+    trial_sweep_stats["last_matched"] = result.matched_count
+    trial_sweep_stats["last_expired"] = result.modified_count
+    trial_sweep_stats["total_expired"] += result.modified_count
+    
+    if result.modified_count:
+        logger.info(f"Trial sweep expired {result.modified_count} subscriptions in {duration_ms} ms")
+    return dict(trial_sweep_stats)
+
+async def run_trial_sweeper():
+    """Periodically expire exhausted trials until cancelled"""
+    while True:
+        try:
+            await sweep_expired_trials()
+        except Exception as e:
+            logger.error(f"Error sweeping expired trials: {e}")
+        await asyncio.sleep(TRIAL_SWEEP_INTERVAL_SECONDS)
+
 @api_router.get("/subscription/{device_id}")
 async def get_subscription_status(device_id: str):
     """Get subscription status for a device"""
@@ -576,11 +1651,13 @@ async def get_subscription_status(device_id: str):
 async def create_customer(request: CustomerCreate):
     """Create a Stripe customer"""
     try:
-        customer = stripe.Customer.create(
-            email=request.email,
-            name=request.name,
-            metadata={"device_id": request.device_id}
-        )
+        stripe = get_stripe()
+        with track_external_call("stripe"):
+            customer = stripe.Customer.create(
+                email=request.email,
+                name=request.name,
+                metadata={"device_id": request.device_id}
+            )
         
         await db.subscriptions.update_one(
             {"device_id": request.device_id},
@@ -599,18 +1676,20 @@ async def create_customer(request: CustomerCreate):
 @api_router.post("/subscription/create-payment-intent")
 async def create_payment_intent(device_id: str):
     """Create a payment intent for subscription"""
+    stripe = get_stripe()
     try:
         sub = await db.subscriptions.find_one({"device_id": device_id})
         if not sub or not sub.get("stripe_customer_id"):
             raise HTTPException(status_code=400, detail="Customer not found")
         
         # Create payment intent for 10 EUR
-        intent = stripe.PaymentIntent.create(
-            amount=1000,  # 10 EUR in cents
-            currency="eur",
-            customer=sub["stripe_customer_id"],
-            metadata={"device_id": device_id}
-        )
+        with track_external_call("stripe"):
+            intent = stripe.PaymentIntent.create(
+                amount=1000,  # 10 EUR in cents
+                currency="eur",
+                customer=sub["stripe_customer_id"],
+                metadata={"device_id": device_id}
+            )
         
         return {
             "client_secret": intent.client_secret,
@@ -625,7 +1704,8 @@ async def activate_subscription(device_id: str, payment_intent_id: str):
     """Activate subscription after successful payment"""
     try:
         # Verify payment was successful
-        intent = stripe.PaymentIntent.retrieve(payment_intent_id)
+        with track_external_call("stripe"):
+            intent = get_stripe().PaymentIntent.retrieve(payment_intent_id)
         
         if intent.status != "succeeded":
             raise HTTPException(status_code=400, detail="Payment not successful")
@@ -645,47 +1725,454 @@ async def activate_subscription(device_id: str, payment_intent_id: str):
         logger.error(f"Error activating subscription: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# ============== OUTBOUND HTTP CLIENT ==============
+
+def create_http_client() -> "httpx.AsyncClient":
+    """Build the pooled, keep-alive client used for outbound calls"""
+    import httpx
+    
+    http2 = HTTP2_ENABLED
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logger.warning("HTTP2_ENABLED is set but the 'h2' package is not installed; using HTTP/1.1")
+            http2 = False
+    
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+        ),
+        timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+        http2=http2
+    )
+
+def get_http_client() -> "httpx.AsyncClient":
+    """Return the application-scoped HTTP client, creating it if needed"""
+    global http_client
+    if http_client is None or http_client.is_closed:
+        http_client = create_http_client()
+    return http_client
+
+# ============== WEATHER CACHE ==============
+
+# Map weather codes to descriptions
+WEATHER_DESCRIPTIONS = {
+    0: "clear", 1: "mainly_clear", 2: "partly_cloudy", 3: "overcast",
+    45: "fog", 48: "fog", 51: "drizzle", 53: "drizzle", 55: "drizzle",
+    61: "rain", 63: "rain", 65: "rain", 71: "snow", 73: "snow", 75: "snow",
+    80: "showers", 81: "showers", 82: "showers", 95: "thunderstorm"
+}
+
+class WeatherCache:
+    """LRU cache of weather keyed on coordinates snapped to a grid.
+
+    Concurrent misses for the same grid cell share a single upstream fetch.
+    """
+
+    def __init__(self, grid_degrees: float, ttl_seconds: float, stale_seconds: float, max_entries: int):
+        self.grid_degrees = grid_degrees
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[Tuple[float, float], Tuple[float, dict]]" = OrderedDict()
+        self.inflight: Dict[Tuple[float, float], asyncio.Task] = {}
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def cell(self, lat: float, lon: float) -> Tuple[float, float]:
+        """Snap coordinates to the centre of their grid cell"""
+        return (
+            round(round(lat / self.grid_degrees) * self.grid_degrees, 4),
+            round(round(lon / self.grid_degrees) * self.grid_degrees, 4)
+        )
+
+    async def get(self, lat: float, lon: float, fetch) -> Tuple[dict, float, bool]:
+        """Return (weather, age_seconds, stale) for the cell containing lat/lon.
+
+        Entries past their TTL but within the stale window are returned
+        immediately while a background refresh runs.
+        """
+        key = self.cell(lat, lon)
+        entry = self.entries.get(key)
+        if entry:
+            age = time.monotonic() - entry[0]
+            if age < self.ttl_seconds:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1], age, False
+            if age < self.ttl_seconds + self.stale_seconds:
+                self.entries.move_to_end(key)
+                self.stale_hits += 1
+                if key not in self.inflight:
+                    self._start_fill(key, fetch).add_done_callback(self._log_refresh_failure)
+                return entry[1], age, True
+        
+        task = self.inflight.get(key)
+        if task:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = self._start_fill(key, fetch)
+        # Shielded so one cancelled request doesn't cancel the shared fetch
+        return await asyncio.shield(task), 0.0, False
+
+    def _start_fill(self, key: Tuple[float, float], fetch) -> asyncio.Task:
+        task = asyncio.ensure_future(self._fill(key, fetch))
+        self.inflight[key] = task
+        return task
+
+    @staticmethod
+    def _log_refresh_failure(task: asyncio.Task):
+        if not task.cancelled() and task.exception() and not isinstance(task.exception(), CircuitOpenError):
+            logger.warning(f"Background weather refresh failed: {task.exception()!r}")
+
+    async def _fill(self, key: Tuple[float, float], fetch) -> dict:
+        try:
+            value = await fetch(*key)
+            self.entries[key] = (time.monotonic(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+            return value
+        finally:
+            del self.inflight[key]
+
+    def stats(self) -> dict:
+        served = self.hits + self.stale_hits + self.coalesced
+        lookups = served + self.misses
+        return {
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "grid_degrees": self.grid_degrees,
+            "ttl_seconds": self.ttl_seconds,
+            "stale_seconds": self.stale_seconds,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "hit_rate": round(served / lookups, 4) if lookups else 0.0
+        }
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit is open"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"{name} circuit is open")
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    """Fail fast after consecutive upstream failures.
+
+    After failure_threshold consecutive failures the circuit opens; once
+    reset_seconds have passed a single probe call is let through, which
+    closes the circuit on success or reopens it on failure.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, reset_seconds: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"  # closed, open, half_open
+        self.failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+
+    def retry_after(self) -> float:
+        return max(0.0, self.reset_seconds - (time.monotonic() - self.opened_at))
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open" and self.retry_after() == 0:
+            self.state = "half_open"
+            return True
+        return False
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.times_opened += 1
+                logger.warning(f"{self.name} circuit opened after {self.failures} failures")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    async def call(self, func, *args):
+        if not self.allow():
+            raise CircuitOpenError(self.name, self.retry_after())
+        try:
+            result = await func(*args)
+        except Exception:
+            self.record_failure()
+            raise
+        except BaseException:
+            # Cancelled: says nothing about the upstream, so let the next call probe instead
+            if self.state == "half_open":
+                self.state = "open"
+            raise
+        self.record_success()
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "times_opened": self.times_opened,
+            "retry_after_seconds": round(self.retry_after(), 1) if self.state == "open" else 0
+        }
+
+weather_cache = WeatherCache(
+    grid_degrees=WEATHER_GRID_DEGREES,
+    ttl_seconds=WEATHER_CACHE_TTL_SECONDS,
+    stale_seconds=WEATHER_STALE_SECONDS,
+    max_entries=WEATHER_CACHE_MAX_ENTRIES
+)
+
+weather_breaker = CircuitBreaker(
+    "open-meteo",
+    failure_threshold=WEATHER_BREAKER_FAILURES,
+    reset_seconds=WEATHER_BREAKER_RESET_SECONDS
+)
+
+async def fetch_weather(lat: float, lon: float) -> dict:
+    """Fetch current weather from Open-Meteo"""
+    with track_external_call("weather"):
+        response = await get_http_client().get(
+            "https://api.open-meteo.com/v1/forecast",
+            params={
+                "latitude": lat,
+                "longitude": lon,
+                "current": "temperature_2m,relative_humidity_2m,weather_code,pressure_msl",
+                "timezone": "auto"
+            },
+            timeout=WEATHER_TIMEOUT_SECONDS
+        )
+        response.raise_for_status()
+    data = response.json()
+    
+    current = data.get("current", {})
+    weather_code = current.get("weather_code", 0)
+    
+    return {
+        "temperature": current.get("temperature_2m"),
+        "humidity": current.get("relative_humidity_2m"),
+        "pressure": current.get("pressure_msl"),
+        "condition": WEATHER_DESCRIPTIONS.get(weather_code, "unknown"),
+        "weather_code": weather_code
+    }
+
+async def fetch_weather_guarded(lat: float, lon: float) -> dict:
+    """Fetch weather through the Open-Meteo circuit breaker"""
+    return await weather_breaker.call(fetch_weather, lat, lon)
+
 # ============== WEATHER ENDPOINT ==============
 
 @api_router.get("/weather")
 async def get_weather(lat: float, lon: float):
     """Get current weather (uses Open-Meteo free API)"""
     try:
-        async with httpx.AsyncClient() as http_client:
-            response = await http_client.get(
-                "https://api.open-meteo.com/v1/forecast",
-                params={
-                    "latitude": lat,
-                    "longitude": lon,
-                    "current": "temperature_2m,relative_humidity_2m,weather_code,pressure_msl",
-                    "timezone": "auto"
-                }
-            )
-            data = response.json()
-            
-            current = data.get("current", {})
-            
-            # Map weather codes to descriptions
-            weather_descriptions = {
-                0: "clear", 1: "mainly_clear", 2: "partly_cloudy", 3: "overcast",
-                45: "fog", 48: "fog", 51: "drizzle", 53: "drizzle", 55: "drizzle",
-                61: "rain", 63: "rain", 65: "rain", 71: "snow", 73: "snow", 75: "snow",
-                80: "showers", 81: "showers", 82: "showers", 95: "thunderstorm"
-            }
-            
-            weather_code = current.get("weather_code", 0)
-            
-            return {
-                "temperature": current.get("temperature_2m"),
-                "humidity": current.get("relative_humidity_2m"),
-                "pressure": current.get("pressure_msl"),
-                "condition": weather_descriptions.get(weather_code, "unknown"),
-                "weather_code": weather_code
-            }
+        weather, age_seconds, stale = await weather_cache.get(lat, lon, fetch_weather_guarded)
+        return {
+            **weather,
+            "cache": {"age_seconds": round(age_seconds, 1), "stale": stale}
+        }
+    except CircuitOpenError as e:
+        raise HTTPException(
+            status_code=503,
+            detail="Weather service temporarily unavailable",
+            headers={"Retry-After": str(int(e.retry_after) + 1)}
+        )
     except Exception as e:
         logger.error(f"Error getting weather: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.get("/weather/cache-stats")
+async def get_weather_cache_stats():
+    """Get hit-rate metrics for the weather cache and circuit breaker state"""
+    return {**weather_cache.stats(), "circuit_breaker": weather_breaker.stats()}
+
+# ============== DIARY WEATHER ATTACHMENT ==============
+
+weather_backfill_stats: Dict[str, Any] = {
+    "running": False,
+    "last_run_at": None,
+    "last_duration_ms": None,
+    "entries_scanned": 0,
+    "entries_updated": 0,
+    "upstream_requests": 0,
+    "failed_requests": 0,
+}
+weather_backfill_task: Optional[asyncio.Task] = None
+
+async def attach_weather(entry_id: str, device_id: str, lat: float, lon: float):
+    """Store current weather on a diary entry (runs after the response is sent)"""
+    try:
+        weather, _, _ = await weather_cache.get(lat, lon, fetch_weather_guarded)
+        async with sync_write(device_id) as sync_seq:
+            await db.diary_entries.update_one(
+                {"id": entry_id, "weather": None},
+                {"$set": {"weather": weather, **sync_fields(sync_seq)}}
+            )
+    except Exception as e:
+        # Left without weather; the backfill job will pick it up later
+        logger.warning(f"Could not attach weather to diary entry {entry_id}: {e}")
+
+async def fetch_historical_weather(day: date, cells: List[Tuple[float, float]]) -> List[dict]:
+    """Fetch one UTC day of hourly weather for several locations in one request"""
+    # The forecast API only reaches a few days back; older days come from the archive
+    if day < datetime.utcnow().date() - timedelta(days=WEATHER_ARCHIVE_AFTER_DAYS):
+        url = "https://archive-api.open-meteo.com/v1/archive"
+    else:
+        url = "https://api.open-meteo.com/v1/forecast"
+    
+    with track_external_call("weather"):
+        response = await get_http_client().get(
+            url,
+            params={
+                "latitude": ",".join(str(lat) for lat, _ in cells),
+                "longitude": ",".join(str(lon) for _, lon in cells),
+                "hourly": "temperature_2m,relative_humidity_2m,weather_code,pressure_msl",
+                "start_date": day.isoformat(),
+                "end_date": day.isoformat(),
+                "timezone": "GMT"
+            }
+        )
+        response.raise_for_status()
+    data = response.json()
+    
+    # Open-Meteo returns a list for multiple locations and an object for one
+    if isinstance(data, dict):
+        data = [data]
+    return [location.get("hourly", {}) for location in data]
+
+def weather_at_hour(hourly: dict, hour: int) -> Optional[dict]:
+    """Pick one hour out of an Open-Meteo hourly block, in get_weather's format"""
+    def value(key):
+        values = hourly.get(key) or []
+        return values[hour] if hour < len(values) else None
+    
+    temperature = value("temperature_2m")
+    if temperature is None:
+        return None
+    weather_code = value("weather_code") or 0
+    
+    return {
+        "temperature": temperature,
+        "humidity": value("relative_humidity_2m"),
+        "pressure": value("pressure_msl"),
+        "condition": WEATHER_DESCRIPTIONS.get(weather_code, "unknown"),
+        "weather_code": weather_code
+    }
+
+async def backfill_diary_weather(max_entries: int) -> dict:
+    """Fill missing weather on diary entries that have a location.
+
+    Entries are grouped by UTC day and grid cell so that each upstream
+    request covers up to WEATHER_BACKFILL_BATCH_LOCATIONS locations, and
+    requests are spaced by WEATHER_BACKFILL_REQUEST_INTERVAL seconds.
+    """
+    started = time.perf_counter()
+    weather_backfill_stats.update({
+        "running": True,
+        "last_run_at": datetime.utcnow().isoformat(),
+        "entries_scanned": 0,
+        "entries_updated": 0,
+        "upstream_requests": 0,
+        "failed_requests": 0,
+    })
+    
+    try:
+        entries = await db.diary_entries.find(
+            {"weather": None, "location": {"$ne": None}},
+            {"_id": 0, "id": 1, "device_id": 1, "location": 1, "created_at": 1}
+        ).sort("created_at", -1).limit(max_entries).to_list(max_entries)
+        weather_backfill_stats["entries_scanned"] = len(entries)
+        
+        groups: Dict[date, Dict[Tuple[float, float], List[dict]]] = {}
+        for entry in entries:
+            cell = (entry["location"]["lat"], entry["location"]["lon"])
+            groups.setdefault(entry["created_at"].date(), {}).setdefault(cell, []).append(entry)
+        
+        circuit_open = False
+        for day, by_cell in groups.items():
+            if circuit_open:
+                break
+            cells = list(by_cell)
+            for i in range(0, len(cells), WEATHER_BACKFILL_BATCH_LOCATIONS):
+                chunk = cells[i:i + WEATHER_BACKFILL_BATCH_LOCATIONS]
+                if weather_backfill_stats["upstream_requests"]:
+                    await asyncio.sleep(WEATHER_BACKFILL_REQUEST_INTERVAL)
+                
+                weather_backfill_stats["upstream_requests"] += 1
+                try:
+                    hourly_blocks = await weather_breaker.call(fetch_historical_weather, day, chunk)
+                except CircuitOpenError:
+                    logger.warning("Weather backfill stopped: Open-Meteo circuit is open")
+                    circuit_open = True
+                    break
+                except Exception as e:
+                    weather_backfill_stats["failed_requests"] += 1
+                    logger.error(f"Error backfilling weather for {day}: {e}")
+                    continue
+                
+                updates: Dict[str, List[Tuple[str, dict]]] = {}
+                for cell, hourly in zip(chunk, hourly_blocks):
+                    for entry in by_cell[cell]:
+                        weather = weather_at_hour(hourly, entry["created_at"].hour)
+                        if weather:
+                            updates.setdefault(entry["device_id"], []).append((entry["id"], weather))
+                if not updates:
+                    continue
+                
+                # One change number per entry, so delta sync picks the weather up
+                async with AsyncExitStack() as reservations:
+                    firsts = await asyncio.gather(*(
+                        reservations.enter_async_context(sync_write(device_id, len(device_updates)))
+                        for device_id, device_updates in updates.items()
+                    ))
+                    operations = [
+                        UpdateOne(
+                            {"id": entry_id, "weather": None},
+                            {"$set": {"weather": weather, **sync_fields(first + i)}}
+                        )
+                        for first, device_updates in zip(firsts, updates.values())
+                        for i, (entry_id, weather) in enumerate(device_updates)
+                    ]
+                    result = await db.diary_entries.bulk_write(operations, ordered=False)
+                    weather_backfill_stats["entries_updated"] += result.modified_count
+    finally:
+        weather_backfill_stats["running"] = False
+        weather_backfill_stats["last_duration_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    
+    return dict(weather_backfill_stats)
+
+@api_router.post("/admin/weather-backfill", dependencies=[Depends(require_admin_code)])
+async def start_weather_backfill(max_entries: int = 5000):
+    """Start filling missing weather on historical diary entries"""
+    global weather_backfill_task
+    if weather_backfill_task and not weather_backfill_task.done():
+        return {"started": False, "message": "Backfill already running", "stats": weather_backfill_stats}
+    
+    weather_backfill_task = asyncio.create_task(backfill_diary_weather(max_entries))
+    return {"started": True, "message": "Backfill started"}
+
+@api_router.get("/admin/weather-backfill")
+async def get_weather_backfill_status():
+    """Get progress of the diary weather backfill"""
+    return weather_backfill_stats
+
 # ============== MONTHLY PAIN RECORD ENDPOINTS ==============
 
 @api_router.get("/monthly-record/{device_id}")
@@ -699,7 +2186,8 @@ async def get_monthly_record(device_id: str):
                 "device_id": device_id,
                 "records": [],
                 "cycle_start_date": datetime.utcnow().isoformat(),
-                "created_at": datetime.utcnow().isoformat()
+                "created_at": datetime.utcnow().isoformat(),
+                "version": 0
             }
         
         # Check if cycle is older than 30 days
@@ -716,7 +2204,8 @@ async def get_monthly_record(device_id: str):
             "device_id": record["device_id"],
             "records": record.get("records", []),
             "cycle_start_date": record.get("cycle_start_date").isoformat() if isinstance(record.get("cycle_start_date"), datetime) else record.get("cycle_start_date"),
-            "created_at": record.get("created_at").isoformat() if isinstance(record.get("created_at"), datetime) else record.get("created_at")
+            "created_at": record.get("created_at").isoformat() if isinstance(record.get("created_at"), datetime) else record.get("created_at"),
+            "version": record.get("version", 0)
         }
     except Exception as e:
         logger.error(f"Error getting monthly record: {e}")
@@ -728,44 +2217,487 @@ async def save_monthly_record(device_id: str, data: MonthlyPainRecordCreate):
     try:
         # Parse cycle_start_date
         cycle_start = datetime.fromisoformat(data.cycle_start_date.replace('Z', '+00:00').replace('+00:00', ''))
+        # Stored with millisecond precision; truncate so an unchanged start compares equal
+        cycle_start = cycle_start.replace(microsecond=cycle_start.microsecond // 1000 * 1000)
         
-        record_data = {
-            "device_id": device_id,
-            "records": data.records,
-            "cycle_start_date": cycle_start,
-            "updated_at": datetime.utcnow()
-        }
+        async with sync_write(device_id) as sync_seq:
+            record_data = {
+                "device_id": device_id,
+                "records": data.records,
+                "cycle_start_date": cycle_start,
+                **sync_fields(sync_seq)
+            }
+            
+            # Upsert the record, keeping the previous cycle to archive
+            previous = await db.monthly_records.find_one_and_update(
+                {"device_id": device_id},
+                {
+                    "$set": record_data,
+                    "$inc": {"version": 1},
+                    "$setOnInsert": {"id": str(uuid.uuid4()), "created_at": datetime.utcnow()}
+                },
+                projection={"_id": 0},
+                upsert=True,
+                return_document=ReturnDocument.BEFORE
+            )
         
-        # Upsert the record
-        await db.monthly_records.update_one(
-            {"device_id": device_id},
-            {
-                "$set": record_data,
-                "$setOnInsert": {"created_at": datetime.utcnow()}
-            },
-            upsert=True
-        )
+        # The app starts a new cycle by saving an empty record with a new start date
+        archived_id = None
+        if previous and previous.get("records") and previous.get("cycle_start_date") != cycle_start:
+            archived = compact_pain_cycle(previous)
+            await db.pain_cycle_archive.insert_one(archived)
+            archived_id = archived["id"]
         
         return {
             "device_id": device_id,
             "records": data.records,
             "cycle_start_date": cycle_start.isoformat(),
+            "version": previous.get("version", 0) + 1 if previous else 1,
+            "archived_id": archived_id,
             "message": "Record saved successfully"
         }
     except Exception as e:
         logger.error(f"Error saving monthly record: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.patch("/monthly-record/{device_id}/day/{date}")
+async def save_monthly_record_day(
+    device_id: str,
+    data: MonthlyPainDayUpdate,
+    day: str = PathParam(alias="date")
+):
+    """Set or clear a single day of the monthly pain record.
+
+    Only the affected array element is written, using a positional update
+    for an existing day and $push for a new one.
+    """
+    try:
+        day = date.fromisoformat(day).isoformat()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date, expected YYYY-MM-DD")
+    
+    try:
+        now = datetime.utcnow()
+        query: Dict[str, Any] = {"device_id": device_id}
+        if data.expected_version is not None:
+            # Records saved before versioning have no version field
+            query["version"] = data.expected_version if data.expected_version else {"$in": [0, None]}
+        day_record = {"date": day, "intensity": data.intensity}
+        if data.notes is not None:
+            day_record["notes"] = data.notes
+        
+        async def apply(extra_query: dict, update: dict, upsert: bool = False):
+            return await db.monthly_records.find_one_and_update(
+                {**query, **extra_query},
+                {**update, "$set": {**update["$set"], "sync_seq": sync_seq}, "$inc": {"version": 1}},
+                projection={"_id": 0, "version": 1},
+                upsert=upsert,
+                return_document=ReturnDocument.AFTER
+            )
+        
+        async with sync_write(device_id) as sync_seq:
+            if data.intensity == 0:
+                saved = await apply({}, {"$pull": {"records": {"date": day}}, "$set": {"updated_at": now}})
+            else:
+                saved = None
+                for _ in range(2):
+                    # Existing day: update the matched element in place (keeps notes unless given)
+                    saved = await apply(
+                        {"records.date": day},
+                        {"$set": {
+                            **{f"records.$.{key}": value for key, value in day_record.items()},
+                            "updated_at": now
+                        }}
+                    )
+                    if saved:
+                        break
+                    # New day: append it, creating the record if there is none yet
+                    try:
+                        saved = await apply(
+                            {"records.date": {"$ne": day}},
+                            {
+                                "$push": {"records": day_record},
+                                "$set": {"updated_at": now},
+                                "$setOnInsert": {"id": str(uuid.uuid4()), "cycle_start_date": now, "created_at": now}
+                            },
+                            upsert=data.expected_version is None
+                        )
+                        break
+                    except DuplicateKeyError:
+                        # The day was added concurrently; retry as an in-place update
+                        continue
+        
+        if not saved:
+            if data.expected_version is not None:
+                current = await db.monthly_records.find_one({"device_id": device_id}, {"_id": 0, "version": 1})
+                raise HTTPException(
+                    status_code=409,
+                    detail={
+                        "message": "Monthly record was modified by another save",
+                        "current_version": current.get("version", 0) if current else None
+                    }
+                )
+            # Clearing a day on a record that doesn't exist
+            return {"device_id": device_id, "date": day, "record": None, "version": 0}
+        
+        return {
+            "device_id": device_id,
+            "date": day,
+            "record": day_record if data.intensity else None,
+            "version": saved["version"]
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error saving monthly record day: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @api_router.delete("/monthly-record/{device_id}")
 async def delete_monthly_record(device_id: str):
-    """Delete the monthly pain record (start fresh cycle)"""
+    """Delete the monthly pain record (start fresh cycle); the closed cycle is archived"""
     try:
-        await db.monthly_records.delete_one({"device_id": device_id})
-        return {"message": "Record deleted successfully", "device_id": device_id}
+        record = await db.monthly_records.find_one({"device_id": device_id})
+        archived_id = None
+        if record and record.get("records"):
+            archived = compact_pain_cycle(record)
+            await db.pain_cycle_archive.insert_one(archived)
+            archived_id = archived["id"]
+        
+        result = await db.monthly_records.delete_one({"device_id": device_id})
+        if result.deleted_count:
+            await record_tombstones(device_id, "monthly_records", [device_id])
+        await asyncio.to_thread(remove_cached_reports, device_id)
+        return {"message": "Record deleted successfully", "device_id": device_id, "archived_id": archived_id}
     except Exception as e:
         logger.error(f"Error deleting monthly record: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# ============== PAIN CYCLE ARCHIVE ==============
+
+def compact_pain_cycle(record: dict) -> dict:
+    """Convert a monthly record into its compact archived form.
+
+    Daily intensities become a fixed-length array indexed by day offset from
+    cycle_start_date (0 = nothing recorded), at least PAIN_CYCLE_DAYS and at
+    most PAIN_CYCLE_MAX_DAYS long; days outside that window are dropped.
+    Notes are kept sparsely, keyed by the same offset.
+    """
+    cycle_start = record.get("cycle_start_date") or record.get("created_at") or datetime.utcnow()
+    if isinstance(cycle_start, str):
+        cycle_start = datetime.fromisoformat(cycle_start.replace('Z', '+00:00').replace('+00:00', ''))
+    start_day = cycle_start.date()
+    
+    by_offset: Dict[int, dict] = {}
+    for day_record in record.get("records", []):
+        try:
+            offset = (date.fromisoformat(str(day_record["date"])[:10]) - start_day).days
+        except (KeyError, ValueError):
+            continue
+        if 0 <= offset < PAIN_CYCLE_MAX_DAYS:
+            by_offset[offset] = day_record
+    
+    length = max([PAIN_CYCLE_DAYS] + [offset + 1 for offset in by_offset])
+    intensities = [0] * length
+    notes = {}
+    for offset, day_record in by_offset.items():
+        intensities[offset] = int(day_record.get("intensity") or 0)
+        if day_record.get("notes"):
+            notes[str(offset)] = day_record["notes"]
+    
+    return {
+        "id": str(uuid.uuid4()),
+        "device_id": record["device_id"],
+        "cycle_start_date": datetime.combine(start_day, datetime.min.time()),
+        "cycle_end_date": datetime.combine(start_day + timedelta(days=length - 1), datetime.min.time()),
+        "intensities": intensities,
+        "notes": notes,
+        "archived_at": datetime.utcnow()
+    }
+
+def pain_cycle_trends(cycles: List[dict]) -> dict:
+    """Per-cycle and per-day-of-cycle statistics over compact intensity arrays"""
+    import numpy as np
+    
+    length = max(len(cycle["intensities"]) for cycle in cycles)
+    matrix = np.zeros((len(cycles), length), dtype=np.float32)
+    for row, cycle in enumerate(cycles):
+        matrix[row, :len(cycle["intensities"])] = cycle["intensities"]
+    
+    recorded = matrix > 0
+    days_per_cycle = recorded.sum(axis=1)
+    cycles_per_day = recorded.sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cycle_avg = matrix.sum(axis=1) / days_per_cycle
+        day_avg = matrix.sum(axis=0) / cycles_per_day
+    
+    def to_list(values):
+        return [None if np.isnan(v) else round(float(v), 2) for v in values]
+    
+    return {
+        "recorded_days": days_per_cycle.tolist(),
+        "high_pain_days": (matrix >= 4).sum(axis=1).tolist(),
+        "average_by_cycle": to_list(cycle_avg),
+        "average_by_day_of_cycle": to_list(day_avg)
+    }
+
+@api_router.get("/monthly-record/{device_id}/history")
+async def get_pain_cycle_history(device_id: str, cycles: int = 6, include_current: bool = True):
+    """Get daily intensity series for the last N pain cycles, with trends"""
+    try:
+        archived = await db.pain_cycle_archive.find(
+            {"device_id": device_id},
+            {"_id": 0}
+        ).sort("cycle_start_date", -1).limit(cycles).to_list(cycles)
+        
+        if include_current:
+            current = await db.monthly_records.find_one({"device_id": device_id})
+            if current and current.get("records"):
+                current_cycle = compact_pain_cycle(current)
+                current_cycle.update({"id": current.get("id", current_cycle["id"]), "current": True})
+                current_cycle.pop("archived_at")
+                archived = [current_cycle] + archived[:max(cycles - 1, 0)]
+        
+        # Oldest first, so series read left to right
+        archived.reverse()
+        
+        return {
+            "device_id": device_id,
+            "cycles": [{
+                "id": c["id"],
+                "cycle_start_date": c["cycle_start_date"].isoformat(),
+                "cycle_end_date": c["cycle_end_date"].isoformat(),
+                "intensities": c["intensities"],
+                "notes": c.get("notes", {}),
+                "current": c.get("current", False)
+            } for c in archived],
+            "trends": pain_cycle_trends(archived) if archived else None
+        }
+    except Exception as e:
+        logger.error(f"Error getting pain cycle history: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# ============== MONTHLY PAIN REPORT ==============
+
+REPORT_LABELS = {
+    "es": {
+        "title": "Registro mensual de dolor",
+        "cycle_start": "Inicio del ciclo",
+        "recorded_days": "Días registrados",
+        "average": "Intensidad media",
+        "high_pain_days": "Días de dolor alto (4-5)",
+        "date": "Fecha",
+        "intensity": "Intensidad",
+        "notes": "Notas",
+    },
+    "en": {
+        "title": "Monthly pain record",
+        "cycle_start": "Cycle start",
+        "recorded_days": "Recorded days",
+        "average": "Average intensity",
+        "high_pain_days": "High pain days (4-5)",
+        "date": "Date",
+        "intensity": "Intensity",
+        "notes": "Notes",
+    },
+}
+
+REPORT_MEDIA_TYPES = {"pdf": "application/pdf", "csv": "text/csv; charset=utf-8"}
+
+report_pool: Optional[ProcessPoolExecutor] = None
+report_renders: Dict[str, asyncio.Future] = {}
+
+def get_report_pool() -> ProcessPoolExecutor:
+    global report_pool
+    if report_pool is None:
+        report_pool = ProcessPoolExecutor(max_workers=REPORT_WORKERS)
+    return report_pool
+
+def report_summary(records: List[dict]) -> dict:
+    intensities = [r.get("intensity", 0) for r in records]
+    return {
+        "recorded_days": len(intensities),
+        "average": round(sum(intensities) / len(intensities), 1) if intensities else 0,
+        "high_pain_days": sum(1 for i in intensities if i >= 4),
+    }
+
+def render_report_csv(report: dict) -> bytes:
+    """Render a monthly report as CSV (runs in the report process pool)"""
+    labels = REPORT_LABELS.get(report["language"], REPORT_LABELS["es"])
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow([labels["date"], labels["intensity"], labels["notes"]])
+    for r in report["records"]:
+        writer.writerow([r.get("date"), r.get("intensity"), r.get("notes") or ""])
+    return output.getvalue().encode("utf-8-sig")  # BOM so spreadsheet apps detect UTF-8
+
+def render_report_pdf(report: dict) -> bytes:
+    """Render a monthly report as a text-only PDF (runs in the report process pool)"""
+    labels = REPORT_LABELS.get(report["language"], REPORT_LABELS["es"])
+    summary = report_summary(report["records"])
+    lines = [
+        (16, labels["title"]),
+        (11, f"{labels['cycle_start']}: {report['cycle_start_date'][:10]}"),
+        (11, f"{labels['recorded_days']}: {summary['recorded_days']}"),
+        (11, f"{labels['average']}: {summary['average']}"),
+        (11, f"{labels['high_pain_days']}: {summary['high_pain_days']}"),
+        (11, ""),
+        (11, f"{labels['date']}    {labels['intensity']}    {labels['notes']}"),
+    ]
+    for r in report["records"]:
+        notes = (r.get("notes") or "").replace("\n", " ")[:70]
+        lines.append((11, f"{r.get('date')}    {r.get('intensity')}/5    {notes}"))
+    
+    def escape(text: str) -> str:
+        text = text.encode("cp1252", "replace").decode("cp1252")
+        return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+    
+    # A4 pages, 50 lines each
+    pages = [lines[i:i + 50] for i in range(0, len(lines), 50)]
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None,
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>"]
+    page_ids = []
+    for page in pages:
+        ops = ["BT", "50 790 Td", "14 TL"]
+        for size, text in page:
+            ops.append(f"/F1 {size} Tf ({escape(text)}) Tj T*")
+        ops.append("ET")
+        stream = "\n".join(ops).encode("cp1252")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % len(objects)
+        )
+        page_ids.append(len(objects))
+    kids = " ".join(f"{i} 0 R" for i in page_ids).encode()
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids))
+    
+    pdf = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        pdf += b"%010d 00000 n \n" % offset
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(pdf)
+
+def write_report(path: str, report: dict, fmt: str) -> int:
+    """Render a report and atomically move it into the cache (process pool entry point)"""
+    content = render_report_pdf(report) if fmt == "pdf" else render_report_csv(report)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+    return len(content)
+
+def report_device_key(device_id: str) -> str:
+    """Prefix of a device's cached report files"""
+    return hashlib.sha256(device_id.encode()).hexdigest()[:24]
+
+def remove_cached_reports(device_id: str):
+    """Delete every cached report of a device (blocking; run in a thread)"""
+    for path in REPORT_CACHE_DIR.glob(f"{report_device_key(device_id)}-*"):
+        path.unlink(missing_ok=True)
+
+async def ensure_report(device_id: str, fmt: str, language: str) -> Tuple[Path, str]:
+    """Return (path, etag) of the cached report, rendering it off the event loop if needed"""
+    record = await db.monthly_records.find_one({"device_id": device_id}, {"_id": 0})
+    if not record:
+        raise HTTPException(status_code=404, detail="Monthly record not found")
+    
+    # version restarts when a record is deleted and recreated; created_at tells the cycles apart
+    version = record.get("version", 0)
+    cycle_key = hashlib.sha256(str(record.get("created_at")).encode()).hexdigest()[:8]
+    device_key = report_device_key(device_id)
+    key = f"{device_key}-{cycle_key}-v{version}-{language}.{fmt}"
+    path = REPORT_CACHE_DIR / key
+    etag = f'"{key}"'
+    if path.exists():
+        return path, etag
+    
+    # Concurrent downloads of the same version share one render
+    render = report_renders.get(key)
+    if render is None:
+        cycle_start = record.get("cycle_start_date")
+        report = {
+            "language": language,
+            "records": sorted(record.get("records", []), key=lambda r: str(r.get("date"))),
+            "cycle_start_date": cycle_start.isoformat() if isinstance(cycle_start, datetime) else str(cycle_start),
+        }
+        REPORT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        loop = asyncio.get_running_loop()
+        render = loop.run_in_executor(get_report_pool(), write_report, str(path), report, fmt)
+        report_renders[key] = render
+        render.add_done_callback(lambda _: report_renders.pop(key, None))
+        
+        # Older versions of this device's report are no longer reachable
+        for old in REPORT_CACHE_DIR.glob(f"{device_key}-*"):
+            if not old.name.startswith(f"{device_key}-{cycle_key}-v{version}-"):
+                old.unlink(missing_ok=True)
+    
+    await asyncio.shield(render)
+    return path, etag
+
+def parse_byte_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single 'bytes=start-end' range; None if unsatisfiable or unsupported"""
+    if not header.startswith("bytes=") or "," in header:
+        return None
+    start, _, end = header[6:].strip().partition("-")
+    try:
+        if start:
+            first = int(start)
+            last = min(int(end), size - 1) if end else size - 1
+        else:
+            first = max(size - int(end), 0)
+            last = size - 1
+    except ValueError:
+        return None
+    if first > last or first >= size:
+        return None
+    return first, last
+
+@api_router.get("/monthly-record/{device_id}/report")
+async def download_monthly_report(device_id: str, request: Request, format: str = "pdf", language: str = "es"):
+    """Download the monthly pain record as PDF or CSV (cached per record version)"""
+    if format not in REPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="Unsupported format, use pdf or csv")
+    if language not in REPORT_LABELS:
+        language = "es"
+    
+    try:
+        path, etag = await ensure_report(device_id, format, language)
+        headers = {
+            "ETag": etag,
+            "Accept-Ranges": "bytes",
+            "Cache-Control": "private, no-cache",
+            "Content-Disposition": f'attachment; filename="registro-mensual.{format}"',
+        }
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers=headers)
+        
+        content = await asyncio.to_thread(path.read_bytes)
+        range_header = request.headers.get("range")
+        if range_header and request.headers.get("if-range", etag) == etag:
+            byte_range = parse_byte_range(range_header, len(content))
+            if byte_range is None:
+                return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{len(content)}"})
+            first, last = byte_range
+            return Response(
+                content=content[first:last + 1],
+                status_code=206,
+                media_type=REPORT_MEDIA_TYPES[format],
+                headers={**headers, "Content-Range": f"bytes {first}-{last}/{len(content)}"}
+            )
+        
+        return Response(content=content, media_type=REPORT_MEDIA_TYPES[format], headers=headers)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error generating monthly report: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 # ============== ADMIN ENDPOINTS ==============
 
 class AdminCodeRequest(BaseModel):
@@ -803,189 +2735,901 @@ async def verify_admin_code(request: AdminCodeRequest):
         logger.error(f"Error verifying admin code: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.post("/admin/chat-archive", dependencies=[Depends(require_admin_code)])
+async def start_chat_archive():
+    """Run the idle conversation archiver now"""
+    if chat_archive_stats["running"]:
+        return {"started": False, "stats": chat_archive_stats}
+    spawn_background(archive_idle_conversations())
+    return {"started": True, "stats": chat_archive_stats}
+
+@api_router.get("/admin/chat-archive")
+async def get_chat_archive_stats():
+    """Get counters and compression ratio of the chat archiver"""
+    stats = dict(chat_archive_stats)
+    stats["compression_ratio"] = round(stats["bytes_raw"] / stats["bytes_compressed"], 2) if stats["bytes_compressed"] else None
+    stats["codec"] = "zstd" if zstandard is not None else "zlib"
+    return stats
+
+@api_router.get("/admin/trial-sweep")
+async def get_trial_sweep_stats():
+    """Get duration and row counts of the trial expiry sweeper"""
+    return trial_sweep_stats
+
+# ============== REQUEST PROFILER ==============
+
+PROFILE_HEADER = "x-debug-profile"
+profiles_in_flight = 0
+
+class StackSampler(threading.Thread):
+    """Samples one thread's Python stack at a fixed interval.
+
+    Stacks are aggregated in the folded format ("outer;inner count") that
+    flamegraph.pl, speedscope and inferno read directly. Samples come from
+    the event loop thread, so they are wall-clock and include whatever else
+    the loop ran while the profiled request was in flight.
+    """
+    
+    def __init__(self, target_thread_id: int, interval: float):
+        super().__init__(daemon=True)
+        self.target_thread_id = target_thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.done = threading.Event()
+    
+    def run(self):
+        while not self.done.wait(self.interval):
+            frame = sys._current_frames().get(self.target_thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+    
+    def stop(self) -> Counter:
+        self.done.set()
+        self.join()
+        return self.stacks
+
+def profile_route_dir(method: str, path: str) -> Path:
+    return PROFILE_DIR / (method.lower() + "_" + (re.sub(r'[^A-Za-z0-9]+', '_', path).strip('_') or "root"))
+
+def write_profile(route_dir: Path, profile_id: str, stacks: Counter, meta: dict):
+    """Store a profile and its metadata, keeping the newest PROFILE_MAX_PER_ROUTE per route"""
+    route_dir.mkdir(parents=True, exist_ok=True)
+    folded = "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+    (route_dir / f"{profile_id}.folded").write_text(folded, encoding='utf-8')
+    (route_dir / f"{profile_id}.json").write_text(json.dumps(meta), encoding='utf-8')
+    
+    # Profile ids start with a millisecond timestamp, so name order is age order
+    for old in sorted(route_dir.glob("*.json"))[:-PROFILE_MAX_PER_ROUTE]:
+        old.unlink(missing_ok=True)
+        old.with_suffix(".folded").unlink(missing_ok=True)
+
+def should_profile(request: Request) -> bool:
+    if profiles_in_flight >= PROFILE_MAX_CONCURRENT:
+        return False
+    debug_code = request.headers.get(PROFILE_HEADER)
+    if debug_code is not None:
+        return hmac.compare_digest(debug_code, ADMIN_CODE)
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+async def store_profile(method: str, path: str, status: int, sampler: StackSampler, duration_ms: float) -> Optional[str]:
+    """Write a finished request's profile; returns its id, or None if it couldn't be stored"""
+    profile_id = f"{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}"
+    meta = {
+        "id": profile_id,
+        "method": method,
+        "route": path,
+        "status": status,
+        "duration_ms": duration_ms,
+        "samples": sampler.samples,
+        "interval_ms": PROFILE_INTERVAL_SECONDS * 1000,
+        "created_at": datetime.utcnow().isoformat()
+    }
+    try:
+        await asyncio.to_thread(write_profile, profile_route_dir(method, path), profile_id, sampler.stacks, meta)
+        return profile_id
+    except OSError as e:
+        logger.error(f"Could not store profile for {method} {path}: {e}")
+        return None
+
+class RequestProfilerMiddleware:
+    """ASGI middleware running the stack sampler for selected requests.
+
+    Plain ASGI rather than @app.middleware("http"), so requests that are not
+    profiled go straight to the app without being wrapped and re-streamed.
+    The sampler runs until the response starts; the profile id is sent in
+    the X-Profile-Id header.
+    """
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not should_profile(Request(scope)):
+            await self.app(scope, receive, send)
+            return
+        
+        global profiles_in_flight
+        profiles_in_flight += 1
+        sampler = StackSampler(threading.get_ident(), PROFILE_INTERVAL_SECONDS)
+        started = time.perf_counter()
+        sampler.start()
+        
+        def stop_sampler():
+            global profiles_in_flight
+            if not sampler.done.is_set():
+                sampler.stop()
+                profiles_in_flight -= 1
+        
+        async def send_with_profile(message):
+            if message["type"] == "http.response.start":
+                stop_sampler()
+                duration_ms = round((time.perf_counter() - started) * 1000, 1)
+                # Unmatched paths (404s) have no route; key them by the raw path
+                path = getattr(scope.get("route"), "path", scope["path"])
+                profile_id = await store_profile(scope["method"], path, message["status"], sampler, duration_ms)
+                if profile_id:
+                    message = {**message, "headers": [*message.get("headers", []), (b"x-profile-id", profile_id.encode())]}
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_with_profile)
+        finally:
+            stop_sampler()
+
+def list_profiles() -> List[dict]:
+    profiles = []
+    for meta_path in PROFILE_DIR.glob("*/*.json"):
+        try:
+            profiles.append(json.loads(meta_path.read_text(encoding='utf-8')))
+        except (OSError, ValueError):
+            continue
+    return sorted(profiles, key=lambda meta: meta["id"], reverse=True)
+
+@api_router.get("/admin/profiles", dependencies=[Depends(require_admin_code)])
+async def get_profiles(route: Optional[str] = None):
+    """List stored request profiles, newest first"""
+    profiles = await asyncio.to_thread(list_profiles)
+    if route:
+        profiles = [meta for meta in profiles if meta["route"] == route]
+    return {"profiles": profiles, "sample_rate": PROFILE_SAMPLE_RATE}
+
+@api_router.get("/admin/profiles/{profile_id}", dependencies=[Depends(require_admin_code)])
+async def get_profile(profile_id: str):
+    """Fetch one profile as folded stacks, ready for flamegraph.pl or speedscope"""
+    if not re.fullmatch(r'\d+-[0-9a-f]{8}', profile_id):
+        raise HTTPException(status_code=404, detail="Profile not found")
+    matches = list(PROFILE_DIR.glob(f"*/{profile_id}.folded"))
+    if not matches:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    content = await asyncio.to_thread(matches[0].read_text, encoding='utf-8')
+    return Response(content=content, media_type="text/plain")
+
+# ============== RESOURCE CATALOG ==============
+
+# Category display names and icons, keyed by category id
+with open(ROOT_DIR / 'data' / 'resource_categories.json', encoding='utf-8') as f:
+    RESOURCE_CATEGORIES_INFO: Dict[str, dict] = json.load(f)
+
+# language -> {"resources", "summaries", "by_id", "search_index", "version", "built_at"}
+resource_catalog: Dict[str, dict] = {}
+resource_catalog_locks: Dict[str, asyncio.Lock] = {}
+# language -> {"categories", "version", "built_at"}
+category_catalog: Dict[str, dict] = {}
+
+# Fields served by the list endpoint unless fields= asks otherwise; article
+# bodies are only sent by the detail endpoint or on explicit request
+RESOURCE_LIST_FIELDS = (
+    "id", "category", "type", "title", "description", "video_url", "thumbnail_url",
+    "author", "author_credentials", "duration", "read_time", "is_featured",
+)
+RESOURCE_FIELDS = RESOURCE_LIST_FIELDS + ("content",)
+
+def serialize_resource(r: dict) -> dict:
+    return {
+        "id": r["id"],
+        "category": r["category"],
+        "type": r["type"],
+        "title": r["title"],
+        "description": r["description"],
+        "content": r.get("content"),
+        "video_url": r.get("video_url"),
+        "thumbnail_url": r.get("thumbnail_url"),
+        "author": r.get("author"),
+        "author_credentials": r.get("author_credentials"),
+        "duration": r.get("duration"),
+        "read_time": r.get("read_time"),
+        "is_featured": r.get("is_featured", False),
+    }
+
+async def build_resource_catalog(language: str) -> dict:
+    """Load every resource for a language into an immutable snapshot"""
+    resources = await db.resources.find({"language": language}).sort(
+        [("is_featured", -1), ("order", 1), ("created_at", -1)]
+    ).to_list(None)
+    items = [serialize_resource(r) for r in resources]
+    
+    payload = json.dumps(items, sort_keys=True, default=str).encode()
+    return {
+        "resources": items,
+        "summaries": [{field: item[field] for field in RESOURCE_LIST_FIELDS} for item in items],
+        "by_id": {item["id"]: item for item in items},
+        # Built in a thread so large catalogs don't stall the event loop
+        "search_index": await asyncio.to_thread(ResourceSearchIndex, items, language),
+        "version": hashlib.sha256(payload).hexdigest()[:20],
+        "built_at": time.monotonic()
+    }
+
+async def rebuild_resource_category_counts():
+    """Recompute the materialized per-language category counts from scratch"""
+    result = await db.resources.aggregate([
+        {"$group": {"_id": {"language": "$language", "category": "$category"}, "count": {"$sum": 1}}}
+    ]).to_list(None)
+    
+    counts: Dict[str, Dict[str, int]] = {}
+    for row in result:
+        counts.setdefault(row["_id"]["language"], {})[row["_id"]["category"]] = row["count"]
+    
+    now = datetime.utcnow()
+    for language, language_counts in counts.items():
+        await db.resource_category_counts.replace_one(
+            {"_id": language},
+            {"counts": language_counts, "updated_at": now},
+            upsert=True
+        )
+    await db.resource_category_counts.delete_many({"_id": {"$nin": list(counts)}})
+
+async def build_category_catalog(language: str) -> dict:
+    """Build the categories snapshot from the materialized counts document"""
+    doc = await db.resource_category_counts.find_one({"_id": language})
+    if doc is None and await db.resource_category_counts.estimated_document_count() == 0:
+        # Counts were never materialized (e.g. resources created before this existed)
+        await rebuild_resource_category_counts()
+        doc = await db.resource_category_counts.find_one({"_id": language})
+    
+    counts = (doc or {}).get("counts", {})
+    categories = [{
+        "id": category,
+        "name": RESOURCE_CATEGORIES_INFO.get(category, {}).get(f"name_{language}", category),
+        "icon": RESOURCE_CATEGORIES_INFO.get(category, {}).get("icon", "document"),
+        "count": count
+    } for category, count in sorted(counts.items(), key=lambda c: c[1], reverse=True) if count > 0]
+    
+    payload = json.dumps(categories, sort_keys=True).encode()
+    return {
+        "categories": categories,
+        "version": hashlib.sha256(payload).hexdigest()[:20],
+        "built_at": time.monotonic()
+    }
+
+async def get_resource_catalog(language: str) -> dict:
+    """Return the catalog snapshot for a language, building it on first use.
+
+    Snapshots are rebuilt on every write made through this process; the TTL
+    bounds staleness for writes made by other workers.
+    """
+    snapshot = resource_catalog.get(language)
+    if snapshot and time.monotonic() - snapshot["built_at"] < RESOURCE_CATALOG_TTL_SECONDS:
+        return snapshot
+    
+    lock = resource_catalog_locks.setdefault(language, asyncio.Lock())
+    async with lock:
+        snapshot = resource_catalog.get(language)
+        if snapshot and time.monotonic() - snapshot["built_at"] < RESOURCE_CATALOG_TTL_SECONDS:
+            return snapshot
+        snapshot = await build_resource_catalog(language)
+        resource_catalog[language] = snapshot
+        return snapshot
+
+async def get_category_catalog(language: str) -> dict:
+    """Return the categories snapshot for a language (same TTL as the resource catalog)"""
+    snapshot = category_catalog.get(language)
+    if snapshot and time.monotonic() - snapshot["built_at"] < RESOURCE_CATALOG_TTL_SECONDS:
+        return snapshot
+    snapshot = await build_category_catalog(language)
+    category_catalog[language] = snapshot
+    return snapshot
+
+async def refresh_resource_catalog(languages: Optional[List[str]] = None):
+    """Rebuild snapshots after a write (all cached languages if none given).
+
+    New snapshots are built first and swapped in together, so readers never
+    see a half-refreshed catalog.
+    """
+    resources = {
+        language: await build_resource_catalog(language)
+        for language in set(languages or []) | set(resource_catalog)
+    }
+    categories = {
+        language: await build_category_catalog(language)
+        for language in set(languages or []) | set(category_catalog)
+    }
+    resource_catalog.update(resources)
+    category_catalog.update(categories)
+
+def catalog_response(request: Request, response: Response, etag: str, body):
+    """Attach caching headers, or answer 304 when the client's copy is current"""
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={RESOURCE_CACHE_MAX_AGE}"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return body
+
 # ============== RESOURCES ENDPOINTS ==============
 
+def parse_resource_fields(fields: Optional[str]) -> Optional[List[str]]:
+    """Validate a fields= sparse fieldset; None means the default list fields"""
+    if not fields:
+        return None
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in requested if f not in RESOURCE_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return ["id"] + [f for f in requested if f != "id"]
+
 @api_router.get("/resources")
-async def get_resources(category: Optional[str] = None, language: str = "es", limit: int = 50):
-    """Get resources (articles and videos)"""
+async def get_resources(
+    request: Request,
+    response: Response,
+    category: Optional[str] = None,
+    language: str = "es",
+    limit: int = 50,
+    fields: Optional[str] = None
+):
+    """Get resources (articles and videos) without article bodies, unless requested via fields="""
+    selected = parse_resource_fields(fields)
     try:
-        query = {"language": language}
-        if category:
-            query["category"] = category
+        catalog = await get_resource_catalog(language)
+        fieldset = ",".join(selected) if selected else "list"
+        etag = f'"{catalog["version"]}-{category or "all"}-{limit}-{hashlib.sha1(fieldset.encode()).hexdigest()[:8]}"'
         
-        resources = await db.resources.find(query).sort([("is_featured", -1), ("order", 1), ("created_at", -1)]).limit(limit).to_list(limit)
-        
-        return [{
-            "id": r["id"],
-            "category": r["category"],
-            "type": r["type"],
-            "title": r["title"],
-            "description": r["description"],
-            "content": r.get("content"),
-            "video_url": r.get("video_url"),
-            "thumbnail_url": r.get("thumbnail_url"),
-            "author": r.get("author"),
-            "author_credentials": r.get("author_credentials"),
-            "duration": r.get("duration"),
-            "read_time": r.get("read_time"),
-            "is_featured": r.get("is_featured", False),
-        } for r in resources]
+        if selected:
+            resources = [{f: r[f] for f in selected} for r in catalog["resources"] if not category or r["category"] == category]
+        else:
+            resources = [r for r in catalog["summaries"] if not category or r["category"] == category]
+        return catalog_response(request, response, etag, resources[:limit])
     except Exception as e:
         logger.error(f"Error getting resources: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @api_router.get("/resources/categories")
-async def get_resource_categories(language: str = "es"):
+async def get_resource_categories(request: Request, response: Response, language: str = "es"):
     """Get available resource categories with counts"""
     try:
-        pipeline = [
-            {"$match": {"language": language}},
-            {"$group": {"_id": "$category", "count": {"$sum": 1}}},
-            {"$sort": {"count": -1}}
-        ]
+        catalog = await get_category_catalog(language)
+        etag = f'"{catalog["version"]}-categories"'
+        return catalog_response(request, response, etag, catalog["categories"])
+    except Exception as e:
+        logger.error(f"Error getting resource categories: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# ============== RESOURCE SEARCH ==============
+
+SEARCH_STOPWORDS = {
+    "es": {
+        "para", "como", "con", "del", "las", "los", "una", "uno", "por", "que", "mas", "sus",
+        "pero", "sin", "sobre", "este", "esta", "estos", "estas", "cuando", "muy", "tambien",
+        "puede", "pueden", "son", "ser", "hay", "tu", "tus", "te", "se", "el", "la", "de", "y", "en", "a",
+    },
+    "en": {
+        "the", "and", "for", "with", "that", "this", "from", "your", "you", "are", "can", "how",
+        "what", "when", "into", "about", "have", "has", "its", "our", "but", "not", "of", "to", "a", "in",
+    },
+}
+
+# Longest suffixes first; a light stemmer that only needs to be consistent
+# between indexing and querying
+SPANISH_SUFFIXES = sorted([
+    "amientos", "imientos", "amiento", "imiento", "aciones", "uciones", "adoras", "adores",
+    "ancias", "encias", "mente", "acion", "ucion", "adora", "ador", "ancia", "encia",
+    "ables", "ibles", "istas", "able", "ible", "ista", "osos", "osas", "oso", "osa",
+    "ivos", "ivas", "ivo", "iva", "idad", "ando", "iendo", "ados", "idos", "adas", "idas",
+    "ado", "ido", "ada", "ida", "ar", "er", "ir", "es", "os", "as", "a", "o", "e", "s",
+], key=len, reverse=True)
+
+ENGLISH_SUFFIXES = sorted([
+    "izations", "ization", "ations", "ation", "nesses", "ness", "ments", "ment", "ings", "ing",
+    "edly", "ies", "ied", "ers", "er", "ed", "ly", "es", "s", "e",
+], key=len, reverse=True)
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+SEARCH_FIELD_WEIGHTS = {"title": 3, "description": 2, "content": 1}
+
+def fold_accents(text: str) -> str:
+    # NFKD splits accented letters into base + combining mark; the ASCII encode drops the mark
+    return unicodedata.normalize("NFKD", text.lower()).encode("ascii", "ignore").decode("ascii")
+
+@lru_cache(maxsize=65536)
+def stem(word: str, language: str) -> str:
+    suffixes = ENGLISH_SUFFIXES if language == "en" else SPANISH_SUFFIXES
+    for suffix in suffixes:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            word = word[:-len(suffix)]
+            if suffix in ("ies", "ied"):
+                word += "y"
+            break
+    return word
+
+def search_term_counts(text: str, language: str) -> Dict[str, int]:
+    """Stemmed term frequencies of a text, without stopwords"""
+    stopwords = SEARCH_STOPWORDS.get(language, SEARCH_STOPWORDS["es"])
+    counts: Dict[str, int] = {}
+    for token, count in Counter(re.findall(r"[a-z0-9]+", fold_accents(text))).items():
+        if token not in stopwords and len(token) > 1:
+            term = stem(token, language)
+            counts[term] = counts.get(term, 0) + count
+    return counts
+
+class ResourceSearchIndex:
+    """BM25 inverted index over the resources of one language.
+
+    Each term's postings hold precomputed BM25 weights, so a query is a few
+    numpy scatter-adds and a partial sort regardless of catalog size.
+    """
+
+    def __init__(self, items: List[dict], language: str):
+        import numpy as np
         
-        result = await db.resources.aggregate(pipeline).to_list(100)
+        self.language = language
+        self.size = len(items)
+        self.categories = np.array([item["category"] for item in items], dtype=object)
         
-        categories_info = {
-            "breathing": {"name_es": "Respiraciones", "name_en": "Breathing", "icon": "leaf"},
-            "stretching": {"name_es": "Estiramientos", "name_en": "Stretching", "icon": "body"},
-            "nutrition": {"name_es": "Nutrición", "name_en": "Nutrition", "icon": "nutrition"},
-            "sleep": {"name_es": "Sueño", "name_en": "Sleep", "icon": "moon"},
-            "mindfulness": {"name_es": "Mindfulness", "name_en": "Mindfulness", "icon": "flower"},
-            "professional": {"name_es": "Consejos profesionales", "name_en": "Professional advice", "icon": "medkit"},
-        }
+        term_freqs: List[Dict[str, int]] = []
+        doc_lengths = np.zeros(self.size, dtype=np.float32)
+        for i, item in enumerate(items):
+            freqs: Dict[str, int] = {}
+            for field, weight in SEARCH_FIELD_WEIGHTS.items():
+                for term, count in search_term_counts(item.get(field) or "", language).items():
+                    freqs[term] = freqs.get(term, 0) + count * weight
+            term_freqs.append(freqs)
+            doc_lengths[i] = sum(freqs.values())
         
-        return [{
-            "id": cat["_id"],
-            "name": categories_info.get(cat["_id"], {}).get(f"name_{language}", cat["_id"]),
-            "icon": categories_info.get(cat["_id"], {}).get("icon", "document"),
-            "count": cat["count"]
-        } for cat in result]
+        postings: Dict[str, Tuple[List[int], List[int]]] = {}
+        for i, freqs in enumerate(term_freqs):
+            for term, tf in freqs.items():
+                ids, tfs = postings.setdefault(term, ([], []))
+                ids.append(i)
+                tfs.append(tf)
+        
+        avg_length = float(doc_lengths.mean()) if self.size else 1.0
+        norms = BM25_K1 * (1 - BM25_B + BM25_B * doc_lengths / max(avg_length, 1.0))
+        self.postings: Dict[str, Tuple["np.ndarray", "np.ndarray"]] = {}
+        for term, (ids, tfs) in postings.items():
+            ids = np.array(ids, dtype=np.int32)
+            tfs = np.array(tfs, dtype=np.float32)
+            idf = np.log(1 + (self.size - len(ids) + 0.5) / (len(ids) + 0.5))
+            self.postings[term] = (ids, (idf * tfs * (BM25_K1 + 1) / (tfs + norms[ids])).astype(np.float32))
+
+    def search(self, query: str, limit: int, category: Optional[str] = None) -> List[Tuple[int, float]]:
+        """Return (item index, score) pairs, best first"""
+        import numpy as np
+        
+        scores = np.zeros(self.size, dtype=np.float32)
+        matched = False
+        for term in search_term_counts(query, self.language):
+            posting = self.postings.get(term)
+            if posting:
+                scores[posting[0]] += posting[1]
+                matched = True
+        if not matched:
+            return []
+        if category:
+            scores[self.categories != category] = 0
+        
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > limit:
+            candidates = candidates[np.argpartition(scores[candidates], -limit)[-limit:]]
+        ranked = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [(int(i), round(float(scores[i]), 4)) for i in ranked]
+
+@api_router.get("/resources/search")
+async def search_resources(q: str, language: str = "es", category: Optional[str] = None, limit: int = 20):
+    """Full-text search over resource titles, descriptions and content"""
+    try:
+        catalog = await get_resource_catalog(language)
+        results = catalog["search_index"].search(q, max(1, min(limit, 100)), category)
+        return [{**catalog["summaries"][i], "score": score} for i, score in results]
     except Exception as e:
-        logger.error(f"Error getting resource categories: {e}")
+        logger.error(f"Error searching resources: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @api_router.post("/resources")
 async def create_resource(resource: Resource):
     """Create a new resource (admin only)"""
+    if resource.category.startswith("$") or "." in resource.category:
+        raise HTTPException(status_code=400, detail="Invalid category")
     try:
         await db.resources.insert_one(resource.model_dump())
+        await db.resource_category_counts.update_one(
+            {"_id": resource.language},
+            {
+                "$inc": {f"counts.{resource.category}": 1},
+                "$set": {"updated_at": datetime.utcnow()}
+            },
+            upsert=True
+        )
+        await refresh_resource_catalog([resource.language])
         return {"success": True, "id": resource.id}
     except Exception as e:
         logger.error(f"Error creating resource: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# ============== CONTENT PACKS ==============
+
+# Namespace for deriving stable resource ids from pack keys
+RESOURCE_ID_NAMESPACE = uuid.UUID("6f1c9a52-3d0e-4b8a-9c47-2a5e8d1f0b63")
+# Fields identifying a resource written by the old destructive seed
+LEGACY_SEED_FIELDS = ("language", "category", "type", "title", "video_url", "author")
+
+def load_content_packs() -> List[dict]:
+    """Read every JSON/YAML content pack from CONTENT_PACKS_DIR"""
+    packs = []
+    for path in sorted(CONTENT_PACKS_DIR.glob("*")):
+        if path.suffix == ".json":
+            packs.append(json.loads(path.read_text(encoding="utf-8")))
+        elif path.suffix in (".yaml", ".yml"):
+            if yaml is None:
+                logger.warning(f"Skipping content pack {path.name}: PyYAML is not installed")
+                continue
+            packs.append(yaml.safe_load(path.read_text(encoding="utf-8")))
+    return packs
+
+def pack_resource_doc(pack: dict, item: dict) -> dict:
+    """Validate a pack item and turn it into a stored resource document"""
+    fields = {k: v for k, v in item.items() if k != "key"}
+    fields.setdefault("language", pack.get("language", "es"))
+    resource = Resource(id=str(uuid.uuid5(RESOURCE_ID_NAMESPACE, f"{pack['pack']}:{item['key']}")), **fields)
+    
+    doc = resource.model_dump(exclude={"created_at"})
+    doc.update({"pack": pack["pack"], "pack_key": item["key"]})
+    doc["content_hash"] = hashlib.sha256(json.dumps(doc, sort_keys=True).encode()).hexdigest()
+    return doc
+
+async def apply_content_pack(pack: dict, force: bool = False) -> dict:
+    """Bring the stored resources of one pack in line with its file.
+
+    Resources are matched by their stable pack key; only new, changed and
+    removed ones are written, in a single unordered bulk write.
+    """
+    name, version = pack["pack"], pack["version"]
+    report = {"pack": name, "version": version, "skipped": False,
+              "inserted": 0, "updated": 0, "deleted": 0, "unchanged": 0}
+    
+    applied = await db.content_packs.find_one({"_id": name})
+    if applied and applied.get("version", 0) >= version and not force:
+        report["skipped"] = True
+        return report
+    
+    docs = {item["key"]: pack_resource_doc(pack, item) for item in pack.get("resources", [])}
+    stored = await db.resources.find(
+        {"pack": name},
+        {"_id": 0, "pack_key": 1, "content_hash": 1}
+    ).to_list(None)
+    stored_hashes = {d["pack_key"]: d.get("content_hash") for d in stored}
+    
+    now = datetime.utcnow()
+    operations = []
+    for key, doc in docs.items():
+        if key not in stored_hashes:
+            report["inserted"] += 1
+        elif stored_hashes[key] != doc["content_hash"]:
+            report["updated"] += 1
+        else:
+            report["unchanged"] += 1
+            continue
+        operations.append(UpdateOne(
+            {"pack": name, "pack_key": key},
+            {"$set": doc, "$setOnInsert": {"created_at": now}},
+            upsert=True
+        ))
+    
+    removed = [key for key in stored_hashes if key not in docs]
+    if removed:
+        operations.append(DeleteMany({"pack": name, "pack_key": {"$in": removed}}))
+    
+    # Resources from the old destructive seed carry no pack. A pack that replaces
+    # them says so, and only rows identical in every field the seed wrote are
+    # dropped, so admin-created resources with the same title stay.
+    if pack.get("replaces_legacy_seed"):
+        for doc in docs.values():
+            operations.append(DeleteMany({
+                "pack": {"$exists": False},
+                **{field: doc[field] for field in LEGACY_SEED_FIELDS}
+            }))
+    
+    if operations:
+        result = await db.resources.bulk_write(operations, ordered=False)
+        report["deleted"] = result.deleted_count
+    
+    await db.content_packs.replace_one(
+        {"_id": name},
+        {"version": version, "applied_at": now, "resources": len(docs)},
+        upsert=True
+    )
+    return report
+
 # Seed some initial resources
 @api_router.post("/resources/seed")
-async def seed_resources():
-    """Seed initial resources for testing"""
+async def seed_resources(force: bool = False):
+    """Load the content packs, applying only what changed since the stored version"""
     try:
-        # Delete existing resources first to allow re-seeding
-        await db.resources.delete_many({})
+        packs = load_content_packs()
+        reports = [await apply_content_pack(pack, force) for pack in packs]
         
-        initial_resources = [
-            {
-                "id": str(uuid.uuid4()),
-                "category": "breathing",
-                "type": "video",
-                "title": "Respiración diafragmática para el dolor",
-                "description": "Técnica de respiración profunda que ayuda a reducir la tensión muscular y calmar el sistema nervioso.",
-                "video_url": "https://www.youtube.com/watch?v=YRPh_GaiL8s",
-                "thumbnail_url": "https://images.unsplash.com/photo-1506126613408-eca07ce68773?w=400",
-                "author": "Fisioterapia Online",
-                "author_credentials": "Fisioterapeutas especializados",
-                "duration": "5:42",
-                "language": "es",
-                "is_featured": True,
-                "order": 1,
-                "created_at": datetime.utcnow()
-            },
-            {
-                "id": str(uuid.uuid4()),
-                "category": "stretching",
-                "type": "video",
-                "title": "Estiramientos suaves para fibromialgia",
-                "description": "Rutina de estiramientos suaves diseñada específicamente para personas con fibromialgia.",
-                "video_url": "https://www.youtube.com/watch?v=4pKly2JojMw",
-                "thumbnail_url": "https://images.unsplash.com/photo-1544367567-0f2fcb009e0b?w=400",
-                "author": "Fibromialgia Noticias",
-                "author_credentials": "Especialistas en fibromialgia",
-                "duration": "15:30",
-                "language": "es",
-                "is_featured": True,
-                "order": 2,
-                "created_at": datetime.utcnow()
-            },
-            {
-                "id": str(uuid.uuid4()),
-                "category": "mindfulness",
-                "type": "video",
-                "title": "Meditación guiada para el dolor crónico",
-                "description": "Meditación de 10 minutos para ayudar a gestionar el dolor crónico con técnicas de mindfulness.",
-                "video_url": "https://www.youtube.com/watch?v=inpok4MKVLM",
-                "thumbnail_url": "https://images.unsplash.com/photo-1499209974431-9dddcece7f88?w=400",
-                "author": "Mindfulness España",
-                "author_credentials": "Instructores certificados de mindfulness",
-                "duration": "10:00",
-                "language": "es",
-                "is_featured": False,
-                "order": 3,
-                "created_at": datetime.utcnow()
-            },
-            {
-                "id": str(uuid.uuid4()),
-                "category": "sleep",
-                "type": "video",
-                "title": "Técnicas para mejorar el sueño",
-                "description": "Consejos y técnicas para mejorar la calidad del sueño cuando tienes dolor crónico.",
-                "video_url": "https://www.youtube.com/watch?v=t0kACis_dJE",
-                "thumbnail_url": "https://images.unsplash.com/photo-1541781774459-bb2af2f05b55?w=400",
-                "author": "Salud y Bienestar",
-                "author_credentials": "Especialistas en trastornos del sueño",
-                "duration": "8:15",
-                "language": "es",
-                "is_featured": False,
-                "order": 4,
-                "created_at": datetime.utcnow()
-            },
-            {
-                "id": str(uuid.uuid4()),
-                "category": "professional",
-                "type": "video",
-                "title": "¿Qué es la fibromialgia? Explicación médica",
-                "description": "Un profesional médico explica qué es la fibromialgia, sus síntomas y opciones de tratamiento.",
-                "video_url": "https://www.youtube.com/watch?v=_4Vt88jIKAs",
-                "thumbnail_url": "https://images.unsplash.com/photo-1576091160399-112ba8d25d1d?w=400",
-                "author": "Dr. Medical",
-                "author_credentials": "Reumatólogo",
-                "duration": "12:45",
-                "language": "es",
-                "is_featured": False,
-                "order": 5,
-                "created_at": datetime.utcnow()
-            },
-            {
-                "id": str(uuid.uuid4()),
-                "category": "nutrition",
-                "type": "video",
-                "title": "Alimentación antiinflamatoria",
-                "description": "Alimentos que pueden ayudar a reducir la inflamación y mejorar los síntomas de fibromialgia.",
-                "video_url": "https://www.youtube.com/watch?v=Yv1v7-RFnNE",
-                "thumbnail_url": "https://images.unsplash.com/photo-1512621776951-a57141f2eefd?w=400",
-                "author": "Nutrición Consciente",
-                "author_credentials": "Nutricionistas especializados",
-                "duration": "11:20",
-                "language": "es",
-                "is_featured": False,
-                "order": 6,
-                "created_at": datetime.utcnow()
+        if any(r["inserted"] or r["updated"] or r["deleted"] for r in reports):
+            await rebuild_resource_category_counts()
+            await refresh_resource_catalog()
+        
+        return {
+            "message": "Resources seeded successfully",
+            "count": sum(len(pack.get("resources", [])) for pack in packs),
+            "packs": reports
+        }
+    except Exception as e:
+        logger.error(f"Error seeding resources: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/resources/{resource_id}")
+async def get_resource(resource_id: str, request: Request, response: Response):
+    """Get a single resource, including the article content"""
+    try:
+        for catalog in list(resource_catalog.values()):
+            resource = catalog["by_id"].get(resource_id)
+            if resource:
+                break
+        else:
+            found = await db.resources.find_one({"id": resource_id})
+            if not found:
+                raise HTTPException(status_code=404, detail="Resource not found")
+            resource = serialize_resource(found)
+        
+        digest = hashlib.sha256(json.dumps(resource, sort_keys=True, default=str).encode()).hexdigest()[:20]
+        return catalog_response(request, response, f'"{digest}"', resource)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting resource: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# ============== HOME SCREEN ==============
+
+async def home_section(name: str, coro, timeout: float):
+    """Run one section of the home payload; return (value, error) without raising"""
+    try:
+        return await asyncio.wait_for(coro, timeout), None
+    except asyncio.TimeoutError:
+        logger.warning(f"Home section {name} timed out after {timeout}s")
+        return None, "timeout"
+    except HTTPException as e:
+        return None, str(e.detail)
+    except Exception as e:
+        logger.error(f"Error building home section {name}: {e}")
+        return None, "error"
+
+async def home_resources(language: str, limit: int) -> List[dict]:
+    catalog = await get_resource_catalog(language)
+    return catalog["summaries"][:limit]
+
+@api_router.get("/home/{device_id}")
+async def get_home(
+    device_id: str,
+    language: str = "es",
+    diary_limit: int = 30,
+    patterns_days: int = 7,
+    conversations_limit: int = 20,
+    resources_limit: int = 50
+):
+    """Everything the home screen loads on launch, fetched concurrently.
+
+    Each section has its own timeout; a slow or failing section comes back
+    as null with its reason under "errors" instead of failing the request.
+    """
+    sections = {
+        "subscription": get_subscription_status_internal(device_id),
+        "diary": get_diary_entries(device_id, diary_limit, 0),
+        "patterns": get_patterns(device_id, patterns_days),
+        "conversations": get_conversations(device_id, conversations_limit),
+        "resources": home_resources(language, resources_limit),
+    }
+    results = await asyncio.gather(*(
+        home_section(name, coro, HOME_SECTION_TIMEOUT_SECONDS) for name, coro in sections.items()
+    ))
+    
+    payload = {"device_id": device_id, "errors": {}}
+    for name, (value, error) in zip(sections, results):
+        payload[name] = value
+        if error is not None:
+            payload["errors"][name] = error
+    return payload
+
+# ============== DELTA SYNC ==============
+
+# Device-owned collections served by /sync; every write stamps sync_seq from
+# the device's counter in sync_counters, and deletes leave a tombstone.
+# Deleting a conversation also deletes its messages; only the conversation
+# gets a tombstone.
+SYNC_COLLECTIONS = ("diary_entries", "chat_conversations", "chat_messages", "cycle_entries", "monthly_records")
+# Archived conversations are sent as chat_conversations with archived: true
+SYNC_ARCHIVE_PROJECTION = {"_id": 0, "codec": 0, "messages": 0}
+
+async def reserve_sync_seqs(device_id: str, count: int = 1) -> int:
+    """Take the next count change numbers for a device and mark them in flight; returns the first.
+
+    The counter and the in-flight list change in one compare-and-set update,
+    so /sync never sees a number handed out without its reservation.
+    """
+    while True:
+        counter = await db.sync_counters.find_one({"device_id": device_id}, {"_id": 0, "seq": 1})
+        if counter is None:
+            try:
+                await db.sync_counters.insert_one({"device_id": device_id, "seq": 0, "pending": []})
+            except DuplicateKeyError:
+                pass
+            continue
+        seq = counter.get("seq", 0)
+        result = await db.sync_counters.update_one(
+            {"device_id": device_id, "seq": seq},
+            {"$set": {"seq": seq + count}, "$push": {"pending": {"seq": seq + 1, "at": datetime.utcnow()}}}
+        )
+        if result.modified_count:
+            return seq + 1
+
+@asynccontextmanager
+async def sync_write(device_id: str, count: int = 1):
+    """Reserve change numbers for a write; yields the first.
+
+    Until the block exits, /sync hands out tokens below the reservation, so
+    a document stamped with it can't land behind a token a client holds.
+    """
+    first = await reserve_sync_seqs(device_id, count)
+    try:
+        yield first
+    finally:
+        await db.sync_counters.update_one({"device_id": device_id}, {"$pull": {"pending": {"seq": first}}})
+
+def sync_fields(sync_seq: int) -> dict:
+    """Fields every synced write sets"""
+    return {"sync_seq": sync_seq, "updated_at": datetime.utcnow()}
+
+async def sync_watermark(device_id: str) -> Tuple[int, int]:
+    """(epoch, highest change number with no write still in flight at or below it).
+
+    Reservations older than SYNC_RESERVATION_TIMEOUT_SECONDS belong to writes
+    that died; they are dropped here and no longer hold the token back.
+    """
+    counter = await db.sync_counters.find_one({"device_id": device_id})
+    if not counter:
+        return 0, 0
+    cutoff = datetime.utcnow() - timedelta(seconds=SYNC_RESERVATION_TIMEOUT_SECONDS)
+    pending = counter.get("pending", [])
+    live = [reservation["seq"] for reservation in pending if reservation["at"] > cutoff]
+    if len(live) < len(pending):
+        await db.sync_counters.update_one({"device_id": device_id}, {"$pull": {"pending": {"at": {"$lte": cutoff}}}})
+    return counter.get("epoch", 0), min(live) - 1 if live else counter.get("seq", 0)
+
+def format_sync_token(epoch: int, seq: int) -> str:
+    # Tokens from before the first purge carry no epoch
+    return f"{epoch}.{seq}" if epoch else str(seq)
+
+def parse_sync_token(token: str) -> Tuple[int, int]:
+    """(epoch, change number) of a sync token; raises ValueError if malformed"""
+    epoch, _, seq = token.rpartition(".")
+    return int(epoch) if epoch else 0, int(seq)
+
+async def record_tombstones(device_id: str, collection: str, ids: List[str]):
+    if not ids:
+        return
+    now = datetime.utcnow()
+    async with sync_write(device_id, len(ids)) as first:
+        await db.sync_tombstones.insert_many([
+            {"device_id": device_id, "collection": collection, "id": doc_id, "sync_seq": first + i, "deleted_at": now}
+            for i, doc_id in enumerate(ids)
+        ])
+
+async def stamp_unsynced_documents(device_id: str):
+    """Give documents written before delta sync existed their own change numbers"""
+    for name in (*SYNC_COLLECTIONS, "chat_archive"):
+        docs = await db[name].find(
+            {"device_id": device_id, "sync_seq": {"$exists": False}}, {"_id": 1}
+        ).to_list(None)
+        if not docs:
+            continue
+        async with sync_write(device_id, len(docs)) as first:
+            await db[name].bulk_write([
+                UpdateOne({"_id": doc["_id"], "sync_seq": {"$exists": False}}, {"$set": {"sync_seq": first + i}})
+                for i, doc in enumerate(docs)
+            ], ordered=False)
+
+@api_router.get("/sync/{device_id}")
+async def sync_changes(device_id: str, since: Optional[str] = None):
+    """Changes to a device's data since a change token.
+
+    Omit since for a full download. Pass the returned token on the next
+    call; while has_more is true, call again straight away. Apply
+    deletions before upserts. Documents may be repeated across calls, so
+    clients should upsert by id. A conversation with archived: true has
+    moved to cold storage: clients may drop its local messages, which come
+    back through sync once it is opened again. When reset is true the
+    device's data was purged after the token was issued: drop all local
+    data first, then apply the response as a full download.
+    """
+    try:
+        since_epoch, since_seq = parse_sync_token(since) if since else (0, -1)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid sync token")
+    
+    try:
+        # Take the token before querying, below any write still in flight:
+        # anything stamped after it is sent next time rather than skipped
+        epoch, watermark = await sync_watermark(device_id)
+        reset = bool(since) and since_epoch != epoch
+        if reset:
+            since_seq = -1
+        if since_seq < 0:
+            await stamp_unsynced_documents(device_id)
+            epoch, watermark = await sync_watermark(device_id)
+        
+        sources = [
+            *((db[name], {"_id": 0}) for name in SYNC_COLLECTIONS),
+            (db.chat_archive, SYNC_ARCHIVE_PROJECTION),
+            (db.sync_tombstones, {"_id": 0}),
+        ]
+        query = {"device_id": device_id, "sync_seq": {"$gt": since_seq}}
+        results = await asyncio.gather(*(
+            collection.find(query, projection).sort("sync_seq", 1).limit(SYNC_PAGE_SIZE).to_list(SYNC_PAGE_SIZE)
+            for collection, projection in sources
+        ))
+        
+        # A full page may have more behind it: resume just below the lowest
+        # last number among full pages
+        token = watermark
+        full = [i for i, page in enumerate(results) if len(page) == SYNC_PAGE_SIZE]
+        if full:
+            token = min(token, min(results[i][-1]["sync_seq"] for i in full) - 1)
+            if token <= since_seq < watermark:
+                # A page holds nothing but the next number: more documents
+                # share it than fit in a page. Send all of them at once, so
+                # the token always moves forward.
+                token = since_seq + 1
+                for i in full:
+                    if results[i][-1]["sync_seq"] == token:
+                        collection, projection = sources[i]
+                        results[i] = await collection.find(
+                            {"device_id": device_id, "sync_seq": token}, projection
+                        ).to_list(None)
+        pages, (archived, tombstones) = results[:len(SYNC_COLLECTIONS)], results[len(SYNC_COLLECTIONS):]
+        
+        deleted: Dict[str, List[str]] = {name: [] for name in SYNC_COLLECTIONS}
+        for tombstone in tombstones:
+            if tombstone["sync_seq"] <= token:
+                deleted[tombstone["collection"]].append(tombstone["id"])
+        changes = {}
+        for name, page in zip(SYNC_COLLECTIONS, pages):
+            changes[name] = {
+                "upserted": [doc for doc in page if doc["sync_seq"] <= token],
+                "deleted": deleted[name]
             }
+        changes["chat_conversations"]["upserted"] += [
+            {**doc, "archived": True} for doc in archived if doc["sync_seq"] <= token
         ]
         
-        await db.resources.insert_many(initial_resources)
-        return {"message": "Resources seeded successfully", "count": len(initial_resources)}
+        return {
+            "device_id": device_id,
+            "token": format_sync_token(epoch, token),
+            "has_more": bool(full),
+            "reset": reset,
+            "changes": changes
+        }
     except Exception as e:
-        logger.error(f"Error seeding resources: {e}")
+        logger.error(f"Error syncing device {device_id}: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 # ============== ROOT ENDPOINTS ==============
@@ -996,11 +3640,156 @@ async def root():
 
 @api_router.get("/health")
 async def health_check():
+    """Liveness: the process is up and serving requests"""
     return {"status": "healthy"}
 
+@api_router.get("/metrics")
+async def get_metrics():
+    """Prometheus scrape endpoint"""
+    return Response(content=render_metrics(), media_type="text/plain; version=0.0.4")
+
+@api_router.get("/ready")
+async def readiness_check():
+    """Readiness: start-up warm-up has finished and MongoDB answers"""
+    if not app_ready.is_set():
+        raise HTTPException(status_code=503, detail="Starting up")
+    try:
+        await db.command("ping")
+    except Exception as e:
+        logger.error(f"Readiness check failed: {e}")
+        raise HTTPException(status_code=503, detail="Database unavailable")
+    return {"status": "ready"}
+
+background_tasks: List[asyncio.Task] = []
+
+def spawn_background(coro) -> asyncio.Task:
+    """Start a one-off task that is cancelled on shutdown and forgotten once done"""
+    task = asyncio.create_task(coro)
+    background_tasks.append(task)
+    task.add_done_callback(background_tasks.remove)
+    return task
+
+async def dedupe_monthly_records():
+    """Keep only the newest monthly record per device, so the unique index can be built.
+
+    The upsert used before the index existed could race and insert a second
+    record for a device. Skipped once the unique index is in place.
+    """
+    index = (await db.monthly_records.index_information()).get("device_id_1")
+    if index and index.get("unique"):
+        return
+    duplicates = await db.monthly_records.aggregate([
+        {"$sort": {"updated_at": -1, "_id": -1}},
+        {"$group": {"_id": "$device_id", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+    ]).to_list(None)
+    extra = [doc_id for group in duplicates for doc_id in group["ids"][1:]]
+    if extra:
+        await db.monthly_records.delete_many({"_id": {"$in": extra}})
+        logger.warning(f"Removed {len(extra)} duplicate monthly records for {len(duplicates)} devices")
+
+async def create_indexes():
+    await dedupe_monthly_records()
+    await asyncio.gather(
+        # Supports the trial sweeper's bulk update_many
+        db.subscriptions.create_index([("status", 1), ("usage_seconds", 1)]),
+        db.diary_entries.create_index([("device_id", 1), ("created_at", -1)]),
+        db.cycle_entries.create_index([("device_id", 1), ("start_date", 1)]),
+        # One monthly record per device; makes concurrent per-day upserts safe
+        db.monthly_records.create_index("device_id", unique=True),
+        db.pain_cycle_archive.create_index([("device_id", 1), ("cycle_start_date", -1)]),
+        # Delta sync: change counters, per-collection change numbers and tombstones
+        db.sync_counters.create_index("device_id", unique=True),
+        *(db[name].create_index([("device_id", 1), ("sync_seq", 1)]) for name in SYNC_COLLECTIONS),
+        db.sync_tombstones.create_index([("device_id", 1), ("sync_seq", 1)]),
+        # Chat retention: idle scan, archive listing and expiry
+        db.chat_conversations.create_index("updated_at"),
+        db.chat_archive.create_index("id", unique=True),
+        db.chat_archive.create_index([("device_id", 1), ("updated_at", -1)]),
+        db.chat_archive.create_index([("device_id", 1), ("sync_seq", 1)]),
+        ensure_ttl_index(db.chat_archive, "updated_at", CHAT_ARCHIVE_TTL_DAYS * 86400),
+        db.purge_jobs.create_index("id", unique=True),
+        db.purge_jobs.create_index([("status", 1), ("updated_at", 1)]),
+        db.resources.create_index("id"),
+        db.resources.create_index(
+            [("pack", 1), ("pack_key", 1)],
+            unique=True,
+            partialFilterExpression={"pack": {"$exists": True}}
+        ),
+    )
+
+async def prepare_database():
+    # Concurrent pings make the driver open several pooled connections at once
+    await asyncio.gather(*(client.admin.command("ping") for _ in range(MONGO_WARM_CONNECTIONS)))
+    await create_indexes()
+    # Build resource catalogs and search indexes before the first request
+    languages = await db.resources.distinct("language")
+    await asyncio.gather(*(get_resource_catalog(language) for language in languages))
+
+async def warm_up():
+    """Open pooled Mongo connections, create indexes and build caches, then mark ready.
+
+    Retried with exponential backoff until it succeeds (e.g. once Mongo is
+    reachable); the background loops start only after that.
+    """
+    started = time.perf_counter()
+    delay = WARM_UP_RETRY_SECONDS
+    while True:
+        try:
+            await prepare_database()
+            break
+        except Exception as e:
+            logger.error(f"Warm-up failed, retrying in {delay:g} s: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, WARM_UP_RETRY_MAX_SECONDS)
+    
+    background_tasks.append(asyncio.create_task(run_trial_sweeper()))
+    background_tasks.append(asyncio.create_task(run_rate_limit_evictor()))
+    background_tasks.append(asyncio.create_task(run_chat_archiver()))
+    background_tasks.append(asyncio.create_task(run_purge_resumer()))
+    app_ready.set()
+    logger.info(f"Warm-up finished in {round((time.perf_counter() - started) * 1000)} ms")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global client, db
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], event_listeners=[MongoCommandMetrics()])
+    db = client[os.environ['DB_NAME']]
+    get_http_client()
+    # Liveness is served right away; readiness waits for the warm-up
+    background_tasks.append(asyncio.create_task(warm_up()))
+    
+    yield
+    
+    await shutdown_db_client()
+    await shutdown_http_client()
+    shutdown_report_pool()
+    rate_limiter.close()
+
+async def shutdown_db_client():
+    for task in background_tasks:
+        task.cancel()
+    app_ready.clear()
+    client.close()
+
+async def shutdown_http_client():
+    if http_client is not None:
+        await http_client.aclose()
+
+def shutdown_report_pool():
+    global report_pool
+    if report_pool is not None:
+        report_pool.shutdown(wait=False, cancel_futures=True)
+        report_pool = None
+
+# Create the main app
+app = FastAPI(title="Ágora Mujeres API", description="API for emotional companion app", lifespan=lifespan)
+
 # Include the router in the main app
 app.include_router(api_router)
 
+app.add_middleware(RequestProfilerMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -1008,7 +3797,3 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for the diary analytics behind GET /api/diary/{id}/patterns
+
+Times average_states() and count_common_words() from backend/server.py on
+synthetic diary entries at several sizes, recording best-of-N wall time and
+peak memory (tracemalloc, measured in a separate untimed pass).
+
+Regression gate: save a baseline, then compare later runs against it; the
+script exits with status 1 when any path is slower than the threshold.
+
+    python benchmarks/analytics_benchmark.py --save-baseline baseline.json
+    python benchmarks/analytics_benchmark.py --baseline baseline.json --threshold 0.2
+"""
+
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+
+EMOTIONAL_KEYS = ("calma", "fatiga", "niebla_mental", "dolor_difuso", "gratitud", "tension")
+PHYSICAL_KEYS = ("nivel_dolor", "energia", "sensibilidad")
+
+VOCABULARY = (
+    "hoy me desperté con dolor en la espalda pero el paseo por el parque ayudó "
+    "mucho cansada tranquila niebla mental trabajo familia dormí mal lluvia sol "
+    "gratitud respiración calma ansiedad médica cita ejercicio suave cabeza "
+    "migraña náuseas energía baja alta amiga llamada tarde noche mañana siesta"
+).split()
+
+
+def load_analytics():
+    os.environ.setdefault("MONGO_URL", "mongodb://localhost:1")
+    os.environ.setdefault("DB_NAME", "analytics_benchmark")
+    sys.path.insert(0, str(BACKEND_DIR))
+    import server
+    return {
+        "average_states": server.average_states,
+        "count_common_words": server.count_common_words,
+    }
+
+
+def generate_entries(count, text_words=30, physical_ratio=0.7, text_ratio=0.9, seed=1):
+    """Diary entries shaped like the diary_entries documents get_patterns reads"""
+    rng = random.Random(seed)
+    entries = []
+    for _ in range(count):
+        entry = {
+            "device_id": "bench",
+            "emotional_state": {key: rng.randint(0, 5) for key in EMOTIONAL_KEYS},
+            "physical_state": None,
+            "texto": None,
+        }
+        if rng.random() < physical_ratio:
+            entry["physical_state"] = {key: rng.randint(0, 10) for key in PHYSICAL_KEYS}
+        if rng.random() < text_ratio:
+            entry["texto"] = " ".join(rng.choice(VOCABULARY) for _ in range(text_words))
+        entries.append(entry)
+    return entries
+
+
+def measure(function, entries, repeats):
+    best = float("inf")
+    for _ in range(repeats):
+        gc.collect()
+        started = time.perf_counter()
+        function(entries)
+        best = min(best, time.perf_counter() - started)
+
+    gc.collect()
+    tracemalloc.start()
+    function(entries)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"wall_ms": round(best * 1000, 4), "peak_kib": round(peak / 1024, 1)}
+
+
+def run(args):
+    functions = load_analytics()
+    results = []
+    for size in args.sizes:
+        entries = generate_entries(size, args.text_words, args.physical_ratio, seed=args.seed)
+        # Fewer repeats for the big sizes keeps the 1M run in the minutes range
+        repeats = max(1, min(args.repeats, 10_000_000 // max(size, 1)))
+        for name, function in functions.items():
+            result = {"function": name, "entries": size, "repeats": repeats}
+            result.update(measure(function, entries, repeats))
+            results.append(result)
+            print(json.dumps(result), file=sys.stderr)
+        del entries
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Return the results slower than baseline by more than threshold (a fraction)"""
+    previous = {(item["function"], item["entries"]): item for item in baseline["results"]}
+    regressions = []
+    for result in results:
+        before = previous.get((result["function"], result["entries"]))
+        if not before or before["wall_ms"] <= 0:
+            continue
+        change = result["wall_ms"] / before["wall_ms"] - 1
+        result["change_vs_baseline"] = round(change, 3)
+        if change > threshold:
+            regressions.append(result)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 10_000, 1_000_000])
+    parser.add_argument("--text-words", type=int, default=30, help="words per diary text")
+    parser.add_argument("--physical-ratio", type=float, default=0.7, help="share of entries with a physical state")
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--baseline", help="fail if slower than this saved run")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown vs baseline (0.2 = 20%%)")
+    parser.add_argument("--save-baseline", help="write this run's results here")
+    args = parser.parse_args()
+
+    results = run(args)
+    output = {
+        "config": {
+            "text_words": args.text_words,
+            "physical_ratio": args.physical_ratio,
+            "seed": args.seed,
+            "python": sys.version.split()[0],
+        },
+        "results": results,
+    }
+
+    regressions = []
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        regressions = compare(results, baseline, args.threshold)
+        output["regressions"] = regressions
+
+    print(json.dumps(output, indent=2))
+    if args.save_baseline:
+        Path(args.save_baseline).write_text(json.dumps(output, indent=2) + "\n", encoding="utf-8")
+
+    if regressions:
+        for result in regressions:
+            print(
+                f"REGRESSION {result['function']} @ {result['entries']} entries: "
+                f"{result['change_vs_baseline']:+.0%} wall time",
+                file=sys.stderr
+            )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
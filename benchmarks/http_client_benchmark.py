@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+HTTP client benchmark for Ágora Mujeres
+Compares a new httpx.AsyncClient per request (old get_weather behaviour)
+against the shared, pooled client used by the backend.
+
+Runs against a local Open-Meteo stand-in, so no network access is needed.
+Note that the stand-in is plain HTTP: TLS handshakes, which the shared
+client also saves against the real API, are not part of the numbers.
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+FAKE_WEATHER = json.dumps({
+    "current": {
+        "temperature_2m": 18.4,
+        "relative_humidity_2m": 62,
+        "weather_code": 2,
+        "pressure_msl": 1014.2
+    }
+}).encode()
+
+
+class OpenMeteoStandIn(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(FAKE_WEATHER)))
+        self.end_headers()
+        self.wfile.write(FAKE_WEATHER)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stand_in():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), OpenMeteoStandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def pooled_client():
+    """Same settings as backend/server.py create_http_client()"""
+    return httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=30),
+        timeout=httpx.Timeout(10, connect=5)
+    )
+
+
+async def per_request_client(url, params):
+    async with httpx.AsyncClient() as http_client:
+        response = await http_client.get(url, params=params)
+        return response.json()
+
+
+async def shared_client(http_client, url, params):
+    response = await http_client.get(url, params=params)
+    return response.json()
+
+
+def summarize(name, latencies):
+    latencies = sorted(latencies)
+    return {
+        "mode": name,
+        "requests": len(latencies),
+        "mean_ms": round(statistics.mean(latencies), 3),
+        "p50_ms": round(latencies[len(latencies) // 2], 3),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1], 3),
+    }
+
+
+async def run(requests_count):
+    server = start_stand_in()
+    url = f"http://127.0.0.1:{server.server_address[1]}/v1/forecast"
+    params = {"latitude": 40.4, "longitude": -3.7}
+
+    latencies = []
+    for _ in range(requests_count):
+        started = time.perf_counter()
+        await per_request_client(url, params)
+        latencies.append((time.perf_counter() - started) * 1000)
+    results = [summarize("client_per_request", latencies)]
+
+    latencies = []
+    async with pooled_client() as http_client:
+        for _ in range(requests_count):
+            started = time.perf_counter()
+            await shared_client(http_client, url, params)
+            latencies.append((time.perf_counter() - started) * 1000)
+    results.append(summarize("shared_pooled_client", latencies))
+
+    server.shutdown()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=500)
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args.requests))
+    for result in results:
+        print(json.dumps(result))
+    speedup = results[0]["mean_ms"] / results[1]["mean_ms"]
+    print(f"Shared client is {speedup:.1f}x faster per request")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+Offline load test for the Ágora Mujeres API
+
+Runs backend/server.py in-process, either against a local mongod
+(--mongo-url) or against an in-memory Motor-compatible store
+(mongomock-motor). The LLM, Stripe and Open-Meteo are replaced by local
+stubs, so no network access or API keys are needed.
+
+Drives a mixed workload from concurrent virtual users and prints one JSON
+document with throughput and p50/p95/p99 latency per endpoint, suitable for
+diffing between commits:
+
+    python benchmarks/load_test.py --duration 30 --output before.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import types
+import uuid
+from collections import defaultdict
+from pathlib import Path
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+
+# (name, weight); names are the reported endpoint labels
+WORKLOAD = [
+    ("POST /api/diary", 30),
+    ("GET /api/diary/{device_id}/patterns", 25),
+    ("POST /api/chat", 15),
+    ("GET /api/chat/{device_id}/conversations", 15),
+    ("GET /api/diary/{device_id}", 10),
+    ("GET /api/weather", 5),
+]
+
+WORDS = (
+    "hoy me desperté con dolor en la espalda pero el paseo por el parque ayudó "
+    "mucho cansada tranquila niebla mental trabajo familia dormí mal lluvia sol "
+    "gratitud respiración calma ansiedad médica cita ejercicio suave"
+).split()
+
+FAKE_WEATHER = {
+    "current": {
+        "temperature_2m": 18.4,
+        "relative_humidity_2m": 62,
+        "weather_code": 2,
+        "pressure_msl": 1014.2
+    }
+}
+
+
+def install_llm_stub(latency):
+    """Stand-in for emergentintegrations.llm.chat with a fixed response delay"""
+
+    class UserMessage:
+        def __init__(self, text):
+            self.text = text
+
+    class LlmChat:
+        def __init__(self, api_key=None, session_id=None, system_message=None):
+            self.session_id = session_id
+
+        def with_model(self, provider, model):
+            return self
+
+        async def send_message(self, message):
+            await asyncio.sleep(latency)
+            return "Gracias por compartirlo. ¿Cómo te sientes ahora mismo?"
+
+    chat = types.ModuleType("emergentintegrations.llm.chat")
+    chat.LlmChat = LlmChat
+    chat.UserMessage = UserMessage
+    for name in ("emergentintegrations", "emergentintegrations.llm"):
+        sys.modules.setdefault(name, types.ModuleType(name))
+    sys.modules["emergentintegrations.llm.chat"] = chat
+
+
+def stripe_stub():
+    """Stand-in for the stripe module as used by get_stripe()"""
+
+    class StripeObject(types.SimpleNamespace):
+        pass
+
+    def create_customer(**kwargs):
+        return StripeObject(id=f"cus_{uuid.uuid4().hex[:14]}")
+
+    def create_intent(**kwargs):
+        intent_id = f"pi_{uuid.uuid4().hex[:14]}"
+        return StripeObject(id=intent_id, client_secret=f"{intent_id}_secret", status="requires_payment_method")
+
+    def retrieve_intent(intent_id):
+        return StripeObject(id=intent_id, status="succeeded")
+
+    class StripeError(Exception):
+        pass
+
+    return types.SimpleNamespace(
+        Customer=types.SimpleNamespace(create=create_customer),
+        PaymentIntent=types.SimpleNamespace(create=create_intent, retrieve=retrieve_intent),
+        error=types.SimpleNamespace(StripeError=StripeError),
+    )
+
+
+def weather_client(latency):
+    """Pooled client whose transport answers Open-Meteo requests locally"""
+
+    async def handler(request):
+        await asyncio.sleep(latency)
+        return httpx.Response(200, json=FAKE_WEATHER)
+
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+def load_server(args):
+    os.environ["MONGO_URL"] = args.mongo_url or "mongodb://in-memory"
+    os.environ["DB_NAME"] = args.db_name
+    os.environ.setdefault("EMERGENT_LLM_KEY", "load-test")
+    # Virtual users share a few devices and would otherwise measure the rate limiter
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+    sys.path.insert(0, str(BACKEND_DIR))
+
+    install_llm_stub(args.llm_latency_ms / 1000)
+    import server
+
+    server.get_stripe = stripe_stub
+    server.create_http_client = lambda: weather_client(args.weather_latency_ms / 1000)
+
+    if not args.mongo_url:
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            sys.exit("In-memory mode needs mongomock-motor (pip install mongomock-motor), or pass --mongo-url")
+        store = AsyncMongoMockClient()
+        server.AsyncIOMotorClient = lambda url, **kwargs: store
+    return server
+
+
+def diary_text(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+async def seed(server, devices, entries_per_device, rng):
+    """Admin subscriptions (so chat never hits the trial wall) and some diary history"""
+    now = time.time()
+    for device_id in devices:
+        await server.db.subscriptions.update_one(
+            {"device_id": device_id},
+            {"$set": {"device_id": device_id, "status": "active", "is_admin": True, "usage_seconds": 0}},
+            upsert=True
+        )
+        entries = []
+        for i in range(entries_per_device):
+            entry = server.DiaryEntry(
+                device_id=device_id,
+                texto=diary_text(rng, 40),
+                emotional_state={key: rng.randint(0, 5) for key in server.EmotionalState.model_fields},
+                physical_state={key: rng.randint(0, 10) for key in server.PhysicalState.model_fields} if rng.random() < 0.7 else None,
+            ).model_dump()
+            entry["created_at"] = server.datetime.utcfromtimestamp(now - i * 86400)
+            entries.append(entry)
+        if entries:
+            await server.db.diary_entries.insert_many(entries)
+
+
+def build_request(name, device_id, rng, conversations):
+    """(method, url, json body) for one operation of the workload"""
+    if name == "POST /api/diary":
+        body = {
+            "device_id": device_id,
+            "texto": diary_text(rng, rng.randint(5, 80)),
+            "emotional_state": {"calma": rng.randint(0, 5), "fatiga": rng.randint(0, 5)},
+        }
+        if rng.random() < 0.7:
+            body["physical_state"] = {"nivel_dolor": rng.randint(0, 10), "energia": rng.randint(0, 10)}
+        return "POST", "/api/diary", body
+    if name == "GET /api/diary/{device_id}/patterns":
+        return "GET", f"/api/diary/{device_id}/patterns", None
+    if name == "POST /api/chat":
+        body = {"device_id": device_id, "message": diary_text(rng, 12), "language": "es"}
+        if conversations.get(device_id) and rng.random() < 0.8:
+            body["conversation_id"] = rng.choice(conversations[device_id])
+        return "POST", "/api/chat", body
+    if name == "GET /api/chat/{device_id}/conversations":
+        return "GET", f"/api/chat/{device_id}/conversations", None
+    if name == "GET /api/diary/{device_id}":
+        return "GET", f"/api/diary/{device_id}", None
+    if name == "GET /api/weather":
+        return "GET", f"/api/weather?lat={rng.uniform(36, 43):.3f}&lon={rng.uniform(-9, 3):.3f}", None
+    raise ValueError(name)
+
+
+async def virtual_user(client, devices, deadline, rng, latencies, errors, conversations):
+    names = [name for name, _ in WORKLOAD]
+    weights = [weight for _, weight in WORKLOAD]
+    while time.perf_counter() < deadline:
+        name = rng.choices(names, weights)[0]
+        device_id = rng.choice(devices)
+        method, url, body = build_request(name, device_id, rng, conversations)
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, json=body)
+            ok = response.status_code < 400
+        except Exception:
+            ok = False
+            response = None
+        latencies[name].append((time.perf_counter() - started) * 1000)
+        if not ok:
+            errors[name] += 1
+        elif name == "POST /api/chat":
+            conversation_id = response.json().get("conversation_id")
+            if conversation_id and conversation_id not in conversations[device_id]:
+                conversations[device_id].append(conversation_id)
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, errors, elapsed):
+    endpoints = {}
+    for name, _ in WORKLOAD:
+        values = sorted(latencies.get(name, []))
+        if not values:
+            continue
+        endpoints[name] = {
+            "requests": len(values),
+            "errors": errors.get(name, 0),
+            "throughput_rps": round(len(values) / elapsed, 2),
+            "mean_ms": round(statistics.mean(values), 3),
+            "p50_ms": round(percentile(values, 0.50), 3),
+            "p95_ms": round(percentile(values, 0.95), 3),
+            "p99_ms": round(percentile(values, 0.99), 3),
+        }
+    total = sum(len(values) for values in latencies.values())
+    return {
+        "duration_s": round(elapsed, 3),
+        "requests": total,
+        "errors": sum(errors.values()),
+        "throughput_rps": round(total / elapsed, 2),
+        "endpoints": endpoints,
+    }
+
+
+async def run(args):
+    server = load_server(args)
+    rng = random.Random(args.seed)
+    devices = [f"load-{i:04d}" for i in range(args.devices)]
+
+    async with server.lifespan(server.app):
+        if args.mongo_url:
+            await server.client.drop_database(args.db_name)
+        await seed(server, devices, args.seed_entries, rng)
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://load-test", timeout=60) as client:
+            latencies = defaultdict(list)
+            errors = defaultdict(int)
+            conversations = defaultdict(list)
+
+            if args.warmup > 0:
+                await asyncio.gather(*(
+                    virtual_user(client, devices, time.perf_counter() + args.warmup,
+                                 random.Random(rng.random()), defaultdict(list), defaultdict(int), conversations)
+                    for _ in range(args.concurrency)
+                ))
+
+            started = time.perf_counter()
+            deadline = started + args.duration
+            await asyncio.gather(*(
+                virtual_user(client, devices, deadline, random.Random(rng.random()), latencies, errors, conversations)
+                for _ in range(args.concurrency)
+            ))
+            elapsed = time.perf_counter() - started
+
+    result = summarize(latencies, errors, elapsed)
+    result["config"] = {
+        "store": "mongod" if args.mongo_url else "in-memory",
+        "concurrency": args.concurrency,
+        "devices": args.devices,
+        "seed_entries": args.seed_entries,
+        "llm_latency_ms": args.llm_latency_ms,
+        "weather_latency_ms": args.weather_latency_ms,
+        "seed": args.seed,
+    }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=20, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=2, help="unmeasured seconds before the run")
+    parser.add_argument("--concurrency", type=int, default=20, help="virtual users")
+    parser.add_argument("--devices", type=int, default=50)
+    parser.add_argument("--seed-entries", type=int, default=100, help="diary entries per device before the run")
+    parser.add_argument("--llm-latency-ms", type=float, default=0)
+    parser.add_argument("--weather-latency-ms", type=float, default=0)
+    parser.add_argument("--mongo-url", help="use a local mongod instead of the in-memory store")
+    parser.add_argument("--db-name", default="agora_load_test")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="also write the JSON result to this file")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    output = json.dumps(result, indent=2)
+    print(output)
+    if args.output:
+        Path(args.output).write_text(output + "\n", encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
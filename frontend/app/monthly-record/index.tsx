@@ -20,7 +20,7 @@ import { colors, spacing, borderRadius, typography } from '../../src/theme/color
 import { useStore } from '../../src/store/useStore';
 import { format, differenceInDays, startOfMonth, endOfMonth, addDays } from 'date-fns';
 import { es, enUS } from 'date-fns/locale';
-import { getMonthlyRecord, saveMonthlyRecord, MonthlyPainRecord } from '../../src/services/api';
+import { getMonthlyRecord, saveMonthlyRecord, saveMonthlyRecordDay, MonthlyPainRecord } from '../../src/services/api';
 
 // Configure calendar locale
 LocaleConfig.locales['es'] = {
@@ -110,10 +110,8 @@ export default function MonthlyRecordScreen() {
         newRecords = [...records, { date: selectedDate, intensity }];
       }
       
-      await saveMonthlyRecord(deviceId, {
-        records: newRecords,
-        cycle_start_date: cycleStartDate.toISOString(),
-      });
+      // Only the changed day is sent; the server updates it in place
+      await saveMonthlyRecordDay(deviceId, selectedDate, { intensity });
       
       setRecords(newRecords);
     } catch (error) {
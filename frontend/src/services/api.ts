@@ -108,6 +108,7 @@ export interface MonthlyPainRecord {
   }>;
   cycle_start_date: string;
   created_at?: string;
+  version?: number;
 }
 
 // API Functions
@@ -167,7 +168,7 @@ export const getConversationMessages = async (deviceId: string, conversationId:
   return response.data;
 };
 
-export const deleteConversation = async (deviceId: string, conversationId: string): Promise<{ message: string; deleted_messages: number }> => {
+export const deleteConversation = async (deviceId: string, conversationId: string): Promise<{ message: string; purge_job_id: string }> => {
   const response = await api.delete(`/chat/${deviceId}/conversation/${conversationId}`);
   return response.data;
 };
@@ -177,7 +178,7 @@ export const getChatHistory = async (deviceId: string, limit = 50): Promise<Chat
   return response.data;
 };
 
-export const clearChatHistory = async (deviceId: string): Promise<{ message: string; deleted_count: number }> => {
+export const clearChatHistory = async (deviceId: string): Promise<{ message: string; purge_job_id: string | null }> => {
   const response = await api.delete(`/chat/${deviceId}/history`);
   return response.data;
 };
@@ -254,6 +255,15 @@ export const saveMonthlyRecord = async (deviceId: string, data: {
   return response.data;
 };
 
+export const saveMonthlyRecordDay = async (deviceId: string, date: string, data: {
+  intensity: number;
+  notes?: string;
+  expected_version?: number;
+}): Promise<{ date: string; record: { date: string; intensity: number; notes?: string } | null; version: number }> => {
+  const response = await api.patch(`/monthly-record/${deviceId}/day/${date}`, data);
+  return response.data;
+};
+
 // Resources
 export interface Resource {
   id: string;
@@ -285,11 +295,58 @@ export const getResources = async (category?: string, language: string = 'es'):
   return response.data;
 };
 
+export const getResource = async (id: string): Promise<Resource> => {
+  const response = await api.get(`/resources/${id}`);
+  return response.data;
+};
+
 export const getResourceCategories = async (language: string = 'es'): Promise<ResourceCategory[]> => {
   const response = await api.get('/resources/categories', { params: { language } });
   return response.data;
 };
 
+// Home screen
+export interface HomeData {
+  device_id: string;
+  subscription: SubscriptionStatus | null;
+  diary: DiaryEntry[] | null;
+  patterns: Patterns | null;
+  conversations: Conversation[] | null;
+  resources: Resource[] | null;
+  errors: Record<string, string>;
+}
+
+export const getHome = async (deviceId: string, language: string = 'es'): Promise<HomeData> => {
+  const response = await api.get(`/home/${deviceId}`, { params: { language } });
+  return response.data;
+};
+
+// Delta sync
+export interface SyncCollectionChanges<T = any> {
+  upserted: T[];
+  deleted: string[];
+}
+
+export interface SyncResponse {
+  device_id: string;
+  token: string;
+  has_more: boolean;
+  // Data was purged since the token was issued: drop local data, then apply as a full download
+  reset: boolean;
+  changes: {
+    diary_entries: SyncCollectionChanges<DiaryEntry>;
+    chat_conversations: SyncCollectionChanges<Conversation & { archived?: boolean }>;
+    chat_messages: SyncCollectionChanges;
+    cycle_entries: SyncCollectionChanges<CycleEntry>;
+    monthly_records: SyncCollectionChanges<MonthlyPainRecord>;
+  };
+}
+
+export const syncChanges = async (deviceId: string, since?: string): Promise<SyncResponse> => {
+  const response = await api.get(`/sync/${deviceId}`, { params: since ? { since } : {} });
+  return response.data;
+};
+
 // Admin
 export const verifyAdminCode = async (deviceId: string, code: string): Promise<{ success: boolean; message: string; is_admin: boolean }> => {
   const response = await api.post('/admin/verify', { device_id: deviceId, code });
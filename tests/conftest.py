@@ -0,0 +1,82 @@
+"""
+Shared fixtures: backend/server.py running in-process on an in-memory,
+Motor-compatible store (mongomock-motor), with no network access.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+STATE_DIR = Path(tempfile.mkdtemp(prefix="agora-tests-"))
+
+# Read by server at import time
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:1")
+os.environ.setdefault("DB_NAME", "agora_tests")
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+os.environ.setdefault("RATE_LIMIT_DB", str(STATE_DIR / "rate_limits.sqlite3"))
+os.environ.setdefault("REPORT_CACHE_DIR", str(STATE_DIR / "report_cache"))
+os.environ.setdefault("PROFILE_DIR", str(STATE_DIR / "profiles"))
+os.environ.setdefault("CHAT_ARCHIVE_INTERVAL_SECONDS", "3600")
+os.environ.setdefault("PURGE_BATCH_PAUSE_SECONDS", "0")
+sys.path.insert(0, str(BACKEND_DIR))
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+from fastapi.testclient import TestClient  # noqa: E402
+
+import server  # noqa: E402
+
+@pytest.fixture
+def client_factory(monkeypatch):
+    """Returns a context manager starting the app on a fresh in-memory database
+    with cleared in-process caches, and waiting for warm-up to finish"""
+    store = mongomock_motor.AsyncMongoMockClient()
+    monkeypatch.setattr(server, "AsyncIOMotorClient", lambda url, **kwargs: store)
+    monkeypatch.setattr(server, "weather_cache", server.WeatherCache(
+        server.WEATHER_GRID_DEGREES, server.WEATHER_CACHE_TTL_SECONDS,
+        server.WEATHER_STALE_SECONDS, server.WEATHER_CACHE_MAX_ENTRIES
+    ))
+    monkeypatch.setattr(server, "weather_breaker", server.CircuitBreaker(
+        "open-meteo", failure_threshold=server.WEATHER_BREAKER_FAILURES,
+        reset_seconds=server.WEATHER_BREAKER_RESET_SECONDS
+    ))
+    for cache in (server.resource_catalog, server.resource_catalog_locks, server.category_catalog,
+                  server.cycle_stats_cache, server.report_renders):
+        cache.clear()
+    shutil.rmtree(server.REPORT_CACHE_DIR, ignore_errors=True)
+    shutil.rmtree(server.PROFILE_DIR, ignore_errors=True)
+
+    @contextmanager
+    def start():
+        with TestClient(server.app) as test_client:
+            deadline = time.monotonic() + 5
+            while not server.app_ready.is_set():
+                assert time.monotonic() < deadline, "warm-up did not finish"
+                time.sleep(0.01)
+            yield test_client
+
+    return start
+
+
+@pytest.fixture
+def client(client_factory):
+    """TestClient on a fresh in-memory database, after warm-up"""
+    with client_factory() as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def run(client):
+    """Run a coroutine function on the app's event loop: run(fn, *args)"""
+    return client.portal.call
+
+
+@pytest.fixture
+def db(client):
+    return server.db
@@ -0,0 +1,99 @@
+"""Cold archive of idle conversations."""
+
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from pymongo.errors import OperationFailure
+
+import server
+
+
+async def insert_idle_conversation(db, device_id, conversation_id, messages=3):
+    idle_since = datetime.utcnow() - timedelta(days=server.CHAT_ARCHIVE_IDLE_DAYS + 1)
+    async with server.sync_write(device_id, messages + 1) as first:
+        await db.chat_conversations.insert_one({
+            "id": conversation_id, "device_id": device_id, "title": "Hola",
+            "created_at": idle_since, "updated_at": idle_since, "sync_seq": first,
+        })
+        await db.chat_messages.insert_many([
+            {"id": f"{conversation_id}-{i}", "device_id": device_id, "conversation_id": conversation_id,
+             "role": "user", "content": f"mensaje {i}", "created_at": idle_since, "sync_seq": first + 1 + i}
+            for i in range(messages)
+        ])
+
+
+def conversations(body):
+    return body["changes"]["chat_conversations"]["upserted"]
+
+
+def test_archive_endpoint_requires_the_admin_code(client):
+    assert client.post("/api/admin/chat-archive").status_code == 403
+    response = client.post("/api/admin/chat-archive", headers={"X-Admin-Code": server.ADMIN_CODE})
+    assert response.status_code == 200
+
+
+def test_archived_conversation_stays_visible_to_sync(client, run, db):
+    run(insert_idle_conversation, db, "dev", "conv")
+    before = client.get("/api/sync/dev").json()
+
+    stats = run(server.archive_idle_conversations)
+
+    assert stats["conversations_archived"] >= 1
+    assert run(db.chat_messages.count_documents, {"conversation_id": "conv"}) == 0
+    delta = client.get("/api/sync/dev", params={"since": before["token"]}).json()
+    assert [(c["id"], c["archived"]) for c in conversations(delta)] == [("conv", True)]
+    assert "messages" not in conversations(delta)[0]
+    full = client.get("/api/sync/dev").json()
+    assert [(c["id"], c.get("archived")) for c in conversations(full)] == [("conv", True)]
+    assert full["changes"]["chat_messages"]["upserted"] == []
+
+
+def test_opening_an_archived_conversation_resends_it_through_sync(client, run, db):
+    run(insert_idle_conversation, db, "dev", "conv")
+    run(server.archive_idle_conversations)
+    token = client.get("/api/sync/dev").json()["token"]
+
+    messages = client.get("/api/chat/dev/conversation/conv").json()
+
+    assert [m["content"] for m in messages] == ["mensaje 0", "mensaje 1", "mensaje 2"]
+    delta = client.get("/api/sync/dev", params={"since": token}).json()
+    assert [(c["id"], c.get("archived")) for c in conversations(delta)] == [("conv", None)]
+    assert len(delta["changes"]["chat_messages"]["upserted"]) == 3
+
+
+class FakeCollection:
+    name = "chat_archive"
+
+    def __init__(self, code):
+        self.code = code
+
+    async def create_index(self, *args, **kwargs):
+        raise OperationFailure("conflict", code=self.code)
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.commands = []
+
+    async def command(self, *args, **kwargs):
+        self.commands.append((args, kwargs))
+
+
+@pytest.mark.parametrize("code", [85, 86])
+def test_ttl_index_with_another_expiry_is_retuned(monkeypatch, code):
+    fake_db = FakeDatabase()
+    monkeypatch.setattr(server, "db", fake_db)
+
+    asyncio.run(server.ensure_ttl_index(FakeCollection(code), "updated_at", 60))
+
+    assert fake_db.commands == [(("collMod", "chat_archive"), {"index": {"name": "updated_at_ttl", "expireAfterSeconds": 60}})]
+
+
+def test_other_index_failures_are_raised(monkeypatch):
+    fake_db = FakeDatabase()
+    monkeypatch.setattr(server, "db", fake_db)
+
+    with pytest.raises(OperationFailure):
+        asyncio.run(server.ensure_ttl_index(FakeCollection(13), "updated_at", 60))
+    assert fake_db.commands == []
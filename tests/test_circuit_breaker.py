@@ -0,0 +1,90 @@
+"""Circuit breaker guarding Open-Meteo."""
+
+import asyncio
+
+import pytest
+
+import server
+
+
+async def fail():
+    raise ConnectionError("upstream down")
+
+
+async def succeed():
+    return "ok"
+
+
+def open_breaker():
+    breaker = server.CircuitBreaker("test", failure_threshold=2, reset_seconds=30)
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            asyncio.run(breaker.call(fail))
+    return breaker
+
+
+def test_opens_after_consecutive_failures_and_fails_fast():
+    breaker = open_breaker()
+
+    assert breaker.state == "open"
+    with pytest.raises(server.CircuitOpenError) as error:
+        asyncio.run(breaker.call(succeed))
+    assert 0 < error.value.retry_after <= 30
+
+
+def test_successful_probe_closes_and_failed_probe_reopens():
+    breaker = open_breaker()
+    breaker.opened_at -= 30
+
+    assert asyncio.run(breaker.call(succeed)) == "ok"
+    assert breaker.state == "closed" and breaker.failures == 0
+
+    breaker = open_breaker()
+    breaker.opened_at -= 30
+    with pytest.raises(ConnectionError):
+        asyncio.run(breaker.call(fail))
+    assert breaker.state == "open" and breaker.retry_after() > 0
+
+
+def test_cancelled_probe_lets_the_next_call_probe():
+    breaker = open_breaker()
+    breaker.opened_at -= 30
+
+    async def cancelled_probe():
+        probe = asyncio.ensure_future(breaker.call(asyncio.sleep, 10))
+        await asyncio.sleep(0)
+        assert breaker.state == "half_open"
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+
+    asyncio.run(cancelled_probe())
+
+    assert breaker.state == "open" and breaker.times_opened == 1
+    assert asyncio.run(breaker.call(succeed)) == "ok"
+    assert breaker.state == "closed"
+
+
+def test_weather_endpoint_serves_stale_then_503_while_open(client, monkeypatch):
+    calls = []
+
+    async def failing_fetch(lat, lon):
+        calls.append((lat, lon))
+        raise ConnectionError("upstream down")
+
+    monkeypatch.setattr(server, "fetch_weather", failing_fetch)
+    cache = server.weather_cache
+    cell = cache.cell(40.4, -3.7)
+    cache.entries[cell] = (server.time.monotonic() - cache.ttl_seconds - 1, {"temperature": 18})
+
+    stale = client.get("/api/weather", params={"lat": 40.4, "lon": -3.7})
+    assert stale.status_code == 200
+    assert stale.json()["cache"]["stale"] is True
+
+    for _ in range(server.weather_breaker.failure_threshold):
+        client.get("/api/weather", params={"lat": 10, "lon": 10})
+    response = client.get("/api/weather", params={"lat": 10, "lon": 10})
+
+    assert server.weather_breaker.state == "open"
+    assert response.status_code == 503
+    assert int(response.headers["Retry-After"]) >= 1
@@ -0,0 +1,56 @@
+"""Versioned content-pack loader."""
+
+import server
+
+ITEM = {
+    "key": "breathing", "category": "breathing", "type": "video", "title": "Respiración",
+    "description": "Respira", "video_url": "https://example.org/v", "author": "Fisio",
+}
+
+
+def make_pack(version=1, items=(ITEM,), **extra):
+    return {"pack": "test-es", "version": version, "language": "es", "resources": list(items), **extra}
+
+
+def resources(run, db):
+    return run(lambda: db.resources.find({}, {"_id": 0}).sort("title", 1).to_list(None))
+
+
+def test_reapplying_an_unchanged_pack_writes_nothing(client, run):
+    assert run(server.apply_content_pack, make_pack())["inserted"] == 1
+    assert run(server.apply_content_pack, make_pack())["skipped"] is True
+
+    report = run(server.apply_content_pack, make_pack(), True)
+
+    assert report["unchanged"] == 1 and not report["inserted"] and not report["deleted"]
+
+
+def test_new_version_updates_and_removes_by_key(client, run, db):
+    extra = {**ITEM, "key": "sleep", "title": "Sueño", "category": "sleep"}
+    run(server.apply_content_pack, make_pack(items=(ITEM, extra)))
+
+    report = run(server.apply_content_pack, make_pack(version=2, items=({**ITEM, "description": "Nueva"},)))
+
+    assert (report["updated"], report["deleted"]) == (1, 1)
+    assert [(r["pack_key"], r["description"]) for r in resources(run, db)] == [("breathing", "Nueva")]
+
+
+def test_legacy_seed_rows_are_retired_only_when_identical(client, run, db):
+    legacy = {k: v for k, v in ITEM.items() if k != "key"}
+    run(db.resources.insert_many, [
+        {**legacy, "id": "legacy", "language": "es"},
+        # Same title, created by an admin
+        {**legacy, "id": "admin", "language": "es", "author": "Otra autora"},
+    ])
+
+    run(server.apply_content_pack, make_pack(replaces_legacy_seed=True))
+
+    assert sorted(r.get("pack_key") or r["id"] for r in resources(run, db)) == ["admin", "breathing"]
+
+
+def test_packs_without_the_flag_leave_legacy_rows(client, run, db):
+    run(db.resources.insert_one, {**{k: v for k, v in ITEM.items() if k != "key"}, "id": "legacy", "language": "es"})
+
+    run(server.apply_content_pack, make_pack())
+
+    assert len(resources(run, db)) == 2
@@ -0,0 +1,109 @@
+"""Diary entries grouped by cycle phase."""
+
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("numpy")
+
+
+def add_cycle(client, start_date, end_date=None):
+    body = {"device_id": "dev", "start_date": start_date}
+    if end_date:
+        body["end_date"] = end_date
+    assert client.post("/api/cycle", json=body).status_code == 200
+
+
+def add_entries(run, db, *entries):
+    """entries: (id, created_at, emotional_state, physical_state)"""
+    run(db.diary_entries.insert_many, [
+        {"id": entry_id, "device_id": "dev", "created_at": created_at,
+         "emotional_state": emotional, "physical_state": physical}
+        for entry_id, created_at, emotional, physical in entries
+    ])
+
+
+def phases(client):
+    response = client.get("/api/cycle/dev/phases", params={"include_entries": True})
+    assert response.status_code == 200
+    return response.json()
+
+
+def by_id(result):
+    return {e["id"]: (e["phase"], e["day_of_cycle"]) for e in result["entries"]}
+
+
+def test_phase_boundaries(client, run, db):
+    # 28-day cycle: period days 1-4, ovulation estimated on day 14
+    add_cycle(client, "2026-01-01", "2026-01-04")
+    add_cycle(client, "2026-01-29")
+    add_entries(run, db, *(
+        (f"day-{day}", datetime(2026, 1, day, 12), {"calma": 3}, None)
+        for day in (1, 4, 5, 12, 13, 15, 16, 28)
+    ))
+
+    result = phases(client)
+
+    assert result["typical_cycle_length"] == 28
+    assert by_id(result) == {
+        "day-1": ("menstrual", 1), "day-4": ("menstrual", 4), "day-5": ("follicular", 5),
+        "day-12": ("follicular", 12), "day-13": ("ovulatory", 13), "day-15": ("ovulatory", 15),
+        "day-16": ("luteal", 16), "day-28": ("luteal", 28),
+    }
+    assert result["entries_unassigned"] == 0
+
+
+def test_missed_log_gaps_are_unassigned_and_left_out_of_the_typical_length(client, run, db):
+    add_cycle(client, "2026-01-01")
+    add_cycle(client, "2026-08-01")
+    add_cycle(client, "2026-08-31")
+    add_entries(run, db, *(
+        (name, created_at, {"calma": 2}, None)
+        for name, created_at in [("january", datetime(2026, 1, 10)), ("march", datetime(2026, 3, 15)),
+                                 ("may", datetime(2026, 5, 20)), ("july", datetime(2026, 7, 10))]
+    ))
+
+    result = phases(client)
+
+    assert result["typical_cycle_length"] == 30
+    assert result["entries_unassigned"] == 3
+    # Inside the gap's first MAX_CYCLE_LENGTH_DAYS, phases follow the typical length
+    assert by_id(result) == {
+        "january": ("follicular", 10), "march": (None, None), "may": (None, None), "july": (None, None)
+    }
+    assert client.get("/api/cycle/dev/stats").json()["cycle_length"]["skipped_gaps"] == 1
+
+
+def test_no_cycles_and_no_entries(client):
+    assert client.get("/api/cycle/dev/phases").json()["phases"] is None
+
+    add_cycle(client, "2026-01-01")
+    result = phases(client)
+
+    assert result["entries_analyzed"] == 0 and result["entries_unassigned"] == 0
+    assert result["typical_cycle_length"] == 28
+    assert all(
+        phase == {"entries": 0, "emotional_averages": None, "physical_averages": None}
+        for phase in result["phases"].values()
+    )
+
+
+def test_physical_averages_skip_entries_without_physical_state(client, run, db):
+    add_cycle(client, "2026-01-01", "2026-01-05")
+    add_entries(
+        run, db,
+        ("with", datetime(2026, 1, 2), {"calma": 4, "fatiga": 2}, {"nivel_dolor": 8, "energia": 2}),
+        ("without", datetime(2026, 1, 3), {"calma": 2}, None),
+        ("luteal", datetime(2026, 1, 20), None, None),
+    )
+
+    result = phases(client)["phases"]
+
+    menstrual = result["menstrual"]
+    assert menstrual["entries"] == 2
+    assert menstrual["emotional_averages"]["calma"] == 3.0
+    assert menstrual["emotional_averages"]["fatiga"] == 1.0
+    assert menstrual["physical_averages"] == {"nivel_dolor": 8.0, "energia": 2.0, "sensibilidad": 0.0}
+    assert result["luteal"]["entries"] == 1
+    assert result["luteal"]["emotional_averages"]["calma"] == 0.0
+    assert result["luteal"]["physical_averages"] is None
@@ -0,0 +1,58 @@
+"""Cycle statistics and their per-worker cache."""
+
+from datetime import datetime
+
+import server
+from tests.test_purge import purge
+
+
+def add_cycle(client, device_id, start_date):
+    assert client.post("/api/cycle", json={"device_id": device_id, "start_date": start_date}).status_code == 200
+
+
+def test_stats_are_cached_until_the_cycles_change(client, monkeypatch):
+    add_cycle(client, "dev", "2026-08-01")
+    add_cycle(client, "dev", "2026-08-29")
+    computed = []
+    compute = server.compute_cycle_stats
+
+    async def counting_compute(device_id):
+        computed.append(device_id)
+        return await compute(device_id)
+
+    monkeypatch.setattr(server, "compute_cycle_stats", counting_compute)
+
+    first = client.get("/api/cycle/dev/stats").json()
+    assert client.get("/api/cycle/dev/stats").json() == first
+    assert computed == ["dev"]
+    assert first["cycles"] == 2 and first["cycle_length"]["mean"] == 28
+
+
+def test_writes_from_another_worker_invalidate_the_cache(client, run, db):
+    add_cycle(client, "dev", "2026-08-01")
+    assert client.get("/api/cycle/dev/stats").json()["cycles"] == 1
+
+    # Another worker's write never touches this worker's cache dict
+    async def write_elsewhere():
+        async with server.sync_write("dev") as sync_seq:
+            await db.cycle_entries.insert_one({
+                **server.CycleEntry(device_id="dev", start_date=datetime(2026, 8, 30)).model_dump(),
+                **server.sync_fields(sync_seq)
+            })
+
+    run(write_elsewhere)
+    assert "dev" in server.cycle_stats_cache
+
+    stats = client.get("/api/cycle/dev/stats").json()
+    assert stats["cycles"] == 2
+    assert stats["cycle_length"]["mean"] == 29
+
+
+def test_purge_clears_cached_stats(client):
+    add_cycle(client, "dev", "2026-08-01")
+    assert client.get("/api/cycle/dev/stats").json()["cycles"] == 1
+
+    purge(client, "dev")
+
+    assert "dev" not in server.cycle_stats_cache
+    assert client.get("/api/cycle/dev/stats").json()["cycles"] == 0
@@ -0,0 +1,48 @@
+"""Home screen payload: concurrent sections with partial results."""
+
+import asyncio
+import time
+
+from fastapi import HTTPException
+
+import server
+
+
+def test_all_sections_load(client):
+    client.post("/api/diary", json={"device_id": "dev", "texto": "hola"})
+
+    body = client.get("/api/home/dev").json()
+
+    assert body["errors"] == {}
+    assert body["subscription"]["status"] == "trial"
+    assert [entry["texto"] for entry in body["diary"]] == ["hola"]
+    assert body["conversations"] == [] and body["resources"] == []
+
+
+def test_slow_and_failing_sections_come_back_null_with_their_reason(client, monkeypatch):
+    client.post("/api/diary", json={"device_id": "dev", "texto": "hola"})
+    monkeypatch.setattr(server, "HOME_SECTION_TIMEOUT_SECONDS", 0.05)
+
+    async def slow_patterns(device_id, days):
+        await asyncio.sleep(5)
+
+    async def broken_conversations(device_id, limit):
+        raise RuntimeError("connection reset")
+
+    async def missing_subscription(device_id):
+        raise HTTPException(status_code=404, detail="Subscription not found")
+
+    monkeypatch.setattr(server, "get_patterns", slow_patterns)
+    monkeypatch.setattr(server, "get_conversations", broken_conversations)
+    monkeypatch.setattr(server, "get_subscription_status_internal", missing_subscription)
+
+    started = time.monotonic()
+    response = client.get("/api/home/dev")
+
+    assert time.monotonic() - started < 2
+    assert response.status_code == 200
+    body = response.json()
+    assert body["errors"] == {"patterns": "timeout", "conversations": "error", "subscription": "Subscription not found"}
+    assert body["patterns"] is None and body["conversations"] is None and body["subscription"] is None
+    assert [entry["texto"] for entry in body["diary"]] == ["hola"]
+    assert body["resources"] == []
@@ -0,0 +1,32 @@
+"""Prometheus metrics endpoint."""
+
+
+def requests_total(client, route, status):
+    prefix = f'http_requests_total{{method="POST",route="{route}",status="{status}"}} '
+    for line in client.get("/api/metrics").text.splitlines():
+        if line.startswith(prefix):
+            return int(line[len(prefix):])
+    return 0
+
+
+def test_validation_errors_are_counted_as_422(client):
+    before = requests_total(client, "/api/diary", 422)
+
+    response = client.post("/api/diary", json={"texto": "missing device_id"})
+
+    assert response.status_code == 422
+    assert requests_total(client, "/api/diary", 422) == before + 1
+    assert requests_total(client, "/api/diary", 500) == 0
+
+
+def test_successful_requests_are_counted_with_their_status(client):
+    before = requests_total(client, "/api/diary", 200)
+    client.post("/api/diary", json={"device_id": "dev", "texto": "hola"})
+    assert requests_total(client, "/api/diary", 200) == before + 1
+
+
+def test_latency_histogram_is_exposed(client):
+    client.get("/api/health")
+    text = client.get("/api/metrics").text
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/api/health",le="+Inf"}' in text
+    assert "mongodb_command_duration_seconds" in text
@@ -0,0 +1,70 @@
+"""Per-day updates of the monthly pain record."""
+
+import asyncio
+from datetime import datetime
+
+import server
+
+
+def test_concurrent_patches_of_different_days_all_land(client, run, db):
+    days = [f"2026-10-{day:02d}" for day in range(1, 11)]
+
+    async def patch_all():
+        return await asyncio.gather(*(
+            server.save_monthly_record_day("dev", server.MonthlyPainDayUpdate(intensity=i % 5 + 1), day=day)
+            for i, day in enumerate(days)
+        ))
+
+    run(patch_all)
+
+    records = run(lambda: db.monthly_records.find({"device_id": "dev"}).to_list(None))
+    assert len(records) == 1
+    assert sorted(day["date"] for day in records[0]["records"]) == days
+    assert records[0]["version"] == 10
+
+
+def test_patch_created_record_gets_an_id(client, run, db):
+    client.patch("/api/monthly-record/dev/day/2026-10-03", json={"intensity": 2})
+
+    record = run(db.monthly_records.find_one, {"device_id": "dev"})
+
+    assert record["id"]
+    assert client.get("/api/monthly-record/dev/history").json()["cycles"][0]["id"] == record["id"]
+
+
+def test_patch_updates_a_day_in_place_and_clears_it(client):
+    client.patch("/api/monthly-record/dev/day/2026-10-03", json={"intensity": 2, "notes": "leve"})
+    client.patch("/api/monthly-record/dev/day/2026-10-03", json={"intensity": 4})
+    assert client.get("/api/monthly-record/dev").json()["records"] == [
+        {"date": "2026-10-03", "intensity": 4, "notes": "leve"}
+    ]
+
+    client.patch("/api/monthly-record/dev/day/2026-10-03", json={"intensity": 0})
+    assert client.get("/api/monthly-record/dev").json()["records"] == []
+
+
+def test_stale_expected_version_is_rejected(client):
+    client.patch("/api/monthly-record/dev/day/2026-10-03", json={"intensity": 2})
+
+    response = client.patch("/api/monthly-record/dev/day/2026-10-04", json={"intensity": 3, "expected_version": 0})
+
+    assert response.status_code == 409
+    assert response.json()["detail"]["current_version"] == 1
+
+
+def test_duplicate_records_are_removed_before_the_unique_index(client, run, db):
+    run(db.monthly_records.drop_index, "device_id_1")
+    run(db.monthly_records.insert_many, [
+        {"device_id": "dev", "records": [], "updated_at": datetime(2026, 10, 1)},
+        {"device_id": "dev", "records": [{"date": "2026-10-02", "intensity": 3}], "updated_at": datetime(2026, 10, 2)},
+        {"device_id": "other", "records": [], "updated_at": datetime(2026, 10, 1)},
+    ])
+
+    run(server.create_indexes)
+
+    records = run(lambda: db.monthly_records.find({}, {"_id": 0, "device_id": 1, "records": 1}).to_list(None))
+    assert sorted(records, key=lambda r: r["device_id"]) == [
+        {"device_id": "dev", "records": [{"date": "2026-10-02", "intensity": 3}]},
+        {"device_id": "other", "records": []},
+    ]
+    assert run(db.monthly_records.index_information)["device_id_1"]["unique"] is True
@@ -0,0 +1,51 @@
+"""Cached monthly report downloads."""
+
+import server
+
+
+def save_record(client, records, cycle_start="2026-10-01T00:00:00"):
+    response = client.post("/api/monthly-record/dev", json={"records": records, "cycle_start_date": cycle_start})
+    assert response.status_code == 200
+
+
+def cached_reports():
+    return sorted(path.name for path in server.REPORT_CACHE_DIR.glob(f"{server.report_device_key('dev')}-*"))
+
+
+def test_new_cycle_does_not_reuse_the_previous_cycles_report(client):
+    save_record(client, [{"date": "2026-10-02", "intensity": 3}])
+    old = client.get("/api/monthly-record/dev/report", params={"format": "csv"})
+    client.delete("/api/monthly-record/dev")
+
+    save_record(client, [{"date": "2026-11-05", "intensity": 1}], cycle_start="2026-11-01T00:00:00")
+    new = client.get("/api/monthly-record/dev/report", params={"format": "csv"},
+                     headers={"If-None-Match": old.headers["etag"]})
+
+    assert new.status_code == 200
+    assert new.headers["etag"] != old.headers["etag"]
+    assert "2026-11-05" in new.text and "2026-10-02" not in new.text
+
+
+def test_deleting_the_record_removes_its_cached_reports(client):
+    save_record(client, [{"date": "2026-10-02", "intensity": 3}])
+    client.get("/api/monthly-record/dev/report", params={"format": "csv"})
+    client.get("/api/monthly-record/dev/report", params={"format": "pdf"})
+    assert len(cached_reports()) == 2
+
+    client.delete("/api/monthly-record/dev")
+
+    assert cached_reports() == []
+    assert client.get("/api/monthly-record/dev/report").status_code == 404
+
+
+def test_conditional_and_range_requests(client):
+    save_record(client, [{"date": "2026-10-02", "intensity": 3, "notes": "migraña"}])
+    full = client.get("/api/monthly-record/dev/report", params={"format": "pdf"})
+    assert full.content.startswith(b"%PDF")
+
+    etag = full.headers["etag"]
+    assert client.get("/api/monthly-record/dev/report", headers={"If-None-Match": etag}).status_code == 304
+
+    partial = client.get("/api/monthly-record/dev/report", headers={"Range": "bytes=0-7"})
+    assert partial.status_code == 206
+    assert partial.content == full.content[:8]
@@ -0,0 +1,51 @@
+"""Compact archive of past pain cycles."""
+
+from datetime import datetime
+
+import server
+
+
+def test_compact_cycle_drops_days_outside_the_window():
+    record = {
+        "device_id": "dev",
+        "cycle_start_date": datetime(2026, 10, 1),
+        "records": [
+            {"date": "2026-09-30", "intensity": 5},
+            {"date": "2026-10-01", "intensity": 2, "notes": "regla"},
+            {"date": "2026-10-31", "intensity": 4},
+            {"date": "9999-01-01", "intensity": 3},
+        ],
+    }
+
+    cycle = server.compact_pain_cycle(record)
+
+    assert len(cycle["intensities"]) == 31
+    assert cycle["intensities"][0] == 2 and cycle["intensities"][30] == 4
+    assert sum(1 for value in cycle["intensities"] if value) == 2
+    assert cycle["notes"] == {"0": "regla"}
+
+
+def test_far_future_date_keeps_history_small(client):
+    client.post("/api/monthly-record/dev", json={
+        "records": [{"date": "9999-01-01", "intensity": 3}, {"date": "2026-10-02", "intensity": 1}],
+        "cycle_start_date": "2026-10-01T00:00:00",
+    })
+
+    cycles = client.get("/api/monthly-record/dev/history").json()["cycles"]
+
+    assert len(cycles[0]["intensities"]) == server.PAIN_CYCLE_DAYS
+
+
+def test_saving_a_new_cycle_start_archives_the_previous_cycle(client):
+    first = {"records": [{"date": "2026-10-02", "intensity": 4}], "cycle_start_date": "2026-10-01T08:30:00.123Z"}
+    assert client.post("/api/monthly-record/dev", json=first).json()["archived_id"] is None
+    # Same start date again is an ordinary save
+    assert client.post("/api/monthly-record/dev", json=first).json()["archived_id"] is None
+
+    saved = client.post("/api/monthly-record/dev", json={"records": [], "cycle_start_date": "2026-11-01T09:00:00.000Z"})
+
+    assert saved.json()["archived_id"]
+    assert saved.json()["version"] == 3
+    history = client.get("/api/monthly-record/dev/history").json()
+    assert [cycle["intensities"][1] for cycle in history["cycles"]] == [4]
+    assert history["cycles"][0]["cycle_start_date"].startswith("2026-10-01")
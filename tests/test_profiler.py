@@ -0,0 +1,61 @@
+"""On-demand request profiler and its admin endpoints."""
+
+import asyncio
+
+import server
+
+ADMIN = {"X-Admin-Code": server.ADMIN_CODE}
+
+
+def test_profile_is_recorded_and_served_to_admins(client):
+    response = client.get("/api/health", headers={server.PROFILE_HEADER: server.ADMIN_CODE})
+    profile_id = response.headers["X-Profile-Id"]
+
+    listing = client.get("/api/admin/profiles", headers=ADMIN).json()
+    assert [meta["id"] for meta in listing["profiles"]] == [profile_id]
+    assert listing["profiles"][0]["route"] == "/api/health"
+
+    folded = client.get(f"/api/admin/profiles/{profile_id}", headers=ADMIN)
+    assert folded.status_code == 200
+    assert folded.headers["content-type"].startswith("text/plain")
+
+
+def test_profiles_require_the_admin_code(client):
+    profile_id = client.get("/api/health", headers={server.PROFILE_HEADER: server.ADMIN_CODE}).headers["X-Profile-Id"]
+
+    for headers in ({}, {"X-Admin-Code": "wrong"}):
+        assert client.get("/api/admin/profiles", headers=headers).status_code == 403
+        assert client.get(f"/api/admin/profiles/{profile_id}", headers=headers).status_code == 403
+
+
+def test_wrong_debug_code_is_not_profiled(client):
+    response = client.get("/api/health", headers={server.PROFILE_HEADER: "guess"})
+    assert "X-Profile-Id" not in response.headers
+
+
+def test_unprofiled_requests_pass_straight_through():
+    calls = []
+
+    async def app(scope, receive, send):
+        calls.append((receive, send))
+
+    async def receive():
+        pass
+
+    async def send(message):
+        pass
+
+    scope = {"type": "http", "method": "GET", "path": "/api/health", "headers": []}
+    asyncio.run(server.RequestProfilerMiddleware(app)(scope, receive, send))
+
+    assert calls == [(receive, send)]
+
+
+def test_failed_profiled_request_releases_its_slot(client):
+    response = client.get("/api/nowhere", headers={server.PROFILE_HEADER: server.ADMIN_CODE})
+
+    assert response.status_code == 404
+    assert "X-Profile-Id" in response.headers
+    assert server.profiles_in_flight == 0
+    routes = [meta["route"] for meta in client.get("/api/admin/profiles", headers=ADMIN).json()["profiles"]]
+    assert routes == ["/api/nowhere"]
@@ -0,0 +1,135 @@
+"""Background purge of a device's data."""
+
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+import server
+
+
+def wait_for_purge(client, job_id):
+    deadline = time.monotonic() + 5
+    while True:
+        job = client.get(f"/api/purge/{job_id}").json()
+        if job["status"] in ("completed", "failed"):
+            return job
+        assert time.monotonic() < deadline, job
+        time.sleep(0.01)
+
+
+def purge(client, device_id, **body):
+    response = client.post("/api/purge", json={"device_id": device_id, **body})
+    assert response.status_code == 202
+    return wait_for_purge(client, response.json()["id"])
+
+
+def test_device_purge_removes_only_that_devices_data(client, run, db):
+    for device_id in ("dev", "other"):
+        client.post("/api/diary", json={"device_id": device_id, "texto": "hola"})
+        client.post("/api/cycle", json={"device_id": device_id, "start_date": "2026-10-01"})
+        client.post("/api/monthly-record/" + device_id, json={
+            "records": [{"date": "2026-10-02", "intensity": 2}], "cycle_start_date": "2026-10-01T00:00:00"
+        })
+
+    job = purge(client, "dev")
+
+    assert job["status"] == "completed"
+    assert job["deleted"]["diary_entries"] == 1
+    for name in server.PURGE_DEVICE_COLLECTIONS:
+        assert run(db[name].count_documents, {"device_id": "dev"}) == 0, name
+    assert run(db.diary_entries.count_documents, {"device_id": "other"}) == 1
+
+
+def test_purge_removes_cached_reports(client):
+    client.post("/api/monthly-record/dev", json={
+        "records": [{"date": "2026-10-02", "intensity": 2}], "cycle_start_date": "2026-10-01T00:00:00"
+    })
+    client.get("/api/monthly-record/dev/report", params={"format": "csv"})
+    device_key = server.report_device_key("dev")
+    assert list(server.REPORT_CACHE_DIR.glob(f"{device_key}-*"))
+
+    purge(client, "dev")
+
+    assert not list(server.REPORT_CACHE_DIR.glob(f"{device_key}-*"))
+
+
+def test_reused_device_id_sends_old_tokens_a_reset(client):
+    client.post("/api/diary", json={"device_id": "dev", "texto": "before"})
+    client.post("/api/diary", json={"device_id": "dev", "texto": "before again"})
+    old_token = client.get("/api/sync/dev").json()["token"]
+
+    purge(client, "dev")
+    after = client.post("/api/diary", json={"device_id": "dev", "texto": "after"}).json()
+
+    body = client.get("/api/sync/dev", params={"since": old_token}).json()
+    assert body["reset"] is True
+    assert [doc["id"] for doc in body["changes"]["diary_entries"]["upserted"]] == [after["id"]]
+    assert server.parse_sync_token(body["token"])[1] > server.parse_sync_token(old_token)[1]
+
+    follow_up = client.get("/api/sync/dev", params={"since": body["token"]}).json()
+    assert follow_up["reset"] is False
+    assert follow_up["changes"]["diary_entries"]["upserted"] == []
+
+
+def test_conversation_purge_keeps_other_conversations(client, run, db):
+    run(db.chat_messages.insert_many, [
+        {"device_id": "dev", "conversation_id": "a", "role": "user", "content": "uno"},
+        {"device_id": "dev", "conversation_id": "b", "role": "user", "content": "dos"},
+    ])
+
+    job = purge(client, "dev", conversation_id="a")
+
+    assert job["deleted"]["chat_messages"] == 1
+    assert [m["conversation_id"] for m in run(lambda: db.chat_messages.find().to_list(None))] == ["b"]
+
+
+def test_job_cancelled_mid_collection_is_taken_over_and_finishes(client, run, db, monkeypatch):
+    for i in range(3):
+        client.post("/api/diary", json={"device_id": "dev", "texto": f"entrada {i}"})
+    monkeypatch.setattr(server, "PURGE_BATCH_SIZE", 1)
+    monkeypatch.setattr(server, "PURGE_BATCH_PAUSE_SECONDS", 60)
+    job_id = client.post("/api/purge", json={"device_id": "dev"}).json()["id"]
+
+    deadline = time.monotonic() + 5
+    while client.get(f"/api/purge/{job_id}").json()["deleted"].get("diary_entries") != 1:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+    async def shut_down_worker():
+        task = next(t for t in server.background_tasks if t.get_coro().__name__ == "run_purge_job")
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    run(shut_down_worker)
+    assert client.get(f"/api/purge/{job_id}").json()["status"] == "running"
+
+    # A restarted worker takes the job over once it has gone stale
+    monkeypatch.setattr(server, "PURGE_WORKER_ID", "restarted")
+    monkeypatch.setattr(server, "PURGE_BATCH_PAUSE_SECONDS", 0)
+    assert run(server.resume_purge_jobs) == 0
+    run(db.purge_jobs.update_one, {"id": job_id}, {"$set": {"updated_at": datetime.utcnow() - timedelta(hours=1)}})
+    assert run(server.resume_purge_jobs) == 1
+
+    job = wait_for_purge(client, job_id)
+    assert job["status"] == "completed"
+    assert job["owner"] == "restarted"
+    assert job["deleted"]["diary_entries"] == 3
+    assert job["completed_collections"] == list(server.PURGE_DEVICE_COLLECTIONS)
+    assert run(db.diary_entries.count_documents, {"device_id": "dev"}) == 0
+
+
+def test_job_leased_by_another_live_worker_is_not_run_twice(client, run, db):
+    client.post("/api/diary", json={"device_id": "dev", "texto": "hola"})
+    now = datetime.utcnow()
+    run(db.purge_jobs.insert_one, {
+        "id": "leased", "device_id": "dev", "conversation_id": None, "status": "running", "owner": "elsewhere",
+        "deleted": {}, "completed_collections": [], "current_collection": None, "error": None,
+        "created_at": now, "updated_at": now, "finished_at": None,
+    })
+
+    run(server.run_purge_job, "leased")
+    assert run(server.resume_purge_jobs) == 0
+
+    job = client.get("/api/purge/leased").json()
+    assert (job["status"], job["owner"], job["deleted"]) == ("running", "elsewhere", {})
+    assert run(db.diary_entries.count_documents, {"device_id": "dev"}) == 1
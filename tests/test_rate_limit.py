@@ -0,0 +1,69 @@
+"""Per-device token buckets in the shared SQLite store."""
+
+import sqlite3
+
+import pytest
+
+import server
+
+
+@pytest.fixture
+def store_path(tmp_path):
+    return str(tmp_path / "buckets.sqlite3")
+
+
+def test_bucket_is_shared_between_store_instances(store_path):
+    # One store per worker process, all on the same file
+    first, second = server.TokenBucketStore(store_path), server.TokenBucketStore(store_path)
+    try:
+        assert first.take("dev|GET /api/x", capacity=2, per_second=2 / 60) == 0
+        assert second.take("dev|GET /api/x", capacity=2, per_second=2 / 60) == 0
+        assert first.take("dev|GET /api/x", capacity=2, per_second=2 / 60) > 0
+        assert second.take("dev|GET /api/x", capacity=2, per_second=2 / 60) > 0
+        assert second.take("other|GET /api/x", capacity=2, per_second=2 / 60) == 0
+    finally:
+        first.close()
+        second.close()
+
+
+def test_idle_buckets_are_evicted(store_path):
+    store = server.TokenBucketStore(store_path)
+    try:
+        store.take("dev|GET /api/x", capacity=1, per_second=1)
+        assert store.evict_idle(3600) == 0
+        assert store.evict_idle(-1) == 1
+    finally:
+        store.close()
+
+
+@pytest.fixture
+def limited(monkeypatch, store_path):
+    store = server.TokenBucketStore(store_path, lock_timeout=0.01)
+    monkeypatch.setattr(server, "RATE_LIMIT_ENABLED", True)
+    monkeypatch.setattr(server, "RATE_LIMITS_PER_MINUTE", {"POST /api/diary": 2})
+    monkeypatch.setattr(server, "rate_limiter", store)
+    yield store
+    store.close()
+
+
+def test_requests_over_the_limit_get_429(limited, client):
+    statuses = [client.post("/api/diary", json={"device_id": "dev", "texto": "hola"}).status_code for _ in range(3)]
+
+    assert statuses == [200, 200, 429]
+    assert client.post("/api/diary", json={"device_id": "dev2", "texto": "hola"}).status_code == 200
+
+
+def test_locked_store_fails_open_and_is_counted(limited, client, store_path):
+    limited.take("warm|GET /api/x", 1, 1)  # creates the table
+    blocker = sqlite3.connect(store_path, isolation_level=None)
+    blocker.execute("BEGIN EXCLUSIVE")
+    before = server.rate_limit_counters["fail_open"]
+    try:
+        response = client.post("/api/diary", json={"device_id": "dev", "texto": "hola"})
+    finally:
+        blocker.execute("ROLLBACK")
+        blocker.close()
+
+    assert response.status_code == 200
+    assert server.rate_limit_counters["fail_open"] == before + 1
+    assert f"rate_limit_fail_open_total {before + 1}" in client.get("/api/metrics").text
@@ -0,0 +1,74 @@
+"""BM25 search over the resource catalog."""
+
+import pytest
+
+import server
+
+pytest.importorskip("numpy")
+
+
+def item(title, description="", content="", category="breathing"):
+    return {"title": title, "description": description, "content": content, "category": category}
+
+
+def ranked_titles(items, query, language="es", category=None):
+    index = server.ResourceSearchIndex(items, language)
+    return [items[i]["title"] for i, _ in index.search(query, 10, category)]
+
+
+def test_spanish_accents_and_inflections_match():
+    assert server.search_term_counts("Respiración", "es") == server.search_term_counts("respiracion", "es")
+    assert server.search_term_counts("estiramientos", "es") == server.search_term_counts("Estiramiento", "es")
+    assert ranked_titles([item("Técnicas de relajación")], "tecnica relajacion") == ["Técnicas de relajación"]
+
+
+def test_stopwords_alone_match_nothing():
+    assert ranked_titles([item("La respiración para el dolor")], "para el la") == []
+
+
+def test_title_matches_outrank_description_matches():
+    items = [
+        item("Dormir mejor", description="Consejos de respiración antes de dormir"),
+        item("Respiración consciente", description="Ejercicio guiado"),
+    ]
+    assert ranked_titles(items, "respiración") == ["Respiración consciente", "Dormir mejor"]
+
+
+def test_rarer_terms_weigh_more():
+    items = [
+        item("Dolor y fatiga"),
+        item("Dolor lumbar"),
+        item("Dolor cervical y fatiga"),
+        item("Migraña y dolor"),
+    ]
+    assert ranked_titles(items, "dolor migraña")[0] == "Migraña y dolor"
+
+
+def test_shorter_documents_win_on_equal_matches():
+    items = [
+        item("Meditación", description="Una práctica larga con muchas palabras sobre calma, sueño y descanso profundo"),
+        item("Meditación", description="Práctica breve"),
+    ]
+    index = server.ResourceSearchIndex(items, "es")
+    assert [i for i, _ in index.search("meditacion", 10)] == [1, 0]
+
+
+def test_category_filter_and_english_stemming():
+    items = [item("Stretching routines", category="stretching"), item("Stretches for sleep", category="sleep")]
+    assert ranked_titles(items, "stretch", "en") == ["Stretching routines", "Stretches for sleep"]
+    assert ranked_titles(items, "stretch", "en", category="sleep") == ["Stretches for sleep"]
+
+
+def test_search_endpoint_sees_new_resources_immediately(client):
+    client.post("/api/resources/seed")
+    assert client.get("/api/resources/search", params={"q": "respiracion"}).json()[0]["category"] == "breathing"
+    assert client.get("/api/resources/search", params={"q": "acupuntura"}).json() == []
+
+    created = client.post("/api/resources", json={
+        "category": "professional", "type": "article", "title": "Acupuntura y dolor crónico",
+        "description": "Lo que dice la evidencia", "content": "Sesiones de acupuntura", "language": "es",
+    }).json()
+
+    results = client.get("/api/resources/search", params={"q": "acupuntura"}).json()
+    assert [r["id"] for r in results] == [created["id"]]
+    assert "content" not in results[0]
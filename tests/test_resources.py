@@ -0,0 +1,94 @@
+"""Resource catalog snapshots: ETags, sparse fieldsets, detail and category counts."""
+
+import server
+
+ARTICLE = {
+    "category": "professional", "type": "article", "title": "Hablar con tu médica",
+    "description": "Cómo preparar la consulta", "content": "Lleva tu diario a la cita", "language": "es",
+}
+
+
+class NoDatabase:
+    def __getattr__(self, name):
+        raise AssertionError(f"unexpected database access: {name}")
+
+
+def create(client, **overrides):
+    response = client.post("/api/resources", json={**ARTICLE, **overrides})
+    assert response.status_code == 200
+    return response.json()["id"]
+
+
+def category_counts(client):
+    return {c["id"]: c["count"] for c in client.get("/api/resources/categories").json()}
+
+
+def test_matching_etag_gets_304_without_touching_the_database(client, monkeypatch):
+    client.post("/api/resources/seed")
+    first = client.get("/api/resources")
+    etag = first.headers["etag"]
+    assert first.status_code == 200 and len(first.json()) == 6
+    assert first.headers["cache-control"] == f"public, max-age={server.RESOURCE_CACHE_MAX_AGE}"
+
+    with monkeypatch.context() as patched:
+        patched.setattr(server, "db", NoDatabase())
+        cached = client.get("/api/resources", headers={"If-None-Match": etag})
+        assert client.get("/api/resources", params={"category": "sleep"}, headers={"If-None-Match": etag}).status_code == 200
+
+    assert cached.status_code == 304
+    assert cached.content == b""
+    assert cached.headers["etag"] == etag
+
+
+def test_create_rebuilds_the_snapshot_and_changes_the_etag(client):
+    client.post("/api/resources/seed")
+    etag = client.get("/api/resources").headers["etag"]
+
+    resource_id = create(client)
+
+    response = client.get("/api/resources", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+    assert resource_id in [r["id"] for r in response.json()]
+
+
+def test_list_omits_content_unless_requested(client):
+    resource_id = create(client)
+
+    default = client.get("/api/resources").json()[0]
+    assert set(default) == set(server.RESOURCE_LIST_FIELDS)
+
+    sparse = client.get("/api/resources", params={"fields": "title, content"})
+    assert sparse.json() == [{"id": resource_id, "title": ARTICLE["title"], "content": ARTICLE["content"]}]
+    assert sparse.headers["etag"] != client.get("/api/resources").headers["etag"]
+
+    invalid = client.get("/api/resources", params={"fields": "title,password"})
+    assert invalid.status_code == 400
+    assert invalid.json()["detail"] == "Unknown fields: password"
+
+
+def test_detail_includes_content_and_supports_etags(client):
+    resource_id = create(client)
+
+    response = client.get(f"/api/resources/{resource_id}")
+    assert response.status_code == 200
+    assert response.json()["content"] == ARTICLE["content"]
+    assert client.get(f"/api/resources/{resource_id}",
+                      headers={"If-None-Match": response.headers["etag"]}).status_code == 304
+    assert client.get("/api/resources/missing").status_code == 404
+
+
+def test_category_counts_follow_seed_and_create(client):
+    client.post("/api/resources/seed")
+    seeded = category_counts(client)
+    assert seeded == {c: 1 for c in ("breathing", "stretching", "mindfulness", "sleep", "professional", "nutrition")}
+    etag = client.get("/api/resources/categories").headers["etag"]
+
+    create(client)
+    create(client, category="pelvic_floor")
+
+    assert category_counts(client) == {**seeded, "professional": 2, "pelvic_floor": 1}
+    assert client.get("/api/resources/categories", headers={"If-None-Match": etag}).status_code == 200
+    # Reseeding without changes leaves the materialized counts alone
+    client.post("/api/resources/seed")
+    assert category_counts(client)["professional"] == 2
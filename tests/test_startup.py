@@ -0,0 +1,73 @@
+"""
+Cold-start check for the backend module.
+
+Imports backend/server.py in a fresh interpreter with `-X importtime` and
+verifies that the heavy SDKs are deferred until first use and that the
+import stays within a time budget (SERVER_IMPORT_BUDGET_MS, default 2000);
+and that warm-up keeps retrying until the database is reachable.
+Run with: python -m pytest tests/test_startup.py -s
+"""
+
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+DEFERRED_MODULES = ["emergentintegrations", "stripe", "httpx", "numpy"]
+IMPORT_BUDGET_MS = float(os.environ.get("SERVER_IMPORT_BUDGET_MS", "2000"))
+
+
+def import_server():
+    """Import server in a subprocess; return {top-level module: cumulative us}"""
+    env = dict(os.environ, MONGO_URL="mongodb://localhost:1", DB_NAME="startup_test")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import server"],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, timeout=60
+    )
+    assert result.returncode == 0, result.stderr[-2000:]
+
+    timings = {}
+    for line in result.stderr.splitlines():
+        # "import time: self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        timings[name.strip()] = int(cumulative)
+    return timings
+
+
+def test_server_import_defers_heavy_sdks():
+    timings = import_server()
+    loaded = [name for name in DEFERRED_MODULES if name in timings]
+    assert not loaded, f"imported at module load: {loaded}"
+
+
+def test_server_import_time():
+    timings = import_server()
+    import_ms = timings["server"] / 1000
+    print(f"\nimport server: {import_ms:.1f} ms cumulative")
+    assert import_ms < IMPORT_BUDGET_MS, f"import server took {import_ms:.0f} ms, budget {IMPORT_BUDGET_MS:.0f} ms"
+
+
+def test_warm_up_retries_until_the_database_is_ready(monkeypatch, client_factory):
+    import server
+
+    attempts = []
+    create_indexes = server.create_indexes
+
+    async def flaky_create_indexes():
+        attempts.append(time.monotonic())
+        if len(attempts) < 3:
+            raise ConnectionError("mongo not reachable yet")
+        await create_indexes()
+
+    monkeypatch.setattr(server, "create_indexes", flaky_create_indexes)
+    monkeypatch.setattr(server, "WARM_UP_RETRY_SECONDS", 0.01)
+
+    with client_factory() as client:
+        assert client.get("/api/ready").status_code == 200
+        assert len(attempts) == 3
+        running = {task.get_coro().__name__ for task in server.background_tasks if not task.done()}
+        assert {"run_trial_sweeper", "run_rate_limit_evictor", "run_chat_archiver", "run_purge_resumer"} <= running
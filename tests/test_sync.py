@@ -0,0 +1,113 @@
+"""Delta sync: change tokens, writes in flight and tombstones."""
+
+from datetime import datetime, timedelta
+
+import server
+
+
+def diary_doc(device_id, entry_id, sync_seq):
+    return {"id": entry_id, "device_id": device_id, "texto": entry_id, "created_at": datetime.utcnow(),
+            **server.sync_fields(sync_seq)}
+
+
+def upserted_ids(body, collection="diary_entries"):
+    return [doc["id"] for doc in body["changes"][collection]["upserted"]]
+
+
+def test_token_stays_below_a_write_in_flight(client, run, db):
+    first = client.post("/api/diary", json={"device_id": "dev", "texto": "first"}).json()
+
+    async def interleave():
+        # A slow write takes its number, a quick one takes the next and lands first
+        async with server.sync_write("dev") as slow_seq:
+            async with server.sync_write("dev") as quick_seq:
+                await db.diary_entries.insert_one(diary_doc("dev", "quick", quick_seq))
+            during = await server.sync_changes("dev")
+            await db.diary_entries.insert_one(diary_doc("dev", "slow", slow_seq))
+        after = await server.sync_changes("dev", since=during["token"])
+        return during, after
+
+    during, after = run(interleave)
+
+    assert upserted_ids(during) == [first["id"]]
+    assert sorted(upserted_ids(after)) == ["quick", "slow"]
+    assert int(after["token"]) > int(during["token"])
+
+
+def test_failed_write_releases_its_reservation(client, run, db):
+    async def failing_write():
+        try:
+            async with server.sync_write("dev"):
+                raise RuntimeError("write failed")
+        except RuntimeError:
+            pass
+        return await server.sync_watermark("dev")
+
+    assert run(failing_write) == (0, 1)
+    assert run(db.sync_counters.find_one, {"device_id": "dev"})["pending"] == []
+
+
+def test_abandoned_reservation_stops_holding_back_the_token(client, run, db):
+    stale = datetime.utcnow() - timedelta(seconds=server.SYNC_RESERVATION_TIMEOUT_SECONDS + 1)
+    run(db.sync_counters.insert_one, {"device_id": "dev", "seq": 5, "pending": [{"seq": 3, "at": stale}]})
+
+    assert run(server.sync_watermark, "dev") == (0, 5)
+    assert run(db.sync_counters.find_one, {"device_id": "dev"})["pending"] == []
+
+
+def test_deletes_are_sent_as_tombstones(client):
+    client.post("/api/monthly-record/dev", json={"records": [], "cycle_start_date": "2026-10-01T00:00:00"})
+    full = client.get("/api/sync/dev").json()
+    assert [doc["device_id"] for doc in full["changes"]["monthly_records"]["upserted"]] == ["dev"]
+
+    client.delete("/api/monthly-record/dev")
+    delta = client.get("/api/sync/dev", params={"since": full["token"]}).json()
+
+    assert delta["changes"]["monthly_records"] == {"upserted": [], "deleted": ["dev"]}
+    assert client.get("/api/sync/dev", params={"since": delta["token"]}).json()["changes"]["monthly_records"] == {
+        "upserted": [], "deleted": []
+    }
+
+
+def test_tombstones_get_distinct_numbers_across_pages(client, run, monkeypatch):
+    monkeypatch.setattr(server, "SYNC_PAGE_SIZE", 3)
+    run(server.record_tombstones, "dev", "diary_entries", [f"gone-{i}" for i in range(7)])
+
+    deleted, token, has_more = [], None, True
+    while has_more:
+        body = client.get("/api/sync/dev", params={"since": token} if token else {}).json()
+        deleted += body["changes"]["diary_entries"]["deleted"]
+        token, has_more = body["token"], body["has_more"]
+
+    assert deleted == [f"gone-{i}" for i in range(7)]
+
+
+def test_invalid_token_is_rejected(client):
+    assert client.get("/api/sync/dev", params={"since": "abc"}).status_code == 400
+
+
+def test_paging_moves_past_more_documents_than_a_page_on_one_number(client, run, db, monkeypatch):
+    monkeypatch.setattr(server, "SYNC_PAGE_SIZE", 2)
+    client.post("/api/diary", json={"device_id": "dev", "texto": "before"})
+
+    async def shared_number():
+        # As written by batch stamps before each document got its own number
+        async with server.sync_write("dev") as sync_seq:
+            await db.diary_entries.insert_many([diary_doc("dev", f"shared-{i}", sync_seq) for i in range(3)])
+
+    run(shared_number)
+    client.post("/api/diary", json={"device_id": "dev", "texto": "after"})
+
+    received, token, calls = [], None, 0
+    while True:
+        body = client.get("/api/sync/dev", params={"since": token} if token else {}).json()
+        calls += 1
+        assert calls <= 5, body
+        assert token is None or int(body["token"]) > int(token)
+        received += upserted_ids(body)
+        token = body["token"]
+        if not body["has_more"]:
+            break
+
+    assert sorted(received[1:4]) == ["shared-0", "shared-1", "shared-2"]
+    assert len(set(received)) == 5
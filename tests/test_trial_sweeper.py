@@ -0,0 +1,50 @@
+"""Trial expiry: the sweeper persists it, the status endpoint only reads it."""
+
+import server
+
+
+def test_sweeper_expires_exhausted_trials_only(client, run, db):
+    limit = server.TRIAL_LIMIT_SECONDS
+    run(db.subscriptions.insert_many, [
+        {"device_id": "exhausted", "status": "trial", "usage_seconds": limit},
+        {"device_id": "fresh", "status": "trial", "usage_seconds": 10},
+        {"device_id": "admin", "status": "trial", "usage_seconds": limit * 2, "is_admin": True},
+    ])
+
+    stats = run(server.sweep_expired_trials)
+
+    assert stats["last_expired"] == 1
+    statuses = {sub["device_id"]: sub["status"] for sub in run(lambda: db.subscriptions.find().to_list(None))}
+    assert statuses == {"exhausted": "expired", "fresh": "trial", "admin": "trial"}
+
+
+def test_sweeper_expires_exhausted_trials_without_a_status(client, run, db):
+    limit = server.TRIAL_LIMIT_SECONDS
+    run(db.subscriptions.insert_many, [
+        {"device_id": "legacy", "usage_seconds": limit},
+        {"device_id": "customer", "status": None, "stripe_customer_id": "cus_1", "usage_seconds": limit + 1},
+        {"device_id": "legacy-fresh", "usage_seconds": 10},
+        {"device_id": "active", "status": "active", "usage_seconds": limit},
+    ])
+
+    assert run(server.sweep_expired_trials)["last_expired"] == 2
+
+    statuses = {sub["device_id"]: sub.get("status") for sub in run(lambda: db.subscriptions.find().to_list(None))}
+    assert statuses == {"legacy": "expired", "customer": "expired", "legacy-fresh": None, "active": "active"}
+
+
+def test_status_reports_exhausted_trial_without_writing(client, run, db):
+    run(db.subscriptions.insert_one,
+        {"device_id": "dev", "status": "trial", "usage_seconds": server.TRIAL_LIMIT_SECONDS})
+
+    response = client.get("/api/subscription/dev")
+
+    assert response.status_code == 200
+    assert response.json()["status"] == "expired"
+    assert run(db.subscriptions.find_one, {"device_id": "dev"})["status"] == "trial"
+
+
+def test_new_device_starts_a_trial(client):
+    body = client.get("/api/subscription/new-device").json()
+    assert body["status"] == "trial"
+    assert body["trial_remaining_seconds"] == server.TRIAL_LIMIT_SECONDS
@@ -0,0 +1,57 @@
+"""Historical weather backfill for diary entries."""
+
+from datetime import datetime
+
+import server
+
+HOURLY = {
+    "temperature_2m": [10 + hour for hour in range(24)],
+    "relative_humidity_2m": [60] * 24,
+    "weather_code": [61] * 24,
+    "pressure_msl": [1012] * 24,
+}
+
+
+def test_backfill_requires_the_admin_code(client):
+    assert client.post("/api/admin/weather-backfill").status_code == 403
+    assert client.post("/api/admin/weather-backfill", headers={"X-Admin-Code": "wrong"}).status_code == 403
+
+
+def test_backfill_batches_locations_per_day_and_stamps_for_sync(client, run, db, monkeypatch):
+    requests = []
+
+    async def fake_historical(day, cells):
+        requests.append((day, cells))
+        return [HOURLY for _ in cells]
+
+    monkeypatch.setattr(server, "fetch_historical_weather", fake_historical)
+    monkeypatch.setattr(server, "WEATHER_BACKFILL_REQUEST_INTERVAL", 0)
+    run(db.diary_entries.insert_many, [
+        {"id": "a", "device_id": "dev", "weather": None, "location": {"lat": 40.4, "lon": -3.7},
+         "created_at": datetime(2026, 3, 1, 8)},
+        {"id": "b", "device_id": "dev", "weather": None, "location": {"lat": 41.4, "lon": 2.2},
+         "created_at": datetime(2026, 3, 1, 20)},
+        {"id": "c", "device_id": "other", "weather": None, "location": None, "created_at": datetime(2026, 3, 1)},
+    ])
+    token = client.get("/api/sync/dev").json()["token"]
+
+    stats = run(server.backfill_diary_weather, 100)
+
+    assert len(requests) == 1 and len(requests[0][1]) == 2
+    assert stats["entries_updated"] == 2
+    weather = {e["id"]: e["weather"] for e in run(lambda: db.diary_entries.find().to_list(None))}
+    assert weather["a"]["temperature"] == 18 and weather["b"]["temperature"] == 30
+    assert weather["a"]["condition"] == "rain" and weather["c"] is None
+
+    synced = client.get("/api/sync/dev", params={"since": token}).json()
+    upserted = synced["changes"]["diary_entries"]["upserted"]
+    assert sorted(doc["id"] for doc in upserted) == ["a", "b"]
+    # Each entry gets its own change number, so sync pages never stall on one
+    assert len({doc["sync_seq"] for doc in upserted}) == 2
+
+
+def test_admin_can_start_the_backfill(client):
+    response = client.post("/api/admin/weather-backfill", params={"max_entries": 10},
+                           headers={"X-Admin-Code": server.ADMIN_CODE})
+    assert response.status_code == 200
+    assert response.json()["started"] is True
@@ -0,0 +1,99 @@
+"""Grid-snapped LRU cache in front of Open-Meteo."""
+
+import asyncio
+
+import server
+
+
+def make_cache(max_entries=10):
+    return server.WeatherCache(grid_degrees=0.1, ttl_seconds=900, stale_seconds=3600, max_entries=max_entries)
+
+
+class Upstream:
+    """Counts calls per cell; each call waits a loop turn, like a real request"""
+
+    def __init__(self):
+        self.calls = []
+
+    async def __call__(self, lat, lon):
+        self.calls.append((lat, lon))
+        await asyncio.sleep(0.01)
+        return {"temperature": 20, "cell": [lat, lon]}
+
+
+def test_concurrent_misses_for_one_cell_share_one_fetch():
+    cache, upstream = make_cache(), Upstream()
+
+    async def burst():
+        return await asyncio.gather(*(cache.get(40.4168, -3.7038, upstream) for _ in range(10)))
+
+    results = asyncio.run(burst())
+
+    assert upstream.calls == [(40.4, -3.7)]
+    assert all(weather == results[0][0] for weather, _, _ in results)
+    stats = cache.stats()
+    assert (stats["misses"], stats["coalesced"], stats["hits"]) == (1, 9, 0)
+    assert cache.inflight == {}
+
+
+def test_nearby_coordinates_hit_the_same_entry():
+    cache, upstream = make_cache(), Upstream()
+
+    async def lookups():
+        first = await cache.get(40.4168, -3.7038, upstream)
+        second = await cache.get(40.38, -3.66, upstream)
+        elsewhere = await cache.get(41.3874, 2.1686, upstream)
+        return first, second, elsewhere
+
+    first, second, elsewhere = asyncio.run(lookups())
+
+    assert cache.cell(40.4168, -3.7038) == cache.cell(40.38, -3.66) == (40.4, -3.7)
+    assert second[0] is first[0] and second[2] is False
+    assert upstream.calls == [(40.4, -3.7), (41.4, 2.2)]
+    assert elsewhere[0]["cell"] == [41.4, 2.2]
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache, upstream = make_cache(max_entries=2), Upstream()
+
+    async def lookups():
+        await cache.get(40.0, -3.0, upstream)
+        await cache.get(41.0, 2.0, upstream)
+        await cache.get(40.0, -3.0, upstream)  # refreshes the first cell
+        await cache.get(39.0, -0.4, upstream)
+
+    asyncio.run(lookups())
+
+    assert list(cache.entries) == [(40.0, -3.0), (39.0, -0.4)]
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["entries"] == 2
+
+
+def test_hit_rate_counts_hits_and_coalesced_lookups():
+    cache, upstream = make_cache(), Upstream()
+
+    async def lookups():
+        await asyncio.gather(cache.get(40.0, -3.0, upstream), cache.get(40.0, -3.0, upstream))
+        await cache.get(40.0, -3.0, upstream)
+        await cache.get(41.0, 2.0, upstream)
+
+    assert make_cache().stats()["hit_rate"] == 0.0
+    asyncio.run(lookups())
+
+    stats = cache.stats()
+    assert (stats["misses"], stats["coalesced"], stats["hits"]) == (2, 1, 1)
+    assert stats["hit_rate"] == 0.5
+
+
+def test_cache_stats_endpoint(client, monkeypatch):
+    upstream = Upstream()
+    monkeypatch.setattr(server, "fetch_weather", upstream)
+
+    for lat, lon in [(40.4168, -3.7038), (40.42, -3.70), (40.41, -3.71)]:
+        assert client.get("/api/weather", params={"lat": lat, "lon": lon}).status_code == 200
+
+    stats = client.get("/api/weather/cache-stats").json()
+    assert len(upstream.calls) == 1
+    assert (stats["entries"], stats["misses"], stats["hits"]) == (1, 1, 2)
+    assert stats["hit_rate"] == round(2 / 3, 4)
+    assert stats["circuit_breaker"]["state"] == "closed"